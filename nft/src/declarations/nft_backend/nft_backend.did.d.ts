@@ -13,6 +13,9 @@ export interface ApprovalInfo {
   'expires_at' : [] | [bigint],
   'spender' : Account,
 }
+export type ApprovalSweepResult = { 'Ok' : ApprovalSweepStats } |
+  { 'Err' : GenericError };
+export interface ApprovalSweepStats { 'queued' : bigint, 'reclaimed' : bigint }
 export interface ApproveCollectionArg { 'approval_info' : ApprovalInfo }
 export type ApproveCollectionError = { 'GenericError' : GenericError } |
   { 'CreatedInFuture' : CreatedInFutureError } |
@@ -32,17 +35,39 @@ export type ApproveTokenError = { 'GenericError' : GenericError } |
   { 'TooOld' : null };
 export type ApproveTokenResult = { 'Ok' : bigint } |
   { 'Err' : ApproveTokenError };
+export interface AuditStats {
+  'records_written' : bigint,
+  'mode' : string,
+  'records_seen' : bigint,
+  'bytes_written' : bigint,
+  'sample_rate' : bigint,
+  'journal_entries' : bigint,
+  'sampled_entries' : bigint,
+}
 export interface CollectionApproval { 'approval_info' : ApprovalInfo }
 export interface CreatedInFutureError { 'ledger_time' : bigint }
 export interface DuplicateError { 'duplicate_of' : bigint }
 export interface GenericError { 'message' : string, 'error_code' : bigint }
+export interface GetTransactionsResponse {
+  'log_length' : bigint,
+  'transactions' : Array<TransactionRecord>,
+}
 export interface InitArg {
   'supply_cap' : [] | [bigint],
+  'audit_mode' : [] | [string],
   'name' : string,
   'test' : [] | [boolean],
   'description' : [] | [string],
+  'audit_sample_rate' : [] | [bigint],
+  'batch_instruction_budget' : [] | [bigint],
   'symbol' : string,
 }
+export interface MetadataCacheStats {
+  'hits' : bigint,
+  'misses' : bigint,
+  'size' : bigint,
+  'capacity' : bigint,
+}
 export type MetadataValue = { 'Int' : bigint } |
   { 'Nat' : bigint } |
   { 'Blob' : Uint8Array | number[] } |
@@ -52,7 +77,11 @@ export interface MintArg {
   'owner' : Account,
   'metadata' : [] | [Array<[string, MetadataValue]>],
 }
+export interface MintBatchReceipt { 'minted' : bigint, 'queued' : bigint }
+export type MintBatchResult = { 'Ok' : MintBatchReceipt } |
+  { 'Err' : MintError };
 export type MintError = { 'GenericError' : GenericError } |
+  { 'GenericBatchError' : GenericError } |
   { 'SupplyCapReached' : null } |
   { 'Unauthorized' : null } |
   { 'TokenIdAlreadyExists' : null };
@@ -105,6 +134,11 @@ export interface TransactionRecord {
   'from_principal' : string,
   'timestamp' : bigint,
 }
+export interface TokenInfo {
+  'token_id' : bigint,
+  'owner' : Account,
+  'metadata' : Array<[string, MetadataValue]>,
+}
 export interface TransferArg {
   'to' : Account,
   'token_id' : bigint,
@@ -141,7 +175,22 @@ export type TransferFromResult = { 'Ok' : bigint } |
 export type TransferResult = { 'Ok' : bigint } |
   { 'Err' : TransferError };
 export interface _SERVICE {
-  'get_transactions' : ActorMethod<[bigint, bigint], Array<TransactionRecord>>,
+  'get_account_nft_transactions' : ActorMethod<
+    [Account, [] | [bigint], [] | [bigint]],
+    Array<TransactionRecord>
+  >,
+  'get_approval_sweep_stats' : ActorMethod<[], ApprovalSweepStats>,
+  'get_audit_stats' : ActorMethod<[], AuditStats>,
+  'get_metadata_cache_stats' : ActorMethod<[], MetadataCacheStats>,
+  'get_token_history' : ActorMethod<
+    [bigint, [] | [bigint], [] | [bigint]],
+    Array<TransactionRecord>
+  >,
+  'get_tokens_page' : ActorMethod<
+    [[] | [bigint], [] | [bigint]],
+    Array<TokenInfo>
+  >,
+  'get_transactions' : ActorMethod<[bigint, bigint], GetTransactionsResponse>,
   'icrc37_approve_collection' : ActorMethod<
     [Array<ApproveCollectionArg>],
     Array<[] | [ApproveCollectionResult]>
@@ -178,13 +227,15 @@ export interface _SERVICE {
   'icrc7_collection_metadata' : ActorMethod<[], Array<[string, MetadataValue]>>,
   'icrc7_description' : ActorMethod<[], [] | [string]>,
   'icrc7_name' : ActorMethod<[], string>,
-  'icrc7_owner_of' : ActorMethod<[bigint], [] | [Account]>,
+  'icrc7_max_query_batch_size' : ActorMethod<[], [] | [bigint]>,
+  'icrc7_max_update_batch_size' : ActorMethod<[], [] | [bigint]>,
+  'icrc7_owner_of' : ActorMethod<[Array<bigint>], Array<[] | [Account]>>,
   'icrc7_supply_cap' : ActorMethod<[], [] | [bigint]>,
   'icrc7_supported_standards' : ActorMethod<[], Array<StandardRecord>>,
   'icrc7_symbol' : ActorMethod<[], string>,
   'icrc7_token_metadata' : ActorMethod<
-    [bigint],
-    [] | [Array<[string, MetadataValue]>]
+    [Array<bigint>],
+    Array<[] | [Array<[string, MetadataValue]>]>
   >,
   'icrc7_tokens' : ActorMethod<[[] | [bigint], [] | [bigint]], Array<bigint>>,
   'icrc7_tokens_of' : ActorMethod<
@@ -198,6 +249,16 @@ export interface _SERVICE {
   >,
   'is_test_mode' : ActorMethod<[], boolean>,
   'mint' : ActorMethod<[MintArg], MintResult>,
+  'mint_batch' : ActorMethod<[Array<MintArg>], MintBatchResult>,
+  'mint_range' : ActorMethod<
+    [bigint, bigint, Account, [] | [Array<[string, MetadataValue]>]],
+    MintBatchResult
+  >,
+  'query_tokens_by_trait' : ActorMethod<
+    [Array<[string, MetadataValue]>, [] | [bigint], [] | [bigint]],
+    Array<TokenInfo>
+  >,
+  'sweep_expired_approvals' : ActorMethod<[], ApprovalSweepResult>,
 }
 export declare const idlFactory: IDL.InterfaceFactory;
 export declare const init: (args: { IDL: typeof IDL }) => IDL.Type[];
@@ -1,11 +1,48 @@
 export const idlFactory = ({ IDL }) => {
   const InitArg = IDL.Record({
     'supply_cap' : IDL.Opt(IDL.Nat),
+    'audit_mode' : IDL.Opt(IDL.Text),
     'name' : IDL.Text,
     'test' : IDL.Opt(IDL.Bool),
     'description' : IDL.Opt(IDL.Text),
+    'audit_sample_rate' : IDL.Opt(IDL.Nat),
+    'batch_instruction_budget' : IDL.Opt(IDL.Nat64),
     'symbol' : IDL.Text,
   });
+  const ApprovalSweepStats = IDL.Record({
+    'queued' : IDL.Nat,
+    'reclaimed' : IDL.Nat,
+  });
+  const AuditStats = IDL.Record({
+    'records_written' : IDL.Nat,
+    'mode' : IDL.Text,
+    'records_seen' : IDL.Nat,
+    'bytes_written' : IDL.Nat,
+    'sample_rate' : IDL.Nat,
+    'journal_entries' : IDL.Nat,
+    'sampled_entries' : IDL.Nat,
+  });
+  const MetadataCacheStats = IDL.Record({
+    'hits' : IDL.Nat,
+    'misses' : IDL.Nat,
+    'size' : IDL.Nat,
+    'capacity' : IDL.Nat,
+  });
+  const Account = IDL.Record({
+    'owner' : IDL.Principal,
+    'subaccount' : IDL.Opt(IDL.Vec(IDL.Nat8)),
+  });
+  const MetadataValue = IDL.Variant({
+    'Int' : IDL.Int,
+    'Nat' : IDL.Nat,
+    'Blob' : IDL.Vec(IDL.Nat8),
+    'Text' : IDL.Text,
+  });
+  const TokenInfo = IDL.Record({
+    'token_id' : IDL.Nat,
+    'owner' : Account,
+    'metadata' : IDL.Vec(IDL.Tuple(IDL.Text, MetadataValue)),
+  });
   const TransactionRecord = IDL.Record({
     'id' : IDL.Nat,
     'to_principal' : IDL.Text,
@@ -19,9 +56,9 @@ export const idlFactory = ({ IDL }) => {
     'from_principal' : IDL.Text,
     'timestamp' : IDL.Nat64,
   });
-  const Account = IDL.Record({
-    'owner' : IDL.Principal,
-    'subaccount' : IDL.Opt(IDL.Vec(IDL.Nat8)),
+  const GetTransactionsResponse = IDL.Record({
+    'log_length' : IDL.Nat,
+    'transactions' : IDL.Vec(TransactionRecord),
   });
   const ApprovalInfo = IDL.Record({
     'memo' : IDL.Opt(IDL.Vec(IDL.Nat8)),
@@ -35,6 +72,10 @@ export const idlFactory = ({ IDL }) => {
     'message' : IDL.Text,
     'error_code' : IDL.Nat,
   });
+  const ApprovalSweepResult = IDL.Variant({
+    'Ok' : ApprovalSweepStats,
+    'Err' : GenericError,
+  });
   const CreatedInFutureError = IDL.Record({ 'ledger_time' : IDL.Nat64 });
   const ApproveCollectionError = IDL.Variant({
     'GenericError' : GenericError,
@@ -127,12 +168,6 @@ export const idlFactory = ({ IDL }) => {
     'Ok' : IDL.Nat,
     'Err' : TransferFromError,
   });
-  const MetadataValue = IDL.Variant({
-    'Int' : IDL.Int,
-    'Nat' : IDL.Nat,
-    'Blob' : IDL.Vec(IDL.Nat8),
-    'Text' : IDL.Text,
-  });
   const StandardRecord = IDL.Record({ 'url' : IDL.Text, 'name' : IDL.Text });
   const TransferArg = IDL.Record({
     'to' : Account,
@@ -159,15 +194,39 @@ export const idlFactory = ({ IDL }) => {
   });
   const MintError = IDL.Variant({
     'GenericError' : GenericError,
+    'GenericBatchError' : GenericError,
     'SupplyCapReached' : IDL.Null,
     'Unauthorized' : IDL.Null,
     'TokenIdAlreadyExists' : IDL.Null,
   });
   const MintResult = IDL.Variant({ 'Ok' : IDL.Nat, 'Err' : MintError });
+  const MintBatchReceipt = IDL.Record({ 'minted' : IDL.Nat, 'queued' : IDL.Nat });
+  const MintBatchResult = IDL.Variant({
+    'Ok' : MintBatchReceipt,
+    'Err' : MintError,
+  });
   return IDL.Service({
+    'get_account_nft_transactions' : IDL.Func(
+        [Account, IDL.Opt(IDL.Nat), IDL.Opt(IDL.Nat)],
+        [IDL.Vec(TransactionRecord)],
+        ['query'],
+      ),
+    'get_approval_sweep_stats' : IDL.Func([], [ApprovalSweepStats], ['query']),
+    'get_audit_stats' : IDL.Func([], [AuditStats], ['query']),
+    'get_metadata_cache_stats' : IDL.Func([], [MetadataCacheStats], ['query']),
+    'get_token_history' : IDL.Func(
+        [IDL.Nat, IDL.Opt(IDL.Nat), IDL.Opt(IDL.Nat)],
+        [IDL.Vec(TransactionRecord)],
+        ['query'],
+      ),
+    'get_tokens_page' : IDL.Func(
+        [IDL.Opt(IDL.Nat), IDL.Opt(IDL.Nat)],
+        [IDL.Vec(TokenInfo)],
+        ['query'],
+      ),
     'get_transactions' : IDL.Func(
         [IDL.Nat, IDL.Nat],
-        [IDL.Vec(TransactionRecord)],
+        [GetTransactionsResponse],
         ['query'],
       ),
     'icrc37_approve_collection' : IDL.Func(
@@ -218,7 +277,13 @@ export const idlFactory = ({ IDL }) => {
       ),
     'icrc7_description' : IDL.Func([], [IDL.Opt(IDL.Text)], ['query']),
     'icrc7_name' : IDL.Func([], [IDL.Text], ['query']),
-    'icrc7_owner_of' : IDL.Func([IDL.Nat], [IDL.Opt(Account)], ['query']),
+    'icrc7_max_query_batch_size' : IDL.Func([], [IDL.Opt(IDL.Nat)], ['query']),
+    'icrc7_max_update_batch_size' : IDL.Func([], [IDL.Opt(IDL.Nat)], ['query']),
+    'icrc7_owner_of' : IDL.Func(
+        [IDL.Vec(IDL.Nat)],
+        [IDL.Vec(IDL.Opt(Account))],
+        ['query'],
+      ),
     'icrc7_supply_cap' : IDL.Func([], [IDL.Opt(IDL.Nat)], ['query']),
     'icrc7_supported_standards' : IDL.Func(
         [],
@@ -227,8 +292,8 @@ export const idlFactory = ({ IDL }) => {
       ),
     'icrc7_symbol' : IDL.Func([], [IDL.Text], ['query']),
     'icrc7_token_metadata' : IDL.Func(
-        [IDL.Nat],
-        [IDL.Opt(IDL.Vec(IDL.Tuple(IDL.Text, MetadataValue)))],
+        [IDL.Vec(IDL.Nat)],
+        [IDL.Vec(IDL.Opt(IDL.Vec(IDL.Tuple(IDL.Text, MetadataValue))))],
         ['query'],
       ),
     'icrc7_tokens' : IDL.Func(
@@ -249,14 +314,38 @@ export const idlFactory = ({ IDL }) => {
       ),
     'is_test_mode' : IDL.Func([], [IDL.Bool], ['query']),
     'mint' : IDL.Func([MintArg], [MintResult], []),
+    'mint_batch' : IDL.Func([IDL.Vec(MintArg)], [MintBatchResult], []),
+    'mint_range' : IDL.Func(
+        [
+          IDL.Nat,
+          IDL.Nat,
+          Account,
+          IDL.Opt(IDL.Vec(IDL.Tuple(IDL.Text, MetadataValue))),
+        ],
+        [MintBatchResult],
+        [],
+      ),
+    'query_tokens_by_trait' : IDL.Func(
+        [
+          IDL.Vec(IDL.Tuple(IDL.Text, MetadataValue)),
+          IDL.Opt(IDL.Nat),
+          IDL.Opt(IDL.Nat),
+        ],
+        [IDL.Vec(TokenInfo)],
+        ['query'],
+      ),
+    'sweep_expired_approvals' : IDL.Func([], [ApprovalSweepResult], []),
   });
 };
 export const init = ({ IDL }) => {
   const InitArg = IDL.Record({
     'supply_cap' : IDL.Opt(IDL.Nat),
+    'audit_mode' : IDL.Opt(IDL.Text),
     'name' : IDL.Text,
     'test' : IDL.Opt(IDL.Bool),
     'description' : IDL.Opt(IDL.Text),
+    'audit_sample_rate' : IDL.Opt(IDL.Nat),
+    'batch_instruction_budget' : IDL.Opt(IDL.Nat64),
     'symbol' : IDL.Text,
   });
   return [InitArg];
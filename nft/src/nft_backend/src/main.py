@@ -8,6 +8,9 @@ ICRC-7: https://github.com/dfinity/ICRC/blob/main/ICRCs/ICRC-7/ICRC-7.md
 ICRC-37: https://github.com/dfinity/ICRC/blob/main/ICRCs/ICRC-37/ICRC-37.md
 """
 
+import json
+import zlib
+
 from kybra import (
     Alias,
     Async,
@@ -20,6 +23,8 @@ from kybra import (
     blob,
     null,
     Opt,
+    post_upgrade,
+    pre_upgrade,
     Principal,
     query,
     Record,
@@ -31,14 +36,389 @@ from kybra import (
     void,
     ic,
 )
-from kybra_simple_db import Database, Entity, Integer, String
+from kybra_simple_db import Database, Entity, Integer, Storage, String
 from kybra_simple_logging import get_logger
 
+
+# AuditSink and OrderedIndex are kept identical in the token and NFT canisters on
+# purpose: each canister is built from its own src directory, so there is no shared
+# module both can import. Change the two copies together.
+
+
+class AuditSink(Storage):
+    """
+    Audit storage handed to kybra_simple_db. What happens to each audit record
+    depends on the mode:
+
+    - off: dropped, only counted
+    - sampled (default): one record in sample_rate is kept as the original JSON
+      in samples; a record longer than MAX_SAMPLE_BYTES is journaled instead
+    - journal: every record is appended to journal as op (1 byte) + time in ns
+      (8 bytes) + entity key, without the entity data
+
+    The database still JSON-encodes each record before handing it over, so
+    "off" saves the storage writes but not that CPU cost. The counters live on
+    the heap; the canister saves them in pre_upgrade and restores them on load.
+    """
+
+    MODES = ("off", "sampled", "journal")
+    OPS = {"save": 1, "delete": 2, "update": 3}
+    MAX_KEY_BYTES = 200  # Entity keys, as bounded by the storage map
+    MAX_JOURNAL_ENTRY_BYTES = 1 + 8 + MAX_KEY_BYTES
+    MAX_SAMPLE_BYTES = 4096
+
+    def __init__(self, journal, samples):
+        self.journal = journal
+        self.samples = samples
+        self.mode = "sampled"
+        self.sample_rate = 100
+        self.records_seen = 0
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def configure(self, mode: str, sample_rate: int = None):
+        if mode not in AuditSink.MODES:
+            raise ValueError(
+                f"Unknown audit mode '{mode}', expected one of {AuditSink.MODES}"
+            )
+        if sample_rate is not None:
+            if sample_rate < 1:
+                raise ValueError("Audit sample rate must be at least 1")
+            self.sample_rate = sample_rate
+        self.mode = mode
+
+    def _encode_journal_entry(self, record: str) -> bytes:
+        # record is json.dumps([op, timestamp, key, data]) from Database._audit
+        op, _, key, _ = json.loads(record)
+        return (
+            bytes([AuditSink.OPS.get(op, 0)])
+            + ic.time().to_bytes(8, "big")
+            + key.encode()[: AuditSink.MAX_KEY_BYTES]
+        )
+
+    def _append(self, store, entry: bytes):
+        store.insert(store.len(), entry)
+        self.records_written += 1
+        self.bytes_written += len(entry)
+
+    def get(self, key):
+        if key == "_max_id":
+            return str(self.records_seen)
+        return None
+
+    def insert(self, key, value):
+        if key in ("_min_id", "_max_id"):
+            return
+        self.records_seen += 1
+
+        if self.mode == "off":
+            return
+        if self.mode == "sampled":
+            if self.records_seen % self.sample_rate:
+                return
+            sample = value.encode()
+            if len(sample) <= AuditSink.MAX_SAMPLE_BYTES:
+                self._append(self.samples, sample)
+                return
+        self._append(self.journal, self._encode_journal_entry(value))
+
+    def remove(self, key):
+        pass
+
+    def items(self):
+        return iter([])
+
+    def keys(self):
+        return iter([])
+
+    def __contains__(self, key):
+        return False
+
+
+# Kept identical to the token canister's copy, see the note above AuditSink
+class OrderedIndex:
+    """
+    Ordered set of text members persisted in a StableBTreeMap.
+
+    StableBTreeMap only offers point lookups, so members are kept in a treap
+    (priority = crc32 of the member) whose nodes are stored under
+    "{namespace}/{member}". Add/discard cost O(log n) lookups, and an in-order
+    read of `limit` members after any position costs O(log n + limit).
+    Members are compared as plain strings and must not contain "|".
+    """
+
+    def __init__(self, storage, namespace: str):
+        self.storage = storage
+        self.namespace = namespace
+
+    def _get_meta(self):
+        meta = self.storage.get(self.namespace)
+        if not meta:
+            return "", 0
+        root, count = meta.split("|")
+        return root, int(count)
+
+    def _set_meta(self, root: str, count: int):
+        self.storage.insert(self.namespace, f"{root}|{count}")
+
+    def _get_node(self, member: str):
+        prio, left, right = self.storage.get(f"{self.namespace}/{member}").split("|")
+        return int(prio), left, right
+
+    def _set_node(self, member: str, prio: int, left: str, right: str):
+        self.storage.insert(f"{self.namespace}/{member}", f"{prio}|{left}|{right}")
+
+    def _insert(self, node: str, member: str) -> str:
+        if not node:
+            self._set_node(member, zlib.crc32(member.encode()), "", "")
+            return member
+
+        prio, left, right = self._get_node(node)
+        if member < node:
+            child = self._insert(left, member)
+            child_prio, child_left, child_right = self._get_node(child)
+            if child_prio > prio:
+                # Rotate right: child becomes the subtree root
+                self._set_node(node, prio, child_right, right)
+                self._set_node(child, child_prio, child_left, node)
+                return child
+            if child != left:
+                self._set_node(node, prio, child, right)
+        else:
+            child = self._insert(right, member)
+            child_prio, child_left, child_right = self._get_node(child)
+            if child_prio > prio:
+                # Rotate left: child becomes the subtree root
+                self._set_node(node, prio, left, child_left)
+                self._set_node(child, child_prio, node, child_right)
+                return child
+            if child != right:
+                self._set_node(node, prio, left, child)
+        return node
+
+    def _merge(self, left: str, right: str) -> str:
+        """Merge two subtrees where every member of left sorts before right."""
+        if not left:
+            return right
+        if not right:
+            return left
+        left_prio, left_left, left_right = self._get_node(left)
+        right_prio, right_left, right_right = self._get_node(right)
+        if left_prio > right_prio:
+            self._set_node(left, left_prio, left_left, self._merge(left_right, right))
+            return left
+        self._set_node(right, right_prio, self._merge(left, right_left), right_right)
+        return right
+
+    def _delete(self, node: str, member: str) -> str:
+        prio, left, right = self._get_node(node)
+        if member == node:
+            self.storage.remove(f"{self.namespace}/{member}")
+            return self._merge(left, right)
+        if member < node:
+            child = self._delete(left, member)
+            if child != left:
+                self._set_node(node, prio, child, right)
+        else:
+            child = self._delete(right, member)
+            if child != right:
+                self._set_node(node, prio, left, child)
+        return node
+
+    def contains(self, member: str) -> bool:
+        return self.storage.contains_key(f"{self.namespace}/{member}")
+
+    def count(self) -> int:
+        return self._get_meta()[1]
+
+    def add(self, member: str) -> bool:
+        if self.contains(member):
+            return False
+        root, count = self._get_meta()
+        self._set_meta(self._insert(root, member), count + 1)
+        return True
+
+    def discard(self, member: str) -> bool:
+        if not self.contains(member):
+            return False
+        root, count = self._get_meta()
+        self._set_meta(self._delete(root, member), count - 1)
+        return True
+
+    def items(self, after: str = None, limit: int = 100) -> list:
+        """Up to limit members in ascending order, strictly after `after`."""
+        members = []
+        stack = []
+        node = self._get_meta()[0]
+        while node:
+            _, left, right = self._get_node(node)
+            if after is None or node > after:
+                stack.append((node, right))
+                node = left
+            else:
+                node = right
+
+        while stack and len(members) < limit:
+            member, node = stack.pop()
+            members.append(member)
+            while node:
+                _, left, right = self._get_node(node)
+                stack.append((node, right))
+                node = left
+        return members
+
+
+class MetadataCache:
+    """
+    Bounded LRU of decoded token metadata, keyed by token id.
+
+    Lives on the heap, so it starts empty after every upgrade. It is filled
+    by update calls: mint, transfers (icrc7_transfer, icrc37_transfer_from)
+    and the warm-up timer after an upgrade. Bulk mints leave it alone so a
+    large drop does not push out the tokens in use. Query calls read it, but
+    whatever they change (entries, recency, the hit/miss counters) is
+    dropped with the rest of the call's state, so hits and misses count the
+    lookups made by update calls.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = {}  # token id -> metadata vector, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token_id: int):
+        metadata = self.entries.pop(token_id, None)
+        if metadata is None:
+            self.misses += 1
+            return None
+        self.entries[token_id] = metadata
+        self.hits += 1
+        return metadata
+
+    def put(self, token_id: int, metadata) -> None:
+        self.entries.pop(token_id, None)
+        self.entries[token_id] = metadata
+        if len(self.entries) > self.capacity:
+            del self.entries[next(iter(self.entries))]
+
+    def invalidate(self, token_id: int) -> None:
+        """Drop a token's entry; call whenever its metadata_json changes or the token goes away."""
+        self.entries.pop(token_id, None)
+
+
+class QueuedRanges:
+    """
+    Token id ranges still waiting in mint_queue, keyed by queue sequence number,
+    so mint conflict checks do not decode the queue.
+
+    Lives on the heap: load() reads it back from mint_queue on first use after
+    an upgrade, and _queue_mints / _drain_mint_queue keep it in step.
+    """
+
+    def __init__(self):
+        self.ranges = None  # sequence number -> (first id, end id)
+
+    def load(self, head: int, tail: int) -> dict:
+        if self.ranges is None:
+            self.ranges = {}
+            for seq in range(head, tail):
+                self.update(seq, json.loads(mint_queue.get(seq)))
+        return self.ranges
+
+    def update(self, seq: int, run: dict) -> None:
+        """Record the ids a queued run has left; a finished run is dropped."""
+        if run["count"]:
+            self.ranges[seq] = (run["token_id"], run["token_id"] + run["count"])
+        else:
+            self.ranges.pop(seq, None)
+
+
 # Initialize stable storage for the database
 storage = StableBTreeMap[str, str](
     memory_id=1, max_key_size=200, max_value_size=100_000
 )
-Database.init(db_storage=storage, audit_enabled=True)
+
+# Append-only audit journal and sampled records (see AuditSink). Kybra reads map
+# sizes from the source as literals; they are AuditSink.MAX_JOURNAL_ENTRY_BYTES and
+# AuditSink.MAX_SAMPLE_BYTES, so keep them in step.
+audit_journal = StableBTreeMap[nat64, blob](
+    memory_id=2, max_key_size=8, max_value_size=209
+)
+audit_samples = StableBTreeMap[nat64, blob](
+    memory_id=10, max_key_size=8, max_value_size=4096
+)
+audit_sink = AuditSink(audit_journal, audit_samples)
+Database.init(db_storage=storage, audit_enabled=True, db_audit=audit_sink)
+
+# Index name -> internal entity id up to which it is built (see _INDEXED_ENTITIES)
+index_state = StableBTreeMap[str, nat64](
+    memory_id=3, max_key_size=64, max_value_size=8
+)
+
+# Owner account ("principal" or "principal:subaccount") -> number of tokens owned
+owner_index = StableBTreeMap[str, nat64](
+    memory_id=4, max_key_size=200, max_value_size=8
+)
+
+# OrderedIndex nodes: "o/{owner}" holds the token ids of one owner and "t" every
+# token id in the collection (see _token_member)
+token_order = StableBTreeMap[str, str](
+    memory_id=5, max_key_size=256, max_value_size=200
+)
+token_ids = OrderedIndex(token_order, "t")
+
+# OrderedIndex nodes: "t/{token}" holds the ids of the token-level approvals on one
+# token, "c/{owner}" the ids of one account's collection-level approvals and "e"
+# every approval that expires, as "{expires_at:020d}/{approval id}"
+approval_order = StableBTreeMap[str, str](
+    memory_id=6, max_key_size=512, max_value_size=1024
+)
+approval_expiries = OrderedIndex(approval_order, "e")
+
+# Append-only block id lists: "t/{token_id}#{i}" is the i-th block touching a
+# token and "t/{token_id}#n" how many there are; "a/{account}#..." likewise
+# lists the blocks where an account is the sender, recipient or spender
+history_index = StableBTreeMap[str, nat64](
+    memory_id=7, max_key_size=256, max_value_size=8
+)
+
+# Mints that mint_batch / mint_range could not fit in their own message: sequence
+# number -> JSON run of contiguous token ids, drained by a timer (see _queue_mints).
+# The value size is MINT_QUEUE_ENTRY_SIZE; Kybra reads it from the source, so it
+# stays a literal
+mint_queue = StableBTreeMap[nat64, str](
+    memory_id=8, max_key_size=8, max_value_size=8704
+)
+
+# OrderedIndex nodes: the namespace is the JSON text of a metadata [key, value]
+# pair and its members are the ids of the tokens carrying it (see _trait_namespace)
+trait_order = StableBTreeMap[str, str](
+    memory_id=9, max_key_size=512, max_value_size=200
+)
+
+INDEX_COMPLETE = 2**64 - 1  # index_state value once an index covers every token
+INDEX_REBUILD_CHUNK = 500  # entity rows fed to the indexes per timer tick
+APPROVAL_SWEEP_INTERVAL = 60  # seconds between expired-approval sweeps
+APPROVAL_SWEEP_CHUNK = 100  # most approvals deleted per sweep
+METADATA_CACHE_SIZE = 1000  # decoded token metadata vectors kept on the heap
+MAX_QUERY_BATCH_SIZE = 100  # most token ids per batch query (icrc7_max_query_batch_size)
+TRAIT_NAMESPACE_MAX_SIZE = 480  # longer metadata pairs are left out of the trait index
+MAX_UPDATE_BATCH_SIZE = 100  # most items per batch update (icrc7_max_update_batch_size)
+DEFAULT_PAGE_SIZE = 20  # get_transactions page when length is 0
+MAX_PAGE_SIZE = 100  # most blocks per history page
+MAX_METADATA_JSON_SIZE = 4096  # NFTToken.metadata_json max_length
+# A run's metadata_json escaped again inside the run's JSON is at most twice as
+# long; 512 covers the ids, owner, subaccount and keys around it
+MINT_QUEUE_ENTRY_SIZE = 2 * MAX_METADATA_JSON_SIZE + 512
+
+# Instructions a batch may use before it stops taking new items, leaving
+# headroom under the per-message limit for writing the collection back
+BATCH_INSTRUCTION_BUDGET = 15_000_000_000
+batch_instruction_budget = BATCH_INSTRUCTION_BUDGET  # lowered by a test-mode InitArg (heap only)
+
+metadata_cache = MetadataCache(METADATA_CACHE_SIZE)
+queued_ranges = QueuedRanges()
 
 logger = get_logger("nft_backend")
 
@@ -227,6 +607,9 @@ class InitArg(Record):
     description: Opt[str]
     supply_cap: Opt[nat]
     test: Opt[bool]
+    audit_mode: Opt[str]  # "off", "sampled" (default) or "journal"
+    audit_sample_rate: Opt[nat]
+    batch_instruction_budget: Opt[nat64]  # test mode only: lower budget, until the next upgrade
 
 
 class MintArg(Record):
@@ -240,6 +623,7 @@ class MintError(Variant, total=False):
     TokenIdAlreadyExists: null
     SupplyCapReached: null
     GenericError: "GenericError"
+    GenericBatchError: "GenericBatchError"
 
 
 class MintResult(Variant, total=False):
@@ -247,12 +631,55 @@ class MintResult(Variant, total=False):
     Err: MintError
 
 
+class MintBatchReceipt(Record):
+    minted: nat
+    queued: nat
+
+
+class MintBatchResult(Variant, total=False):
+    Ok: MintBatchReceipt
+    Err: MintError
+
+
 # Candid Record types for query returns
 class StandardRecord(Record):
     name: str
     url: str
 
 
+class AuditStats(Record):
+    mode: str
+    sample_rate: nat
+    records_seen: nat
+    records_written: nat
+    bytes_written: nat
+    journal_entries: nat
+    sampled_entries: nat
+
+
+class ApprovalSweepStats(Record):
+    queued: nat
+    reclaimed: nat
+
+
+class ApprovalSweepResult(Variant, total=False):
+    Ok: ApprovalSweepStats
+    Err: GenericError
+
+
+class TokenInfo(Record):
+    token_id: nat
+    owner: Account
+    metadata: Vec[Tuple[str, MetadataValue]]
+
+
+class MetadataCacheStats(Record):
+    size: nat
+    capacity: nat
+    hits: nat
+    misses: nat
+
+
 class TransactionRecord(Record):
     id: nat
     kind: str
@@ -267,6 +694,11 @@ class TransactionRecord(Record):
     memo: str
 
 
+class GetTransactionsResponse(Record):
+    log_length: nat
+    transactions: Vec[TransactionRecord]
+
+
 # =============================================================================
 # Database Entities
 # =============================================================================
@@ -291,6 +723,16 @@ class NFTCollection(Entity):
     total_supply = Integer(default=0)
     tx_count = Integer(default=0)  # Transaction counter for block indices
     test_mode = Integer(default=0)  # 1 = test mode enabled
+    audit_mode = String(max_length=16, default="sampled")
+    audit_sample_rate = Integer(default=100)
+    # AuditSink counters as of the last upgrade (they live on the heap in between)
+    audit_records_seen = Integer(default=0)
+    audit_records_written = Integer(default=0)
+    audit_bytes_written = Integer(default=0)
+    approvals_reclaimed = Integer(default=0)  # expired approvals deleted by the sweeper
+    mint_queue_head = Integer(default=0)  # oldest pending mint_queue entry
+    mint_queue_tail = Integer(default=0)  # next free mint_queue sequence number
+    mints_queued = Integer(default=0)  # tokens waiting in mint_queue, held against supply_cap
 
 
 class NFTApproval(Entity):
@@ -311,7 +753,7 @@ class NFTTransactionLog(Entity):
     """Transaction history for ICRC-3 compatibility."""
     __alias__ = "id"
     id = Integer()  # Block index
-    kind = String(max_length=16)  # "mint", "transfer", "approve", "revoke"
+    kind = String(max_length=32)  # "mint", "transfer", "approve", "revoke", "approve_collection", ...
     timestamp = Integer()  # Nanoseconds since epoch
     token_id = Integer()
     from_principal = String(default="")
@@ -329,6 +771,13 @@ Database.get_instance().register_entity_type(NFTCollection)
 Database.get_instance().register_entity_type(NFTApproval)
 Database.get_instance().register_entity_type(NFTTransactionLog)
 
+_collection = NFTCollection["config"]
+if _collection:
+    audit_sink.configure(_collection.audit_mode or "sampled", _collection.audit_sample_rate or 100)
+    audit_sink.records_seen = _collection.audit_records_seen or 0
+    audit_sink.records_written = _collection.audit_records_written or 0
+    audit_sink.bytes_written = _collection.audit_bytes_written or 0
+
 
 # =============================================================================
 # Helper Functions
@@ -358,6 +807,19 @@ def _get_collection() -> NFTCollection:
     raise Exception("Collection not initialized")
 
 
+def _set_fields(entity: Entity, **fields) -> Entity:
+    """Set several fields of an entity with one save and one audit record."""
+    # Each field set saves the whole entity unless _do_not_save is set. That flag
+    # is kybra_simple_db internals (checked against 0.6.2, requirements pin 0.6.*),
+    # so recheck this helper whenever that pin moves.
+    entity._do_not_save = True
+    for name, value in fields.items():
+        setattr(entity, name, value)
+    entity._do_not_save = False
+    entity._save()
+    return entity
+
+
 def _get_token(token_id: nat) -> Opt[NFTToken]:
     """Get token by ID."""
     return NFTToken[int(token_id)]
@@ -405,15 +867,657 @@ def _is_approved(token: NFTToken, spender: Account) -> bool:
     return False
 
 
-def _next_tx_id() -> int:
-    """Get next transaction ID and increment counter."""
+def _token_owner_key(token: NFTToken) -> str:
+    """Owner of a token in the same form as _account_to_str."""
+    if token.owner_subaccount:
+        return f"{token.owner_principal}:{token.owner_subaccount}"
+    return token.owner_principal
+
+
+def _add_owner_count(token: NFTToken) -> void:
+    """Count a token towards its owner's balance."""
+    key = _token_owner_key(token)
+    owner_index.insert(key, (owner_index.get(key) or 0) + 1)
+
+
+def _remove_owner_count(token: NFTToken) -> void:
+    """Stop counting a token towards its owner's balance."""
+    key = _token_owner_key(token)
+    count = (owner_index.get(key) or 0) - 1
+    if count > 0:
+        owner_index.insert(key, count)
+    else:
+        owner_index.remove(key)
+
+
+def _token_member(token_id: int) -> str:
+    """OrderedIndex member for a token id; the length prefix makes text order numeric."""
+    digits = str(int(token_id))
+    return f"{len(digits):02d}{digits}"
+
+
+def _owner_tokens(owner_key: str) -> OrderedIndex:
+    """Token ids held by one account, in ascending order."""
+    return OrderedIndex(token_order, f"o/{owner_key}")
+
+
+def _add_owner_token(token: NFTToken) -> void:
+    """List a token under its owner."""
+    _owner_tokens(_token_owner_key(token)).add(_token_member(token.id))
+
+
+def _remove_owner_token(token: NFTToken) -> void:
+    """Drop a token from its owner's list."""
+    _owner_tokens(_token_owner_key(token)).discard(_token_member(token.id))
+
+
+def _add_token_id(token: NFTToken) -> void:
+    """List a token in the collection-wide id order (a no-op if already listed)."""
+    token_ids.add(_token_member(token.id))
+
+
+def _trait_namespace(key: str, value) -> Opt[str]:
+    """Trait index namespace for a metadata pair, or None if it is too long to index."""
+    namespace = json.dumps([key, value])
+    if len(namespace) > TRAIT_NAMESPACE_MAX_SIZE:
+        return None
+    return namespace
+
+
+def _add_token_traits(token: NFTToken) -> void:
+    """List a token under each of its metadata pairs (a no-op for pairs already listed)."""
+    try:
+        meta_dict = json.loads(token.metadata_json)
+    except:
+        return
+    for key, value in meta_dict.items():
+        namespace = _trait_namespace(key, value)
+        if namespace:
+            OrderedIndex(trait_order, namespace).add(_token_member(token.id))
+
+
+def _token_approvals(token_id: int) -> OrderedIndex:
+    """Ids of the token-level approvals on one token, in ascending order."""
+    return OrderedIndex(approval_order, f"t/{_token_member(token_id)}")
+
+
+def _add_token_approval(approval: NFTApproval) -> void:
+    """List a token-level approval under its token."""
+    if approval.approval_type == "token":
+        _token_approvals(approval.token_id).add(approval.id)
+
+
+def _remove_token_approval(approval: NFTApproval) -> void:
+    """Drop a token-level approval from its token's list."""
+    if approval.approval_type == "token":
+        _token_approvals(approval.token_id).discard(approval.id)
+
+
+def _approval_owner_key(approval: NFTApproval) -> str:
+    """Owner of an approval in the same form as _account_to_str."""
+    if approval.owner_subaccount:
+        return f"{approval.owner_principal}:{approval.owner_subaccount}"
+    return approval.owner_principal
+
+
+def _collection_approvals(owner_key: str) -> OrderedIndex:
+    """Ids of one account's collection-level approvals, in ascending order."""
+    return OrderedIndex(approval_order, f"c/{owner_key}")
+
+
+def _add_collection_approval(approval: NFTApproval) -> void:
+    """List a collection-level approval under its owner."""
+    if approval.approval_type == "collection":
+        _collection_approvals(_approval_owner_key(approval)).add(approval.id)
+
+
+def _remove_collection_approval(approval: NFTApproval) -> void:
+    """Drop a collection-level approval from its owner's list."""
+    if approval.approval_type == "collection":
+        _collection_approvals(_approval_owner_key(approval)).discard(approval.id)
+
+
+def _expiry_member(approval: NFTApproval) -> str:
+    """approval_expiries member; zero padding makes text order match expiry order."""
+    return f"{approval.expires_at:020d}/{approval.id}"
+
+
+def _add_approval_expiry(approval: NFTApproval) -> void:
+    """Queue an approval for deletion once it expires."""
+    if approval.expires_at > 0:
+        approval_expiries.add(_expiry_member(approval))
+
+
+def _remove_approval_expiry(approval: NFTApproval) -> void:
+    """Take an approval out of the expiry queue."""
+    if approval.expires_at > 0:
+        approval_expiries.discard(_expiry_member(approval))
+
+
+def _history_append(key: str, block_id: int) -> void:
+    """Append a block id to one history list."""
+    count = history_index.get(f"{key}#n") or 0
+    history_index.insert(f"{key}#{count}", block_id)
+    history_index.insert(f"{key}#n", count + 1)
+
+
+def _history_page(key: str, prev: Opt[int], limit: int) -> Vec[int]:
+    """Block ids of one history list, newest first, all strictly below prev."""
+    end = history_index.get(f"{key}#n") or 0
+    
+    if prev is not None:
+        # Binary search for the first position whose block id is >= prev
+        lo, hi = 0, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if history_index.get(f"{key}#{mid}") < prev:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = lo
+    
+    first = max(end - limit, 0)
+    return [history_index.get(f"{key}#{pos}") for pos in range(end - 1, first - 1, -1)]
+
+
+def _add_token_history(tx: NFTTransactionLog) -> void:
+    """List a block in its token's history."""
+    if tx.kind not in ("approve_collection", "revoke_collection"):
+        _history_append(f"t/{tx.token_id}", tx.id)
+
+
+def _transaction_accounts(tx: NFTTransactionLog) -> Vec[str]:
+    """Distinct accounts a block involves, in the same form as _account_to_str."""
+    accounts = []
+    for principal, subaccount in (
+        (tx.from_principal, tx.from_subaccount),
+        (tx.to_principal, tx.to_subaccount),
+        (tx.spender_principal, tx.spender_subaccount),
+    ):
+        if principal:
+            key = f"{principal}:{subaccount}" if subaccount else principal
+            if key not in accounts:
+                accounts.append(key)
+    return accounts
+
+
+def _add_account_history(tx: NFTTransactionLog) -> void:
+    """List a block in the history of every account it involves."""
+    for account in _transaction_accounts(tx):
+        _history_append(f"a/{account}", tx.id)
+
+
+def _keep_history(tx: NFTTransactionLog) -> void:
+    """Blocks are never changed or deleted, so there is nothing to remove."""
+    pass
+
+
+# Indexes derived from entity rows: name -> (add row, remove row).
+# A row is added after it is created or changed and removed before it changes
+# or is deleted, but only once the index covers it; an index that is still
+# being rebuilt picks up the row's current state when it gets to it.
+_TOKEN_INDEXES = {
+    "owner_count": (_add_owner_count, _remove_owner_count),
+    "owner_tokens": (_add_owner_token, _remove_owner_token),
+}
+
+# Indexes of what is fixed at mint: name -> add row. _mint_token adds each
+# new token once and transfers never touch them
+_MINTED_TOKEN_INDEXES = {
+    "token_ids": _add_token_id,
+    "traits": _add_token_traits,
+}
+
+_APPROVAL_INDEXES = {
+    "token_approvals": (_add_token_approval, _remove_token_approval),
+    "collection_approvals": (_add_collection_approval, _remove_collection_approval),
+    "approval_expiry": (_add_approval_expiry, _remove_approval_expiry),
+}
+
+# Block histories are append-only, so a rebuild feeds them blocks in id order
+_TRANSACTION_INDEXES = {
+    "token_history": (_add_token_history, _keep_history),
+    "account_history": (_add_account_history, _keep_history),
+}
+
+def _rebuild_hooks(indexes: dict) -> dict:
+    """name -> add row, for a table of (add, remove) pairs."""
+    return {name: add for name, (add, _) in indexes.items()}
+
+
+# Entity types and how a rebuild adds a row to each of their indexes, in the
+# order rebuilds walk them
+_INDEXED_ENTITIES = (
+    (NFTToken, {**_rebuild_hooks(_TOKEN_INDEXES), **_MINTED_TOKEN_INDEXES}),
+    (NFTApproval, _rebuild_hooks(_APPROVAL_INDEXES)),
+    (NFTTransactionLog, _rebuild_hooks(_TRANSACTION_INDEXES)),
+)
+
+
+def _index_covers(name: str, row: Entity) -> bool:
+    """Whether the named index already reflects this row."""
+    watermark = index_state.get(name) or 0
+    return watermark == INDEX_COMPLETE or int(row._id) <= watermark
+
+
+def _index_token(token: NFTToken) -> void:
+    """Add a token to every index that covers it."""
+    for name, (add, _) in _TOKEN_INDEXES.items():
+        if _index_covers(name, token):
+            add(token)
+
+
+def _index_minted_token(token: NFTToken) -> void:
+    """Add a new token to every mint-time index that covers it."""
+    for name, add in _MINTED_TOKEN_INDEXES.items():
+        if _index_covers(name, token):
+            add(token)
+
+
+def _unindex_token(token: NFTToken) -> void:
+    """Remove a token from every index that covers it."""
+    for name, (_, remove) in _TOKEN_INDEXES.items():
+        if _index_covers(name, token):
+            remove(token)
+
+
+def _index_approval(approval: NFTApproval) -> void:
+    """Add an approval to every index that covers it."""
+    for name, (add, _) in _APPROVAL_INDEXES.items():
+        if _index_covers(name, approval):
+            add(approval)
+
+
+def _unindex_approval(approval: NFTApproval) -> void:
+    """Remove an approval from every index that covers it."""
+    for name, (_, remove) in _APPROVAL_INDEXES.items():
+        if _index_covers(name, approval):
+            remove(approval)
+
+
+def _index_transaction(tx: NFTTransactionLog) -> void:
+    """Add a new block to every index that covers it."""
+    for name, (add, _) in _TRANSACTION_INDEXES.items():
+        if _index_covers(name, tx):
+            add(tx)
+
+
+def _index_ready(name: str) -> bool:
+    """Whether the named index covers every row."""
+    return index_state.get(name) == INDEX_COMPLETE
+
+
+def _indexes_ready() -> bool:
+    """Whether every index covers every row."""
+    return all(
+        _index_ready(name)
+        for _, indexes in _INDEXED_ENTITIES
+        for name in indexes
+    )
+
+
+def _rebuild_indexes() -> void:
+    """Timer callback: feed the next chunk of rows to indexes still being built."""
+    for entity, indexes in _INDEXED_ENTITIES:
+        pending = {
+            name: index_state.get(name) or 0
+            for name in indexes
+            if not _index_ready(name)
+        }
+        if pending:
+            break
+    else:
+        return
+    
+    start = min(pending.values())
+    rows = entity.load_some(start + 1, INDEX_REBUILD_CHUNK)
+    for row in rows:
+        for name, watermark in pending.items():
+            if int(row._id) > watermark:
+                indexes[name](row)
+    
+    done = int(rows[-1]._id) if rows else entity.max_id()
+    for name, watermark in pending.items():
+        if done >= entity.max_id():
+            index_state.insert(name, INDEX_COMPLETE)
+        elif done > watermark:
+            index_state.insert(name, done)
+    
+    logger.info(f"Rebuilt {entity.__name__} indexes up to row {done}/{entity.max_id()}")
+    if not _indexes_ready():
+        ic.set_timer(0, _rebuild_indexes)
+
+
+def _save_approval(approval_id: str, **fields) -> NFTApproval:
+    """Create an approval, or overwrite the existing one with the same id."""
+    approval = NFTApproval[approval_id]
+    if approval:
+        _unindex_approval(approval)
+        _set_fields(approval, **fields)
+    else:
+        approval = NFTApproval(id=approval_id, **fields)
+    _index_approval(approval)
+    return approval
+
+
+def _delete_approval(approval: NFTApproval) -> void:
+    """Delete an approval and drop it from the indexes."""
+    _unindex_approval(approval)
+    approval.delete()
+
+
+def _read_approvals(index_name: str, index: OrderedIndex, matches, after: Opt[str], limit: Opt[int]) -> Vec[NFTApproval]:
+    """Approvals listed in an index ordered by approval id, starting after `after`.
+    
+    Until the index is built the approval table is scanned with `matches` instead.
+    """
+    if _index_ready(index_name):
+        approval_ids = index.items(after, limit if limit is not None else index.count())
+        return [NFTApproval[approval_id] for approval_id in approval_ids]
+    
+    approvals = sorted(
+        (
+            a for a in NFTApproval.instances()
+            if matches(a) and (after is None or a.id > after)
+        ),
+        key=lambda a: a.id
+    )
+    return approvals if limit is None else approvals[:limit]
+
+
+def _get_token_approvals(token_id: int, after: Opt[str] = None, limit: Opt[int] = None) -> Vec[NFTApproval]:
+    """Token-level approvals on a token ordered by approval id, starting after `after`."""
+    return _read_approvals(
+        "token_approvals",
+        _token_approvals(token_id),
+        lambda a: a.approval_type == "token" and a.token_id == int(token_id),
+        after,
+        limit
+    )
+
+
+def _get_collection_approvals(owner_key: str, after: Opt[str] = None, limit: Opt[int] = None) -> Vec[NFTApproval]:
+    """An account's collection-level approvals ordered by approval id, starting after `after`."""
+    return _read_approvals(
+        "collection_approvals",
+        _collection_approvals(owner_key),
+        lambda a: a.approval_type == "collection" and _approval_owner_key(a) == owner_key,
+        after,
+        limit
+    )
+
+
+def _unexpired_approvals(read, after: Opt[str], limit: int) -> Vec[NFTApproval]:
+    """Up to `limit` unexpired approvals from read(after, limit), skipping expired ones."""
+    now = ic.time()
+    approvals = []
+    while len(approvals) < limit:
+        page = read(after, limit)
+        if not page:
+            break
+        approvals.extend(
+            a for a in page
+            if a.expires_at == 0 or a.expires_at > now
+        )
+        after = page[-1].id
+    return approvals[:limit]
+
+
+def _oversized_batch(size: int) -> Opt[GenericBatchError]:
+    """Error for update batches larger than icrc7_max_update_batch_size, else None."""
+    if size <= MAX_UPDATE_BATCH_SIZE:
+        return None
+    return GenericBatchError(
+        error_code=1,
+        message=f"Batch of {size} items exceeds max_update_batch_size ({MAX_UPDATE_BATCH_SIZE})"
+    )
+
+
+def _budget_exhausted() -> bool:
+    """Whether the current batch has spent its instruction budget."""
+    return ic.performance_counter(0) > batch_instruction_budget
+
+
+def _unprocessed_error() -> GenericBatchError:
+    """Error reported for batch items left untouched once the budget ran out."""
+    return GenericBatchError(
+        error_code=2,
+        message="Instruction budget exhausted before this item was processed; resubmit it"
+    )
+
+
+def _check_query_batch(size: int) -> void:
+    """Reject batch queries larger than icrc7_max_query_batch_size."""
+    if size > MAX_QUERY_BATCH_SIZE:
+        raise ValueError(f"Batch of {size} token ids exceeds max_query_batch_size ({MAX_QUERY_BATCH_SIZE})")
+
+
+def _token_owner(token: NFTToken) -> Account:
+    """Owner of a token as an Account."""
+    return Account(
+        owner=Principal.from_str(token.owner_principal),
+        subaccount=bytes.fromhex(token.owner_subaccount) if token.owner_subaccount else None
+    )
+
+
+def _token_metadata(token_id: nat, token: Opt[NFTToken] = None) -> Opt[Vec[Tuple[str, MetadataValue]]]:
+    """Decoded metadata of a token, from the cache when possible; None if the token does not exist."""
+    metadata = metadata_cache.get(int(token_id))
+    if metadata is not None:
+        return metadata
+    
+    token = token or _get_token(token_id)
+    if not token:
+        return None
+    
+    metadata = _decode_metadata(token.metadata_json)
+    metadata_cache.put(int(token_id), metadata)
+    return metadata
+
+
+def _token_ids_page(prev: Opt[nat], limit: int) -> Vec[nat]:
+    """Up to `limit` token ids in ascending order, strictly after `prev`."""
+    if _index_ready("token_ids"):
+        after = _token_member(prev) if prev is not None else None
+        return [int(member[2:]) for member in token_ids.items(after, limit)]
+    
+    all_tokens = NFTToken.instances()
+    all_ids = sorted([token.id for token in all_tokens])
+    
+    start_idx = 0
+    if prev is not None:
+        for i, tid in enumerate(all_ids):
+            if tid > prev:
+                start_idx = i
+                break
+        else:
+            return []
+    
+    return all_ids[start_idx:start_idx + limit]
+
+
+def _trait_value(value: MetadataValue):
+    """A filter value as it is stored in metadata_json (None for Blob, which is never stored)."""
+    if "Text" in value:
+        return value["Text"]
+    if "Nat" in value:
+        return value["Nat"]
+    if "Int" in value:
+        return value["Int"]
+    return None
+
+
+def _trait_token_ids(filters: Vec[Tuple[str, MetadataValue]], prev: Opt[nat], limit: int) -> Vec[nat]:
+    """Up to `limit` ids, ascending and strictly after `prev`, of tokens matching every filter."""
+    if not filters:
+        return _token_ids_page(prev, limit)
+    
+    wanted = [(key, _trait_value(value)) for key, value in filters]
+    if any(value is None for _, value in wanted):
+        return []
+    
+    namespaces = [_trait_namespace(key, value) for key, value in wanted]
+    if _index_ready("traits") and all(namespaces):
+        # Walk the shortest posting list and probe the others for each of its members
+        postings = sorted((OrderedIndex(trait_order, namespace) for namespace in namespaces), key=lambda index: index.count())
+        driver, others = postings[0], postings[1:]
+        after = _token_member(prev) if prev is not None else None
+        results = []
+        while len(results) < limit:
+            members = driver.items(after, limit)
+            if not members:
+                break
+            for member in members:
+                if all(index.contains(member) for index in others):
+                    results.append(int(member[2:]))
+                    if len(results) == limit:
+                        break
+            after = members[-1]
+        return results
+    
+    matches = []
+    for token in NFTToken.instances():
+        if prev is not None and token.id <= prev:
+            continue
+        try:
+            meta_dict = json.loads(token.metadata_json)
+        except:
+            continue
+        if all(key in meta_dict and meta_dict[key] == value for key, value in wanted):
+            matches.append(token.id)
+    return sorted(matches)[:limit]
+
+
+def _token_infos(token_ids: Vec[nat]) -> Vec[TokenInfo]:
+    """Id, owner and metadata of each listed token that exists."""
+    results = []
+    for token_id in token_ids:
+        token = _get_token(token_id)
+        if not token:
+            continue
+        results.append(TokenInfo(
+            token_id=token_id,
+            owner=_token_owner(token),
+            metadata=_token_metadata(token_id, token)
+        ))
+    return results
+
+
+def _decode_metadata(metadata_json: str) -> Vec[Tuple[str, MetadataValue]]:
+    """Token metadata_json as returned by icrc7_token_metadata."""
+    try:
+        meta_dict = json.loads(metadata_json)
+    except:
+        meta_dict = {}
+    
+    metadata = []
+    for key, value in meta_dict.items():
+        if isinstance(value, str):
+            metadata.append((key, MetadataValue(Text=value)))
+        elif isinstance(value, int):
+            metadata.append((key, MetadataValue(Nat=value)))
+    return metadata
+
+
+def _warm_metadata_cache() -> void:
+    """Timer callback: refill the metadata cache with the first tokens after an upgrade."""
+    for token in NFTToken.load_some(1, METADATA_CACHE_SIZE):
+        metadata_cache.put(token.id, _decode_metadata(token.metadata_json))
+    logger.info(f"Warmed metadata cache with {len(metadata_cache.entries)} tokens")
+
+
+def _sweep_expired_approvals() -> void:
+    """Interval timer: delete up to APPROVAL_SWEEP_CHUNK approvals whose expiry has passed."""
+    _reclaim_expired_approvals()
+
+
+def _reclaim_expired_approvals() -> void:
+    """One sweep, for the interval timer and sweep_expired_approvals."""
+    if not _index_ready("approval_expiry"):
+        return
+    
+    now = ic.time()
+    reclaimed = 0
+    for member in approval_expiries.items(None, APPROVAL_SWEEP_CHUNK):
+        expires_at, approval_id = member.split("/", 1)
+        if int(expires_at) > now:
+            break
+        approval = NFTApproval[approval_id]
+        if approval:
+            _delete_approval(approval)
+        else:
+            approval_expiries.discard(member)
+        reclaimed += 1
+    
+    if reclaimed:
+        collection = _get_collection()
+        collection.approvals_reclaimed = (collection.approvals_reclaimed or 0) + reclaimed
+        logger.info(f"Swept {reclaimed} expired approvals")
+
+
+def _approval_sweep_stats() -> ApprovalSweepStats:
     collection = _get_collection()
-    tx_id = collection.tx_count
-    collection.tx_count = tx_id + 1
-    return tx_id
+    return ApprovalSweepStats(
+        queued=approval_expiries.count(),
+        reclaimed=collection.approvals_reclaimed or 0
+    )
+
+
+def _configure_batch_budget(budget: Opt[nat64]) -> void:
+    """Let test mode lower the batch instruction budget, so tests can exhaust it with small batches."""
+    global batch_instruction_budget
+    if budget is None or _get_collection().test_mode != 1:
+        return
+    batch_instruction_budget = min(budget, BATCH_INSTRUCTION_BUDGET)
+    logger.info(f"Batch instruction budget set to {batch_instruction_budget}")
+
+
+def _configure_audit(mode: Opt[str], sample_rate: Opt[nat]) -> void:
+    """Apply and persist the audit settings from init/upgrade arguments."""
+    if mode is None and sample_rate is None:
+        return
+    audit_sink.configure(mode or audit_sink.mode, sample_rate)
+    _set_fields(_get_collection(), audit_mode=audit_sink.mode, audit_sample_rate=audit_sink.sample_rate)
+    logger.info(f"Audit mode set to {audit_sink.mode} (sample rate {audit_sink.sample_rate})")
+
+
+class CollectionBatch:
+    """
+    Collection counters for one update message.
+    
+    Loads the NFTCollection singleton once, hands out block ids from a local
+    counter and writes tx_count / total_supply, plus any fields given to
+    set(), back in one save in commit(), so a call with many arguments does
+    not read and save the singleton per argument.
+    """
+    
+    def __init__(self):
+        self.collection = _get_collection()
+        self.tx_count = self.collection.tx_count
+        self.total_supply = self.collection.total_supply
+        self.fields = {}
+    
+    def next_tx_id(self) -> int:
+        tx_id = self.tx_count
+        self.tx_count += 1
+        return tx_id
+    
+    def set(self, name: str, value) -> None:
+        """Collection field to write in commit()."""
+        self.fields[name] = value
+    
+    def commit(self) -> None:
+        if self.tx_count != self.collection.tx_count:
+            self.fields["tx_count"] = self.tx_count
+        if self.total_supply != self.collection.total_supply:
+            self.fields["total_supply"] = self.total_supply
+        if self.fields:
+            _set_fields(self.collection, **self.fields)
+            self.fields = {}
 
 
 def _log_transaction(
+    batch: CollectionBatch,
     kind: str,
     token_id: int,
     from_principal: str = "",
@@ -425,7 +1529,7 @@ def _log_transaction(
     memo: str = ""
 ) -> int:
     """Log a transaction and return block index."""
-    tx_id = _next_tx_id()
+    tx_id = batch.next_tx_id()
     tx = NFTTransactionLog(
         id=tx_id,
         kind=kind,
@@ -439,9 +1543,238 @@ def _log_transaction(
         spender_subaccount=spender_subaccount,
         memo=memo
     )
+    _index_transaction(tx)
     return tx_id
 
 
+def _encode_metadata(metadata: Opt[Vec[Tuple[str, MetadataValue]]]) -> str:
+    """JSON text stored in NFTToken.metadata_json for a metadata vector."""
+    metadata_dict = {}
+    if metadata:
+        for key, value in metadata:
+            if "Text" in value:
+                metadata_dict[key] = value["Text"]
+            elif "Nat" in value:
+                metadata_dict[key] = value["Nat"]
+            elif "Int" in value:
+                metadata_dict[key] = value["Int"]
+    return json.dumps(metadata_dict)
+
+
+def _mint_token(batch: CollectionBatch, token_id: int, owner_principal: str, owner_subaccount: str, metadata_json: str) -> int:
+    """Create and index one token, count it in the supply and log its mint block."""
+    token = NFTToken(
+        id=token_id,
+        owner_principal=owner_principal,
+        owner_subaccount=owner_subaccount,
+        metadata_json=metadata_json
+    )
+    _index_token(token)
+    _index_minted_token(token)
+    batch.total_supply += 1
+    
+    return _log_transaction(
+        batch,
+        kind="mint",
+        token_id=token_id,
+        to_principal=owner_principal,
+        to_subaccount=owner_subaccount
+    )
+
+
+def _new_mint_run(token_id: int, count: int, owner: Account, metadata_json: str, template: bool) -> dict:
+    """A run of `count` contiguous token ids minted to one owner with the same metadata."""
+    return {
+        "token_id": int(token_id),
+        "count": int(count),
+        "owner": owner["owner"].to_str(),
+        "subaccount": _subaccount_to_hex(owner.get("subaccount")),
+        "metadata": metadata_json,
+        "template": template,
+    }
+
+
+def _fill_template(metadata: dict, token_id: int) -> str:
+    """metadata_json for one token of a template run: "{token_id}" in Text values becomes its id."""
+    token_id_text = str(token_id)
+    return json.dumps({
+        key: value.replace("{token_id}", token_id_text) if isinstance(value, str) else value
+        for key, value in metadata.items()
+    })
+
+
+def _oversized_run(run: dict) -> bool:
+    """Whether a run's token metadata or its mint_queue entry would be too long to store."""
+    metadata_json = run["metadata"]
+    if run["template"] and run["count"]:
+        # Ids only get longer, so the last token of the run has the longest metadata
+        metadata_json = _fill_template(json.loads(metadata_json), run["token_id"] + run["count"] - 1)
+    return len(metadata_json) > MAX_METADATA_JSON_SIZE or len(json.dumps(run)) > MINT_QUEUE_ENTRY_SIZE
+
+
+def _mint_run(batch: CollectionBatch, run: dict) -> int:
+    """Mint from the front of a run until it or the instruction budget is used up."""
+    template = json.loads(run["metadata"]) if run["template"] else None
+    minted = 0
+    while run["count"] and not _budget_exhausted():
+        token_id = run["token_id"]
+        metadata_json = run["metadata"] if template is None else _fill_template(template, token_id)
+        _mint_token(batch, token_id, run["owner"], run["subaccount"], metadata_json)
+        run["token_id"] += 1
+        run["count"] -= 1
+        minted += 1
+    return minted
+
+
+def _tokens_in_range(start: int, end: int) -> bool:
+    """Whether any token id in [start, end) is already minted."""
+    first = token_ids.items(_token_member(start - 1) if start else None, 1)
+    if first and int(first[0][2:]) < end:
+        return True
+    if _index_ready("token_ids"):
+        return False
+    
+    # While the index is rebuilt, rows past its watermark are not in it yet:
+    # check those rows, or the ids themselves if the range is shorter
+    watermark = index_state.get("token_ids") or 0
+    unindexed = NFTToken.max_id() - watermark
+    if unindexed <= 0:
+        return False
+    if end - start <= unindexed:
+        return any(_get_token(token_id) for token_id in range(start, end))
+    return any(start <= token.id < end for token in NFTToken.load_some(watermark + 1, unindexed))
+
+
+def _mint_conflict(runs: list, collection: NFTCollection) -> bool:
+    """Whether the runs overlap each other, a queued run or a minted token."""
+    spans = sorted((run["token_id"], run["token_id"] + run["count"]) for run in runs if run["count"])
+    for (_, end), (next_start, _) in zip(spans, spans[1:]):
+        if next_start < end:
+            return True
+    
+    queued = queued_ranges.load(collection.mint_queue_head or 0, collection.mint_queue_tail or 0).values()
+    for start, end in spans:
+        if any(q_start < end and start < q_end for q_start, q_end in queued):
+            return True
+        if _tokens_in_range(start, end):
+            return True
+    return False
+
+
+def _queue_mints(batch: CollectionBatch, runs: list) -> int:
+    """Append the unfinished runs to mint_queue, arming the drain timer; returns the tokens queued."""
+    collection = batch.collection
+    head = collection.mint_queue_head or 0
+    tail = collection.mint_queue_tail or 0
+    queued_ranges.load(head, tail)
+    queued = 0
+    for run in runs:
+        if run["count"]:
+            mint_queue.insert(tail, json.dumps(run))
+            queued_ranges.update(tail, run)
+            tail += 1
+            queued += run["count"]
+    
+    if queued:
+        # The timer re-arms itself while the queue is non-empty, so only an empty queue needs one
+        if head == (collection.mint_queue_tail or 0):
+            ic.set_timer(0, _drain_mint_queue)
+        batch.set("mint_queue_tail", tail)
+        batch.set("mints_queued", (collection.mints_queued or 0) + queued)
+    return queued
+
+
+def _drain_mint_queue() -> void:
+    """Timer: mint queued runs until the queue or the instruction budget runs out, then re-arm."""
+    batch = CollectionBatch()
+    collection = batch.collection
+    head = collection.mint_queue_head or 0
+    tail = collection.mint_queue_tail or 0
+    queued_ranges.load(head, tail)
+    minted = 0
+    
+    while head < tail and not _budget_exhausted():
+        run = json.loads(mint_queue.get(head))
+        minted += _mint_run(batch, run)
+        queued_ranges.update(head, run)
+        if run["count"]:
+            mint_queue.insert(head, json.dumps(run))
+            break
+        mint_queue.remove(head)
+        head += 1
+    
+    batch.set("mint_queue_head", head)
+    batch.set("mints_queued", (collection.mints_queued or 0) - minted)
+    batch.commit()
+    logger.info(f"Mint queue: minted {minted}, {collection.mints_queued} pending")
+    
+    if head < tail:
+        ic.set_timer(0, _drain_mint_queue)
+
+
+def _mint_runs(batch: CollectionBatch, runs: list) -> MintBatchResult:
+    """Check and mint runs of token ids, queueing what does not fit in this message."""
+    collection = batch.collection
+    if collection.test_mode != 1:
+        return MintBatchResult(Err=MintError(Unauthorized=null))
+    
+    # One supply cap check for the whole request; queued tokens already hold their share
+    total = sum(run["count"] for run in runs)
+    if collection.supply_cap > 0 and batch.total_supply + (collection.mints_queued or 0) + total > collection.supply_cap:
+        return MintBatchResult(Err=MintError(SupplyCapReached=null))
+    
+    if _mint_conflict(runs, collection):
+        return MintBatchResult(Err=MintError(TokenIdAlreadyExists=null))
+    
+    # Checked up front: a run that cannot be stored must not be half minted or queued
+    if any(_oversized_run(run) for run in runs):
+        return MintBatchResult(Err=MintError(GenericError=GenericError(
+            error_code=1,
+            message="Token metadata is too long to store"
+        )))
+    
+    minted = sum(_mint_run(batch, run) for run in runs)
+    queued = _queue_mints(batch, runs)
+    batch.commit()
+    
+    logger.info(f"Batch mint: {minted} minted, {queued} queued")
+    return MintBatchResult(Ok=MintBatchReceipt(minted=minted, queued=queued))
+
+
+def _clamp_page_size(page_size: int) -> int:
+    """History page size: 0 means DEFAULT_PAGE_SIZE and anything over MAX_PAGE_SIZE is cut to it."""
+    if page_size == 0:
+        return DEFAULT_PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def _transaction_record(tx: NFTTransactionLog) -> TransactionRecord:
+    """Transaction log entry as returned to callers."""
+    return TransactionRecord(
+        id=tx.id,
+        kind=tx.kind,
+        timestamp=tx.timestamp,
+        token_id=tx.token_id,
+        from_principal=tx.from_principal,
+        from_subaccount=tx.from_subaccount,
+        to_principal=tx.to_principal,
+        to_subaccount=tx.to_subaccount,
+        spender_principal=tx.spender_principal,
+        spender_subaccount=tx.spender_subaccount,
+        memo=tx.memo
+    )
+
+
+def _block_records(block_ids) -> Vec[TransactionRecord]:
+    """Load blocks by id, in the given order, skipping ids with no block."""
+    result = []
+    for block_id in block_ids:
+        tx = NFTTransactionLog["id", block_id]
+        if tx:
+            result.append(_transaction_record(tx))
+    return result
+
+
 # =============================================================================
 # Canister Lifecycle
 # =============================================================================
@@ -461,9 +1794,47 @@ def init_(args: InitArg) -> void:
         tx_count=0,
         test_mode=1 if args.get("test") else 0
     )
+    _configure_audit(args.get("audit_mode"), args.get("audit_sample_rate"))
+    _configure_batch_budget(args.get("batch_instruction_budget"))
+    
+    # Nothing to index yet, so every index is complete from the start
+    for _, indexes in _INDEXED_ENTITIES:
+        for name in indexes:
+            index_state.insert(name, INDEX_COMPLETE)
+    ic.set_timer_interval(APPROVAL_SWEEP_INTERVAL, _sweep_expired_approvals)
     logger.info("NFT collection initialized")
 
 
+@pre_upgrade
+def pre_upgrade_() -> void:
+    """Keep the heap-only audit counters across the upgrade."""
+    _set_fields(
+        _get_collection(),
+        audit_records_seen=audit_sink.records_seen,
+        audit_records_written=audit_sink.records_written,
+        audit_bytes_written=audit_sink.bytes_written
+    )
+
+
+@post_upgrade
+def post_upgrade_(args: InitArg) -> void:
+    """Upgrades receive the init arguments; only the audit settings and the test-mode batch budget apply."""
+    _configure_audit(args.get("audit_mode"), args.get("audit_sample_rate"))
+    _configure_batch_budget(args.get("batch_instruction_budget"))
+    
+    # Indexes added by this upgrade are built from the existing rows in the background
+    if not _indexes_ready():
+        ic.set_timer(0, _rebuild_indexes)
+    
+    # Timers and heap state do not survive an upgrade
+    ic.set_timer_interval(APPROVAL_SWEEP_INTERVAL, _sweep_expired_approvals)
+    ic.set_timer(0, _warm_metadata_cache)
+    
+    collection = _get_collection()
+    if (collection.mint_queue_tail or 0) > (collection.mint_queue_head or 0):
+        ic.set_timer(0, _drain_mint_queue)
+
+
 # =============================================================================
 # ICRC-7 Query Methods
 # =============================================================================
@@ -513,48 +1884,48 @@ def icrc7_collection_metadata() -> Vec[Tuple[str, MetadataValue]]:
         metadata.append(("icrc7:description", MetadataValue(Text=collection.description)))
     if collection.supply_cap > 0:
         metadata.append(("icrc7:supply_cap", MetadataValue(Nat=collection.supply_cap)))
+    metadata.append(("icrc7:max_query_batch_size", MetadataValue(Nat=MAX_QUERY_BATCH_SIZE)))
+    metadata.append(("icrc7:max_update_batch_size", MetadataValue(Nat=MAX_UPDATE_BATCH_SIZE)))
     return metadata
 
 
 @query
-def icrc7_token_metadata(token_id: nat) -> Opt[Vec[Tuple[str, MetadataValue]]]:
-    """Returns metadata for a specific token."""
-    token = _get_token(token_id)
-    if not token:
-        return None
-    
-    import json
-    try:
-        meta_dict = json.loads(token.metadata_json)
-    except:
-        meta_dict = {}
-    
-    metadata = []
-    for key, value in meta_dict.items():
-        if isinstance(value, str):
-            metadata.append((key, MetadataValue(Text=value)))
-        elif isinstance(value, int):
-            metadata.append((key, MetadataValue(Nat=value)))
-    
-    return metadata
+def icrc7_max_query_batch_size() -> Opt[nat]:
+    """Most token ids accepted by icrc7_owner_of and icrc7_token_metadata."""
+    return MAX_QUERY_BATCH_SIZE
 
 
 @query
-def icrc7_owner_of(token_id: nat) -> Opt[Account]:
-    """Returns the owner of the specified token."""
-    token = _get_token(token_id)
-    if not token:
-        return None
-    
-    return Account(
-        owner=Principal.from_str(token.owner_principal),
-        subaccount=bytes.fromhex(token.owner_subaccount) if token.owner_subaccount else None
-    )
+def icrc7_max_update_batch_size() -> Opt[nat]:
+    """Most items accepted by the ICRC-7/ICRC-37 batch update methods."""
+    return MAX_UPDATE_BATCH_SIZE
+
+
+@query
+def icrc7_token_metadata(token_ids: Vec[nat]) -> Vec[Opt[Vec[Tuple[str, MetadataValue]]]]:
+    """Returns metadata for each of the given tokens (null for unknown ids)."""
+    _check_query_batch(len(token_ids))
+    return [_token_metadata(token_id) for token_id in token_ids]
+
+
+@query
+def icrc7_owner_of(token_ids: Vec[nat]) -> Vec[Opt[Account]]:
+    """Returns the owner of each of the given tokens (null for unknown ids)."""
+    _check_query_batch(len(token_ids))
+    results = []
+    for token_id in token_ids:
+        token = _get_token(token_id)
+        results.append(_token_owner(token) if token else None)
+    return results
 
 
 @query
 def icrc7_balance_of(account: Account) -> nat:
     """Returns the number of NFTs owned by the specified account."""
+    if _index_ready("owner_count"):
+        return owner_index.get(_account_to_str(account)) or 0
+    
+    # The owner index is still being rebuilt after an upgrade
     principal = account["owner"].to_str()
     subaccount = _subaccount_to_hex(account.get("subaccount"))
     
@@ -569,25 +1940,33 @@ def icrc7_balance_of(account: Account) -> nat:
 @query
 def icrc7_tokens(prev: Opt[nat], take: Opt[nat]) -> Vec[nat]:
     """Returns a paginated list of all token IDs."""
-    all_tokens = NFTToken.instances()
-    token_ids = sorted([token.id for token in all_tokens])
-    
-    start_idx = 0
-    if prev is not None:
-        for i, tid in enumerate(token_ids):
-            if tid > prev:
-                start_idx = i
-                break
-        else:
-            return []
-    
     limit = take if take is not None else 100
-    return token_ids[start_idx:start_idx + limit]
+    return _token_ids_page(prev, limit)
+
+
+@query
+def get_tokens_page(prev: Opt[nat], take: Opt[nat]) -> Vec[TokenInfo]:
+    """Id, owner and metadata of the tokens after prev, at most max_query_batch_size of them."""
+    limit = min(take if take is not None else MAX_QUERY_BATCH_SIZE, MAX_QUERY_BATCH_SIZE)
+    return _token_infos(_token_ids_page(prev, limit))
+
+
+@query
+def query_tokens_by_trait(filters: Vec[Tuple[str, MetadataValue]], prev: Opt[nat], take: Opt[nat]) -> Vec[TokenInfo]:
+    """Tokens after prev whose metadata has every (key, value) filter, at most max_query_batch_size of them."""
+    limit = min(take if take is not None else MAX_QUERY_BATCH_SIZE, MAX_QUERY_BATCH_SIZE)
+    return _token_infos(_trait_token_ids(filters, prev, limit))
 
 
 @query
 def icrc7_tokens_of(account: Account, prev: Opt[nat], take: Opt[nat]) -> Vec[nat]:
     """Returns a paginated list of token IDs owned by the specified account."""
+    limit = take if take is not None else 100
+    if _index_ready("owner_tokens"):
+        after = _token_member(prev) if prev is not None else None
+        members = _owner_tokens(_account_to_str(account)).items(after, limit)
+        return [int(member[2:]) for member in members]
+    
     principal = account["owner"].to_str()
     subaccount = _subaccount_to_hex(account.get("subaccount"))
     
@@ -606,7 +1985,6 @@ def icrc7_tokens_of(account: Account, prev: Opt[nat], take: Opt[nat]) -> Vec[nat
         else:
             return []
     
-    limit = take if take is not None else 100
     return owned_ids[start_idx:start_idx + limit]
 
 
@@ -617,10 +1995,19 @@ def icrc7_tokens_of(account: Account, prev: Opt[nat], take: Opt[nat]) -> Vec[nat
 @update
 def icrc7_transfer(args: Vec[TransferArg]) -> Vec[Opt[TransferResult]]:
     """Transfer NFTs from the caller to another account."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [TransferResult(Err=TransferError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(TransferResult(Err=TransferError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         token = _get_token(arg["token_id"])
         
         if not token:
@@ -648,18 +2035,22 @@ def icrc7_transfer(args: Vec[TransferArg]) -> Vec[Opt[TransferResult]]:
         old_owner = token.owner_principal
         old_subaccount = token.owner_subaccount
         
+        _unindex_token(token)
         token.owner_principal = to_account["owner"].to_str()
         token.owner_subaccount = _subaccount_to_hex(to_account.get("subaccount"))
+        _index_token(token)
         
         # Clear token-level approvals for this token
-        all_approvals = NFTApproval.instances()
-        for approval in all_approvals:
-            if approval.approval_type == "token" and approval.token_id == int(arg["token_id"]):
-                approval.delete()
+        for approval in _get_token_approvals(arg["token_id"]):
+            _delete_approval(approval)
+        
+        # A token that changes hands is likely to be read next, so cache its metadata
+        _token_metadata(arg["token_id"], token)
         
         # Log transaction
         memo = arg.get("memo")
         tx_id = _log_transaction(
+            batch,
             kind="transfer",
             token_id=int(arg["token_id"]),
             from_principal=old_owner,
@@ -672,6 +2063,7 @@ def icrc7_transfer(args: Vec[TransferArg]) -> Vec[Opt[TransferResult]]:
         logger.info(f"Transfer: token {arg['token_id']} from {old_owner} to {token.owner_principal}")
         results.append(TransferResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
@@ -702,24 +2094,21 @@ def icrc37_get_token_approvals(token_id: nat, prev: Opt[Account], take: Opt[nat]
     if not token:
         return []
     
-    all_approvals = NFTApproval.instances()
-    token_approvals = [
-        a for a in all_approvals
-        if a.approval_type == "token" and a.token_id == int(token_id)
-    ]
-    
-    # Filter expired
-    now = ic.time()
-    valid_approvals = [
-        a for a in token_approvals
-        if a.expires_at == 0 or a.expires_at > now
-    ]
+    after = None
+    if prev is not None:
+        owner_account = Account(
+            owner=Principal.from_str(token.owner_principal),
+            subaccount=bytes.fromhex(token.owner_subaccount) if token.owner_subaccount else None
+        )
+        after = _get_approval_id("token", int(token_id), owner_account, prev)
     
-    # Pagination (simplified - not using prev for now)
     limit = take if take is not None else 100
+    valid_approvals = _unexpired_approvals(
+        lambda after, count: _get_token_approvals(token_id, after, count), after, limit
+    )
     
     results = []
-    for approval in valid_approvals[:limit]:
+    for approval in valid_approvals:
         results.append(TokenApproval(
             token_id=token_id,
             approval_info=ApprovalInfo(
@@ -740,28 +2129,15 @@ def icrc37_get_token_approvals(token_id: nat, prev: Opt[Account], take: Opt[nat]
 @query
 def icrc37_get_collection_approvals(owner: Account, prev: Opt[Account], take: Opt[nat]) -> Vec[CollectionApproval]:
     """Get all collection-level approvals for an owner."""
-    owner_principal = owner["owner"].to_str()
-    owner_subaccount = _subaccount_to_hex(owner.get("subaccount"))
-    
-    all_approvals = NFTApproval.instances()
-    collection_approvals = [
-        a for a in all_approvals
-        if a.approval_type == "collection"
-        and a.owner_principal == owner_principal
-        and a.owner_subaccount == owner_subaccount
-    ]
-    
-    # Filter expired
-    now = ic.time()
-    valid_approvals = [
-        a for a in collection_approvals
-        if a.expires_at == 0 or a.expires_at > now
-    ]
-    
+    owner_key = _account_to_str(owner)
+    after = _get_approval_id("collection", 0, owner, prev) if prev is not None else None
     limit = take if take is not None else 100
+    valid_approvals = _unexpired_approvals(
+        lambda after, count: _get_collection_approvals(owner_key, after, count), after, limit
+    )
     
     results = []
-    for approval in valid_approvals[:limit]:
+    for approval in valid_approvals:
         results.append(CollectionApproval(
             approval_info=ApprovalInfo(
                 spender=Account(
@@ -785,10 +2161,19 @@ def icrc37_get_collection_approvals(owner: Account, prev: Opt[Account], take: Op
 @update
 def icrc37_approve_tokens(args: Vec[ApproveTokenArg]) -> Vec[Opt[ApproveTokenResult]]:
     """Approve a spender for specific tokens."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [ApproveTokenResult(Err=ApproveTokenError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(ApproveTokenResult(Err=ApproveTokenError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         token = _get_token(arg["token_id"])
         
         if not token:
@@ -811,8 +2196,8 @@ def icrc37_approve_tokens(args: Vec[ApproveTokenArg]) -> Vec[Opt[ApproveTokenRes
         spender = approval_info["spender"]
         approval_id = _get_approval_id("token", int(arg["token_id"]), caller_account, spender)
         
-        approval = NFTApproval(
-            id=approval_id,
+        approval = _save_approval(
+            approval_id,
             approval_type="token",
             token_id=int(arg["token_id"]),
             owner_principal=caller.to_str(),
@@ -824,6 +2209,7 @@ def icrc37_approve_tokens(args: Vec[ApproveTokenArg]) -> Vec[Opt[ApproveTokenRes
         )
         
         tx_id = _log_transaction(
+            batch,
             kind="approve",
             token_id=int(arg["token_id"]),
             from_principal=caller.to_str(),
@@ -834,16 +2220,26 @@ def icrc37_approve_tokens(args: Vec[ApproveTokenArg]) -> Vec[Opt[ApproveTokenRes
         logger.info(f"Approve: token {arg['token_id']} for spender {spender['owner'].to_str()}")
         results.append(ApproveTokenResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
 @update
 def icrc37_approve_collection(args: Vec[ApproveCollectionArg]) -> Vec[Opt[ApproveCollectionResult]]:
     """Approve a spender for all tokens owned by the caller."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [ApproveCollectionResult(Err=ApproveCollectionError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(ApproveCollectionResult(Err=ApproveCollectionError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         approval_info = arg["approval_info"]
         caller_account = Account(
             owner=caller,
@@ -853,8 +2249,8 @@ def icrc37_approve_collection(args: Vec[ApproveCollectionArg]) -> Vec[Opt[Approv
         
         approval_id = _get_approval_id("collection", 0, caller_account, spender)
         
-        approval = NFTApproval(
-            id=approval_id,
+        approval = _save_approval(
+            approval_id,
             approval_type="collection",
             token_id=0,
             owner_principal=caller.to_str(),
@@ -866,6 +2262,7 @@ def icrc37_approve_collection(args: Vec[ApproveCollectionArg]) -> Vec[Opt[Approv
         )
         
         tx_id = _log_transaction(
+            batch,
             kind="approve_collection",
             token_id=0,
             from_principal=caller.to_str(),
@@ -876,16 +2273,26 @@ def icrc37_approve_collection(args: Vec[ApproveCollectionArg]) -> Vec[Opt[Approv
         logger.info(f"Approve collection for spender {spender['owner'].to_str()}")
         results.append(ApproveCollectionResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
 @update
 def icrc37_revoke_token_approvals(args: Vec[RevokeTokenApprovalArg]) -> Vec[Opt[RevokeTokenApprovalResult]]:
     """Revoke approvals for specific tokens."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [RevokeTokenApprovalResult(Err=RevokeTokenApprovalError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(RevokeTokenApprovalResult(Err=RevokeTokenApprovalError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         token = _get_token(arg["token_id"])
         
         if not token:
@@ -910,16 +2317,15 @@ def icrc37_revoke_token_approvals(args: Vec[RevokeTokenApprovalArg]) -> Vec[Opt[
             if not approval:
                 results.append(RevokeTokenApprovalResult(Err=RevokeTokenApprovalError(ApprovalDoesNotExist=null)))
                 continue
-            approval.delete()
+            _delete_approval(approval)
         else:
             # Revoke all approvals for this token
-            all_approvals = NFTApproval.instances()
-            for approval in all_approvals:
-                if approval.approval_type == "token" and approval.token_id == int(arg["token_id"]):
-                    if approval.owner_principal == caller.to_str():
-                        approval.delete()
+            for approval in _get_token_approvals(arg["token_id"]):
+                if approval.owner_principal == caller.to_str():
+                    _delete_approval(approval)
         
         tx_id = _log_transaction(
+            batch,
             kind="revoke",
             token_id=int(arg["token_id"]),
             from_principal=caller.to_str()
@@ -928,16 +2334,26 @@ def icrc37_revoke_token_approvals(args: Vec[RevokeTokenApprovalArg]) -> Vec[Opt[
         logger.info(f"Revoke approval: token {arg['token_id']}")
         results.append(RevokeTokenApprovalResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
 @update
 def icrc37_revoke_collection_approvals(args: Vec[RevokeCollectionApprovalArg]) -> Vec[Opt[RevokeCollectionApprovalResult]]:
     """Revoke collection-level approvals."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [RevokeCollectionApprovalResult(Err=RevokeCollectionApprovalError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(RevokeCollectionApprovalResult(Err=RevokeCollectionApprovalError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         caller_account = Account(
             owner=caller,
             subaccount=arg.get("from_subaccount")
@@ -951,17 +2367,14 @@ def icrc37_revoke_collection_approvals(args: Vec[RevokeCollectionApprovalArg]) -
             if not approval:
                 results.append(RevokeCollectionApprovalResult(Err=RevokeCollectionApprovalError(ApprovalDoesNotExist=null)))
                 continue
-            approval.delete()
+            _delete_approval(approval)
         else:
             # Revoke all collection approvals for this owner
-            all_approvals = NFTApproval.instances()
-            owner_sub = _subaccount_to_hex(arg.get("from_subaccount"))
-            for approval in all_approvals:
-                if approval.approval_type == "collection":
-                    if approval.owner_principal == caller.to_str() and approval.owner_subaccount == owner_sub:
-                        approval.delete()
+            for approval in _get_collection_approvals(_account_to_str(caller_account)):
+                _delete_approval(approval)
         
         tx_id = _log_transaction(
+            batch,
             kind="revoke_collection",
             token_id=0,
             from_principal=caller.to_str()
@@ -970,16 +2383,26 @@ def icrc37_revoke_collection_approvals(args: Vec[RevokeCollectionApprovalArg]) -
         logger.info(f"Revoke collection approval")
         results.append(RevokeCollectionApprovalResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
 @update
 def icrc37_transfer_from(args: Vec[TransferFromArg]) -> Vec[Opt[TransferFromResult]]:
     """Transfer NFTs on behalf of the owner (if approved)."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return [TransferFromResult(Err=TransferFromError(GenericBatchError=oversized))]
+    
     caller = ic.caller()
+    batch = CollectionBatch()
     results = []
     
-    for arg in args:
+    for index, arg in enumerate(args):
+        if _budget_exhausted():
+            results.extend(TransferFromResult(Err=TransferFromError(GenericBatchError=_unprocessed_error())) for _ in args[index:])
+            break
+        
         token = _get_token(arg["token_id"])
         
         if not token:
@@ -1014,18 +2437,22 @@ def icrc37_transfer_from(args: Vec[TransferFromArg]) -> Vec[Opt[TransferFromResu
         old_owner = token.owner_principal
         old_subaccount = token.owner_subaccount
         
+        _unindex_token(token)
         token.owner_principal = to_account["owner"].to_str()
         token.owner_subaccount = _subaccount_to_hex(to_account.get("subaccount"))
+        _index_token(token)
         
         # Clear token-level approvals for this token
-        all_approvals = NFTApproval.instances()
-        for approval in all_approvals:
-            if approval.approval_type == "token" and approval.token_id == int(arg["token_id"]):
-                approval.delete()
+        for approval in _get_token_approvals(arg["token_id"]):
+            _delete_approval(approval)
+        
+        # A token that changes hands is likely to be read next, so cache its metadata
+        _token_metadata(arg["token_id"], token)
         
         # Log transaction
         memo = arg.get("memo")
         tx_id = _log_transaction(
+            batch,
             kind="transfer_from",
             token_id=int(arg["token_id"]),
             from_principal=old_owner,
@@ -1040,6 +2467,7 @@ def icrc37_transfer_from(args: Vec[TransferFromArg]) -> Vec[Opt[TransferFromResu
         logger.info(f"Transfer_from: token {arg['token_id']} by {caller.to_str()}")
         results.append(TransferFromResult(Ok=tx_id))
     
+    batch.commit()
     return results
 
 
@@ -1051,7 +2479,8 @@ def icrc37_transfer_from(args: Vec[TransferFromArg]) -> Vec[Opt[TransferFromResu
 def mint(arg: MintArg) -> MintResult:
     """Mint a new NFT. Only allowed in test mode or by collection owner."""
     caller = ic.caller()
-    collection = _get_collection()
+    batch = CollectionBatch()
+    collection = batch.collection
     
     # Check authorization (test mode allows anyone to mint)
     if collection.test_mode != 1:
@@ -1059,51 +2488,47 @@ def mint(arg: MintArg) -> MintResult:
         # For now, we'll allow anyone in test mode
         return MintResult(Err=MintError(Unauthorized=null))
     
-    # Check supply cap
-    if collection.supply_cap > 0 and collection.total_supply >= collection.supply_cap:
+    # Check supply cap (tokens waiting in the mint queue count as minted)
+    if collection.supply_cap > 0 and batch.total_supply + (collection.mints_queued or 0) >= collection.supply_cap:
         return MintResult(Err=MintError(SupplyCapReached=null))
     
-    # Check token ID doesn't exist
-    existing = _get_token(arg["token_id"])
-    if existing:
-        return MintResult(Err=MintError(TokenIdAlreadyExists=null))
-    
-    # Convert metadata to JSON
-    import json
-    metadata_dict = {}
-    if arg.get("metadata"):
-        for key, value in arg["metadata"]:
-            if "Text" in value:
-                metadata_dict[key] = value["Text"]
-            elif "Nat" in value:
-                metadata_dict[key] = value["Nat"]
-            elif "Int" in value:
-                metadata_dict[key] = value["Int"]
-    
-    # Create token
+    # Check token ID doesn't exist and isn't reserved by a queued batch mint
     owner = arg["owner"]
-    token = NFTToken(
-        id=int(arg["token_id"]),
-        owner_principal=owner["owner"].to_str(),
-        owner_subaccount=_subaccount_to_hex(owner.get("subaccount")),
-        metadata_json=json.dumps(metadata_dict)
-    )
+    run = _new_mint_run(arg["token_id"], 1, owner, _encode_metadata(arg.get("metadata")), False)
+    if _mint_conflict([run], collection):
+        return MintResult(Err=MintError(TokenIdAlreadyExists=null))
     
-    # Update supply
-    collection.total_supply += 1
-    
-    # Log transaction
-    tx_id = _log_transaction(
-        kind="mint",
-        token_id=int(arg["token_id"]),
-        to_principal=owner["owner"].to_str(),
-        to_subaccount=_subaccount_to_hex(owner.get("subaccount"))
-    )
+    tx_id = _mint_token(batch, run["token_id"], run["owner"], run["subaccount"], run["metadata"])
+    metadata_cache.put(run["token_id"], _decode_metadata(run["metadata"]))
     
     logger.info(f"Mint: token {arg['token_id']} to {owner['owner'].to_str()}")
+    batch.commit()
     return MintResult(Ok=tx_id)
 
 
+@update
+def mint_batch(args: Vec[MintArg]) -> MintBatchResult:
+    """Mint up to MAX_UPDATE_BATCH_SIZE NFTs at once; tokens past the instruction budget are minted by a timer."""
+    oversized = _oversized_batch(len(args))
+    if oversized:
+        return MintBatchResult(Err=MintError(GenericBatchError=oversized))
+    
+    batch = CollectionBatch()
+    runs = [
+        _new_mint_run(arg["token_id"], 1, arg["owner"], _encode_metadata(arg.get("metadata")), False)
+        for arg in args
+    ]
+    return _mint_runs(batch, runs)
+
+
+@update
+def mint_range(start_id: nat, count: nat, owner: Account, metadata_template: Opt[Vec[Tuple[str, MetadataValue]]]) -> MintBatchResult:
+    """Mint token ids start_id .. start_id + count - 1 to one owner; "{token_id}" in Text metadata becomes each id."""
+    batch = CollectionBatch()
+    runs = [_new_mint_run(start_id, count, owner, _encode_metadata(metadata_template), True)]
+    return _mint_runs(batch, runs)
+
+
 @query
 def icrc7_supported_standards() -> Vec[StandardRecord]:
     """Returns the list of standards supported by this canister."""
@@ -1114,26 +2539,95 @@ def icrc7_supported_standards() -> Vec[StandardRecord]:
 
 
 @query
-def get_transactions(start: nat, length: nat) -> Vec[TransactionRecord]:
-    """Get transaction history (for debugging/indexer)."""
-    all_txs = NFTTransactionLog.instances()
-    sorted_txs = sorted(all_txs, key=lambda x: x.id)
-    result = []
-    for tx in sorted_txs[int(start):int(start) + int(length)]:
-        result.append(TransactionRecord(
-            id=tx.id,
-            kind=tx.kind,
-            timestamp=tx.timestamp,
-            token_id=tx.token_id,
-            from_principal=tx.from_principal,
-            from_subaccount=tx.from_subaccount,
-            to_principal=tx.to_principal,
-            to_subaccount=tx.to_subaccount,
-            spender_principal=tx.spender_principal,
-            spender_subaccount=tx.spender_subaccount,
-            memo=tx.memo
-        ))
-    return result
+def get_transactions(start: nat, length: nat) -> GetTransactionsResponse:
+    """Up to MAX_PAGE_SIZE transactions from id start on (DEFAULT_PAGE_SIZE when length is 0)."""
+    # Transaction ids come from the dense tx_count counter, so the window is a key range
+    log_length = _get_collection().tx_count
+    end = min(int(start) + _clamp_page_size(int(length)), log_length)
+    return GetTransactionsResponse(
+        log_length=log_length,
+        transactions=_block_records(range(int(start), end))
+    )
+
+
+@query
+def get_token_history(token_id: nat, prev: Opt[nat], take: Opt[nat]) -> Vec[TransactionRecord]:
+    """Blocks that involve one token, newest first, all older than block prev."""
+    limit = min(take if take is not None else MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    if not _index_ready("token_history"):
+        txs = sorted(
+            (
+                tx for tx in NFTTransactionLog.instances()
+                if tx.token_id == int(token_id)
+                and tx.kind not in ("approve_collection", "revoke_collection")
+                and (prev is None or tx.id < prev)
+            ),
+            key=lambda tx: tx.id,
+            reverse=True
+        )
+        return [_transaction_record(tx) for tx in txs[:limit]]
+    
+    return _block_records(_history_page(f"t/{int(token_id)}", prev, limit))
+
+
+@query
+def get_account_nft_transactions(account: Account, prev: Opt[nat], take: Opt[nat]) -> Vec[TransactionRecord]:
+    """Blocks where the account is sender, recipient or spender, newest first, all older than block prev."""
+    limit = min(take if take is not None else MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    account_key = _account_to_str(account)
+    if not _index_ready("account_history"):
+        txs = sorted(
+            (
+                tx for tx in NFTTransactionLog.instances()
+                if account_key in _transaction_accounts(tx)
+                and (prev is None or tx.id < prev)
+            ),
+            key=lambda tx: tx.id,
+            reverse=True
+        )
+        return [_transaction_record(tx) for tx in txs[:limit]]
+    
+    return _block_records(_history_page(f"a/{account_key}", prev, limit))
+
+
+@query
+def get_audit_stats() -> AuditStats:
+    """Audit mode and how many records/bytes it has written."""
+    return AuditStats(
+        mode=audit_sink.mode,
+        sample_rate=audit_sink.sample_rate,
+        records_seen=audit_sink.records_seen,
+        records_written=audit_sink.records_written,
+        bytes_written=audit_sink.bytes_written,
+        journal_entries=audit_journal.len(),
+        sampled_entries=audit_samples.len()
+    )
+
+
+@query
+def get_approval_sweep_stats() -> ApprovalSweepStats:
+    """Approvals waiting to expire and how many expired ones the sweeper has deleted."""
+    return _approval_sweep_stats()
+
+
+@update
+def sweep_expired_approvals() -> ApprovalSweepResult:
+    """Run the expired-approval sweep now instead of waiting for its timer (test mode only)."""
+    if _get_collection().test_mode != 1:
+        return ApprovalSweepResult(Err=GenericError(error_code=1, message="Only available in test mode"))
+    _reclaim_expired_approvals()
+    return ApprovalSweepResult(Ok=_approval_sweep_stats())
+
+
+@query
+def get_metadata_cache_stats() -> MetadataCacheStats:
+    """Size of the token metadata cache and its hits/misses in update calls since the last upgrade."""
+    return MetadataCacheStats(
+        size=len(metadata_cache.entries),
+        capacity=metadata_cache.capacity,
+        hits=metadata_cache.hits,
+        misses=metadata_cache.misses
+    )
 
 
 @query
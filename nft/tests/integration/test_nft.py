@@ -7,6 +7,7 @@ Uses dfx canister calls with --output json to test the deployed canister.
 import json
 import subprocess
 import sys
+import time
 
 # Colors for output
 GREEN = "\033[92m"
@@ -17,6 +18,11 @@ RESET = "\033[0m"
 passed = 0
 failed = 0
 
+# Init argument the canister is deployed with (see entrypoint.sh); upgrades pass it again
+INIT_ARG = '(record { name = "Test NFT Collection"; symbol = "TNFT"; description = opt "Integration test NFT collection"; supply_cap = null; test = opt true })'
+# Same collection with a batch budget too small for a single item (test mode, until the next upgrade)
+TINY_BUDGET_INIT_ARG = INIT_ARG.replace("test = opt true", "test = opt true; batch_instruction_budget = opt (1 : nat64)")
+
 
 def dfx_call(method: str, args: str = "()", identity: str = None) -> dict:
     """Call a canister method using dfx and return JSON result."""
@@ -35,6 +41,27 @@ def dfx_call(method: str, args: str = "()", identity: str = None) -> dict:
         return {"raw": result.stdout.strip()}
 
 
+def upgrade_canister(init_arg: str = INIT_ARG) -> bool:
+    """Upgrade the deployed canister in place with the same code and the given init argument."""
+    cmd = ["dfx", "deploy", "nft_backend", "--upgrade-unchanged", "--argument", init_arg, "--yes"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"dfx deploy failed: {result.stderr}")
+        return False
+    return True
+
+
+def batch_errors(result) -> list:
+    """Collect the GenericBatchError records in a batch result, in order."""
+    if isinstance(result, dict):
+        if "GenericBatchError" in result:
+            return [result["GenericBatchError"]]
+        return [e for v in result.values() for e in batch_errors(v)]
+    if isinstance(result, list):
+        return [e for v in result for e in batch_errors(v)]
+    return []
+
+
 def parse_nat(value):
     """Parse a nat value that may be a string with underscores or an int."""
     if isinstance(value, int):
@@ -46,6 +73,25 @@ def parse_nat(value):
     return value
 
 
+def balance_of(principal: str):
+    """icrc7_balance_of of a principal's default account."""
+    return parse_nat(dfx_call("icrc7_balance_of", f'(record {{ owner = principal "{principal}"; subaccount = null }})'))
+
+
+def token_ids(result) -> list:
+    """Token ids of an icrc7_tokens / icrc7_tokens_of result, as ints."""
+    if not isinstance(result, list):
+        return result
+    return [parse_nat(token_id) for token_id in result]
+
+
+def spender_owners(approvals) -> list:
+    """Spender principals of a list of token or collection approvals."""
+    if not isinstance(approvals, list):
+        return approvals
+    return [approval["approval_info"]["spender"]["owner"] for approval in approvals]
+
+
 def get_principal(identity: str = None) -> str:
     """Get the principal for an identity."""
     cmd = ["dfx", "identity", "get-principal"]
@@ -182,14 +228,28 @@ def run_tests():
     print()
     print("--- Ownership Tests ---")
 
-    result = dfx_call("icrc7_owner_of", "(1 : nat)")
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat })")
     assert_contains(result, alice, "NFT #1 is owned by alice")
 
-    result = dfx_call("icrc7_owner_of", "(2 : nat)")
+    result = dfx_call("icrc7_owner_of", "(vec { 2 : nat })")
     assert_contains(result, bob, "NFT #2 is owned by bob")
 
-    result = dfx_call("icrc7_owner_of", "(999 : nat)")
-    assert_true(result is None or result == [] or "null" in str(result), "non-existent token returns null")
+    result = dfx_call("icrc7_owner_of", "(vec { 999 : nat })")
+    assert_true(result == [[]] or "null" in str(result), "non-existent token returns null")
+
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat; 2 : nat; 999 : nat })")
+    assert_true(isinstance(result, list) and len(result) == 3, "icrc7_owner_of answers a batch of ids")
+    assert_contains(result[0] if isinstance(result, list) else result, alice, "batched owner of NFT #1 is alice")
+    assert_contains(result[1] if isinstance(result, list) else result, bob, "batched owner of NFT #2 is bob")
+
+    result = dfx_call("icrc7_token_metadata", "(vec { 1 : nat; 999 : nat })")
+    assert_contains(result, "Alice NFT", "icrc7_token_metadata answers a batch of ids")
+
+    result = dfx_call("icrc7_max_query_batch_size")
+    assert_contains(result, "100", "icrc7_max_query_batch_size is advertised")
+
+    result = dfx_call("icrc7_max_update_batch_size")
+    assert_contains(result, "100", "icrc7_max_update_batch_size is advertised")
 
     # ==========================================
     # Balance Tests
@@ -225,6 +285,11 @@ def run_tests():
     assert_true(isinstance(result, list), "icrc7_tokens returns a list")
     assert_true(len(result) == 3, "icrc7_tokens returns 3 tokens")
 
+    result = dfx_call("get_tokens_page", "(null, opt (2 : nat))")
+    assert_true(isinstance(result, list) and len(result) == 2, "get_tokens_page returns take tokens")
+    assert_contains(result, alice, "get_tokens_page includes owners")
+    assert_contains(result, "Alice NFT", "get_tokens_page includes metadata")
+
     result = dfx_call(
         "icrc7_tokens_of",
         f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, null)',
@@ -247,7 +312,7 @@ def run_tests():
     assert_contains(result, "Ok", "alice transfers NFT #1 to charlie")
 
     # Verify ownership changed
-    result = dfx_call("icrc7_owner_of", "(1 : nat)")
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat })")
     assert_contains(result, charlie, "NFT #1 is now owned by charlie")
 
     # Try transfer without ownership (alice tries to transfer #2 which belongs to bob)
@@ -301,7 +366,7 @@ def run_tests():
     assert_contains(result, "Ok", "alice transfers NFT #2 from bob to charlie")
 
     # Verify ownership changed
-    result = dfx_call("icrc7_owner_of", "(2 : nat)")
+    result = dfx_call("icrc7_owner_of", "(vec { 2 : nat })")
     assert_contains(result, charlie, "NFT #2 is now owned by charlie")
 
     # Transfer from without approval fails
@@ -334,7 +399,7 @@ def run_tests():
     assert_contains(result, "Ok", "deployer transfers NFT #1 from charlie to alice using collection approval")
 
     # Verify ownership
-    result = dfx_call("icrc7_owner_of", "(1 : nat)")
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat })")
     assert_contains(result, alice, "NFT #1 is now owned by alice")
 
     # ==========================================
@@ -344,8 +409,498 @@ def run_tests():
     print("--- Transaction History Tests ---")
 
     result = dfx_call("get_transactions", "(0 : nat, 20 : nat)")
-    assert_true(isinstance(result, list), "get_transactions returns a list")
-    assert_true(len(result) > 0, "transaction history is not empty")
+    transactions = result.get("transactions") if isinstance(result, dict) else None
+    assert_true(isinstance(transactions, list), "get_transactions returns a list of transactions")
+    assert_true(bool(transactions), "transaction history is not empty")
+    assert_true(parse_nat(result.get("log_length", 0)) >= len(transactions or []), "get_transactions reports the log length")
+
+    result = dfx_call("get_transactions", "(0 : nat, 0 : nat)")
+    assert_true(len(result.get("transactions") or []) <= 20, "get_transactions with length 0 returns the default page")
+    result = dfx_call("get_transactions", "(0 : nat, 100000 : nat)")
+    assert_true(len(result.get("transactions") or []) <= 100, "get_transactions caps the page at 100 blocks")
+
+    result = dfx_call("get_token_history", "(1 : nat, null, null)")
+    assert_true(isinstance(result, list) and len(result) > 1, "get_token_history lists NFT #1's blocks")
+    assert_true(
+        isinstance(result, list) and all(parse_nat(tx.get("token_id")) == 1 for tx in result),
+        "get_token_history only returns NFT #1's blocks",
+    )
+    assert_contains(result[-1] if isinstance(result, list) and result else result, "mint", "NFT #1's history ends with its mint")
+
+    result = dfx_call(
+        "get_account_nft_transactions",
+        f'(record {{ owner = principal "{bob}"; subaccount = null }}, null, null)',
+    )
+    assert_true(isinstance(result, list) and len(result) > 0, "get_account_nft_transactions lists bob's activity")
+    assert_contains(result, bob, "bob's activity only includes blocks involving bob")
+
+    # ==========================================
+    # Batch Mint Tests
+    # ==========================================
+    print()
+    print("--- Batch Mint Tests ---")
+
+    supply_before = parse_nat(dfx_call("icrc7_total_supply"))
+    log_before = parse_nat(dfx_call("get_transactions", "(0 : nat, 1 : nat)").get("log_length", 0))
+
+    result = dfx_call(
+        "mint_batch",
+        f'(vec {{ record {{ token_id = 10 : nat; owner = record {{ owner = principal "{alice}"; subaccount = null }}; metadata = null }}; record {{ token_id = 11 : nat; owner = record {{ owner = principal "{alice}"; subaccount = null }}; metadata = null }} }})',
+    )
+    assert_contains(result, "Ok", "mint_batch mints NFT #10 and #11")
+
+    # The collection counters are written once per batch; check they still count every item
+    result = dfx_call("icrc7_total_supply")
+    assert_equals(supply_before + 2, parse_nat(result), "mint_batch adds each token to the supply")
+    result = dfx_call("get_transactions", f"({log_before} : nat, 10 : nat)")
+    assert_equals(log_before + 2, parse_nat(result.get("log_length", 0)), "mint_batch logs one block per token")
+    assert_true(
+        sorted(parse_nat(tx.get("token_id")) for tx in result.get("transactions") or []) == [10, 11],
+        "the new blocks are the mints of NFT #10 and #11",
+    )
+
+    result = dfx_call(
+        "mint_range",
+        f'(100 : nat, 5 : nat, record {{ owner = principal "{charlie}"; subaccount = null }}, opt vec {{ record {{ "name"; variant {{ Text = "Drop #{{token_id}}" }} }}; record {{ "background"; variant {{ Text = "gold" }} }} }})',
+    )
+    assert_contains(result, "Ok", "mint_range mints NFT #100 to #104")
+
+    result = dfx_call("icrc7_total_supply")
+    assert_equals(10, result, "icrc7_total_supply counts batch and range mints")
+
+    result = dfx_call("icrc7_token_metadata", "(vec { 103 : nat })")
+    assert_contains(result, "Drop #103", "mint_range fills {token_id} into the metadata template")
+
+    result = dfx_call(
+        "mint_range",
+        f'(104 : nat, 2 : nat, record {{ owner = principal "{charlie}"; subaccount = null }}, null)',
+    )
+    assert_contains(result, "TokenIdAlreadyExists", "mint_range rejects ranges overlapping minted tokens")
+
+    long_text = "x" * 4100
+    result = dfx_call(
+        "mint_range",
+        f'(900 : nat, 2 : nat, record {{ owner = principal "{charlie}"; subaccount = null }}, opt vec {{ record {{ "name"; variant {{ Text = "{long_text}" }} }} }})',
+    )
+    assert_contains(result, "GenericError", "mint_range rejects metadata too long to store")
+    result = dfx_call("icrc7_total_supply")
+    assert_equals(10, result, "the rejected range mints nothing")
+
+    # ==========================================
+    # Trait Query Tests
+    # ==========================================
+    print()
+    print("--- Trait Query Tests ---")
+
+    result = dfx_call("query_tokens_by_trait", '(vec { record { "background"; variant { Text = "gold" } } }, null, null)')
+    assert_true(
+        isinstance(result, list) and [parse_nat(t.get("token_id")) for t in result] == [100, 101, 102, 103, 104],
+        "query_tokens_by_trait lists the gold background drop",
+    )
+
+    result = dfx_call(
+        "query_tokens_by_trait",
+        '(vec { record { "background"; variant { Text = "gold" } }; record { "name"; variant { Text = "Drop #102" } } }, null, null)',
+    )
+    assert_true(
+        isinstance(result, list) and [parse_nat(t.get("token_id")) for t in result] == [102],
+        "query_tokens_by_trait intersects its filters",
+    )
+
+    result = dfx_call("query_tokens_by_trait", '(vec { record { "background"; variant { Text = "gold" } } }, opt (102 : nat), opt (1 : nat))')
+    assert_true(
+        isinstance(result, list) and [parse_nat(t.get("token_id")) for t in result] == [103],
+        "query_tokens_by_trait pages with prev and take",
+    )
+
+    result = dfx_call("query_tokens_by_trait", '(vec { record { "name"; variant { Text = "Alice NFT" } } }, null, null)')
+    assert_contains(result, alice, "query_tokens_by_trait returns the token's owner")
+
+    # ==========================================
+    # Owner Index Tests
+    # ==========================================
+    print()
+    print("--- Owner Index Tests ---")
+
+    alice_count = balance_of(alice)
+    bob_count = balance_of(bob)
+
+    for token_id in (20, 21):
+        result = dfx_call(
+            "mint",
+            f'(record {{ token_id = {token_id} : nat; owner = record {{ owner = principal "{alice}"; subaccount = null }}; metadata = opt vec {{ record {{ "name"; variant {{ Text = "Index NFT #{token_id}" }} }} }} }})',
+        )
+        assert_contains(result, "Ok", f"mint NFT #{token_id} to alice succeeds")
+
+    assert_equals(alice_count + 2, balance_of(alice), "alice's balance counts her new mints")
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{bob}"; subaccount = null }}; token_id = 20 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice transfers NFT #20 to bob")
+
+    assert_equals(alice_count + 1, balance_of(alice), "alice's balance drops after a transfer")
+    assert_equals(bob_count + 1, balance_of(bob), "bob's balance rises after a transfer")
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{alice}"; subaccount = null }}; token_id = 20 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_bob",
+    )
+    assert_contains(result, "Ok", "bob transfers NFT #20 back to alice")
+
+    assert_equals(bob_count, balance_of(bob), "bob's count goes back down")
+
+    # ==========================================
+    # Owner Token Paging Tests
+    # ==========================================
+    print()
+    print("--- Owner Token Paging Tests ---")
+
+    owned = token_ids(dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, null)',
+    ))
+    assert_true(
+        isinstance(owned, list) and owned == sorted(owned) and {1, 3, 20, 21} <= set(owned),
+        "icrc7_tokens_of lists alice's tokens in id order",
+    )
+    owned = owned if isinstance(owned, list) else []
+
+    result = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, opt (2 : nat))',
+    )
+    assert_equals(owned[:2], token_ids(result), "icrc7_tokens_of returns the first take tokens")
+
+    result = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt (1 : nat), opt (2 : nat))',
+    )
+    assert_equals([t for t in owned if t > 1][:2], token_ids(result), "icrc7_tokens_of pages with prev and take")
+
+    result = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt (2 : nat), null)',
+    )
+    assert_equals([t for t in owned if t > 2], token_ids(result), "icrc7_tokens_of continues after a prev alice does not own")
+
+    result = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt (21 : nat), null)',
+    )
+    assert_equals([], token_ids(result), "icrc7_tokens_of is empty past the owner's last token")
+
+    # ==========================================
+    # Token Id Paging Tests
+    # ==========================================
+    print()
+    print("--- Token Id Paging Tests ---")
+
+    result = dfx_call(
+        "mint",
+        f'(record {{ token_id = 25 : nat; owner = record {{ owner = principal "{charlie}"; subaccount = null }}; metadata = opt vec {{ record {{ "name"; variant {{ Text = "Index NFT #25" }} }} }} }})',
+    )
+    assert_contains(result, "Ok", "mint NFT #25 to charlie succeeds")
+
+    all_ids = token_ids(dfx_call("icrc7_tokens", "(null, null)"))
+    assert_true(
+        isinstance(all_ids, list) and all_ids == sorted(all_ids) and {1, 2, 3, 20, 21, 25} <= set(all_ids),
+        "icrc7_tokens lists every token in id order",
+    )
+    all_ids = all_ids if isinstance(all_ids, list) else []
+    assert_equals(dfx_call("icrc7_total_supply"), len(all_ids), "icrc7_tokens lists as many ids as the total supply")
+
+    result = dfx_call("icrc7_tokens", "(opt (2 : nat), opt (3 : nat))")
+    assert_equals([t for t in all_ids if t > 2][:3], token_ids(result), "icrc7_tokens pages with prev and take")
+
+    result = dfx_call("icrc7_tokens", "(opt (22 : nat), opt (1 : nat))")
+    assert_equals([25], token_ids(result), "icrc7_tokens seeks past a prev that is not a token id")
+
+    result = dfx_call("icrc7_tokens", "(opt (1000 : nat), null)")
+    assert_equals([], token_ids(result), "icrc7_tokens is empty past the last token")
+
+    # ==========================================
+    # Token Approval Index Tests
+    # ==========================================
+    print()
+    print("--- Token Approval Index Tests ---")
+
+    for spender in (bob, charlie):
+        result = dfx_call(
+            "icrc37_approve_tokens",
+            f'(vec {{ record {{ token_id = 3 : nat; approval_info = record {{ spender = record {{ owner = principal "{spender}"; subaccount = null }}; from_subaccount = null; expires_at = null; memo = null; created_at_time = null }} }} }})',
+            identity="test_alice",
+        )
+        assert_contains(result, "Ok", "alice approves a spender for NFT #3")
+
+    # Approvals are listed in approval id order, which follows the spender's principal text
+    spenders = sorted([bob, charlie])
+    result = dfx_call("icrc37_get_token_approvals", "(3 : nat, null, null)")
+    assert_equals(spenders, spender_owners(result), "icrc37_get_token_approvals lists both spenders of NFT #3")
+
+    result = dfx_call(
+        "icrc37_get_token_approvals",
+        f'(3 : nat, opt record {{ owner = principal "{spenders[0]}"; subaccount = null }}, opt (1 : nat))',
+    )
+    assert_equals(spenders[1:], spender_owners(result), "icrc37_get_token_approvals pages with prev and take")
+
+    result = dfx_call("icrc37_get_token_approvals", "(1 : nat, null, null)")
+    assert_equals([], spender_owners(result), "other tokens do not see NFT #3's approvals")
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{bob}"; subaccount = null }}; token_id = 3 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice transfers NFT #3 to bob")
+
+    result = dfx_call("icrc37_get_token_approvals", "(3 : nat, null, null)")
+    assert_equals([], spender_owners(result), "a transfer clears the token's approvals")
+
+    result = dfx_call(
+        "icrc37_is_approved",
+        f'(record {{ owner = principal "{charlie}"; subaccount = null }}, null, 3 : nat)',
+    )
+    assert_true(result == False or result == "false" or str(result) == "False", "charlie's approval on NFT #3 is gone")
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{alice}"; subaccount = null }}; token_id = 3 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_bob",
+    )
+    assert_contains(result, "Ok", "bob transfers NFT #3 back to alice")
+
+    # ==========================================
+    # Collection Approval Index Tests
+    # ==========================================
+    print()
+    print("--- Collection Approval Index Tests ---")
+
+    for spender in (bob, charlie):
+        result = dfx_call(
+            "icrc37_approve_collection",
+            f'(vec {{ record {{ approval_info = record {{ spender = record {{ owner = principal "{spender}"; subaccount = null }}; from_subaccount = null; expires_at = null; memo = null; created_at_time = null }} }} }})',
+            identity="test_alice",
+        )
+        assert_contains(result, "Ok", "alice approves a spender for her collection")
+
+    spenders = sorted([bob, charlie])
+    result = dfx_call(
+        "icrc37_get_collection_approvals",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, null)',
+    )
+    assert_equals(spenders, spender_owners(result), "icrc37_get_collection_approvals lists both of alice's spenders")
+
+    result = dfx_call(
+        "icrc37_get_collection_approvals",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt record {{ owner = principal "{spenders[0]}"; subaccount = null }}, opt (1 : nat))',
+    )
+    assert_equals(spenders[1:], spender_owners(result), "icrc37_get_collection_approvals pages with prev and take")
+
+    result = dfx_call(
+        "icrc37_get_collection_approvals",
+        f'(record {{ owner = principal "{charlie}"; subaccount = null }}, null, null)',
+    )
+    assert_equals([deployer], spender_owners(result), "charlie's collection approvals are listed separately")
+
+    result = dfx_call(
+        "icrc37_revoke_collection_approvals",
+        f'(vec {{ record {{ spender = opt record {{ owner = principal "{bob}"; subaccount = null }}; from_subaccount = null; memo = null; created_at_time = null }} }})',
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice revokes bob's collection approval")
+
+    result = dfx_call(
+        "icrc37_get_collection_approvals",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, null)',
+    )
+    assert_equals([charlie], spender_owners(result), "the revoked spender is dropped from alice's list")
+
+    result = dfx_call(
+        "icrc37_revoke_collection_approvals",
+        "(vec { record { spender = null; from_subaccount = null; memo = null; created_at_time = null } })",
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice revokes all her collection approvals")
+
+    result = dfx_call(
+        "icrc37_get_collection_approvals",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, null, null)',
+    )
+    assert_equals([], spender_owners(result), "alice has no collection approvals left")
+
+    # ==========================================
+    # Approval Expiry Sweep Tests
+    # ==========================================
+    print()
+    print("--- Approval Expiry Sweep Tests ---")
+
+    result = dfx_call("get_approval_sweep_stats")
+    reclaimed_before = parse_nat(result.get("reclaimed", 0)) if isinstance(result, dict) else 0
+
+    # An expiry already in the past: the approval is queued but no longer applies
+    expires_at = time.time_ns() - 60 * 1_000_000_000
+    result = dfx_call(
+        "icrc37_approve_tokens",
+        f'(vec {{ record {{ token_id = 21 : nat; approval_info = record {{ spender = record {{ owner = principal "{deployer}"; subaccount = null }}; from_subaccount = null; expires_at = opt ({expires_at} : nat64); memo = null; created_at_time = null }} }} }})',
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice approves deployer for NFT #21 with an expiry")
+
+    result = dfx_call("get_approval_sweep_stats")
+    queued = parse_nat(result.get("queued", 0)) if isinstance(result, dict) else 0
+    assert_true(isinstance(queued, int) and queued >= 1, "the approval is queued for the expiry sweep")
+
+    result = dfx_call(
+        "icrc37_is_approved",
+        f'(record {{ owner = principal "{deployer}"; subaccount = null }}, null, 21 : nat)',
+    )
+    assert_true(result == False or result == "false" or str(result) == "False", "an expired approval does not apply before the sweep")
+
+    # Run the sweep directly (test mode) instead of waiting for its interval timer
+    result = dfx_call("sweep_expired_approvals")
+    stats = result.get("Ok", {}) if isinstance(result, dict) else {}
+    assert_equals(reclaimed_before + 1, parse_nat(stats.get("reclaimed", 0)), "the sweep reclaims the expired approval")
+    assert_equals(queued - 1, parse_nat(stats.get("queued", 0)), "the reclaimed approval leaves the expiry queue")
+
+    result = dfx_call("icrc37_get_token_approvals", "(21 : nat, null, null)")
+    assert_equals([], spender_owners(result), "the reclaimed approval is no longer listed")
+
+    result = dfx_call(
+        "icrc37_is_approved",
+        f'(record {{ owner = principal "{deployer}"; subaccount = null }}, null, 21 : nat)',
+    )
+    assert_true(result == False or result == "false" or str(result) == "False", "deployer is no longer approved for NFT #21")
+
+    # ==========================================
+    # Metadata Cache Tests
+    # ==========================================
+    print()
+    print("--- Metadata Cache Tests ---")
+
+    # Repeated and missing ids in one batch, answered from the cache or the token rows
+    result = dfx_call("icrc7_token_metadata", "(vec { 20 : nat; 999 : nat; 21 : nat; 20 : nat })")
+    assert_true(isinstance(result, list) and len(result) == 4, "icrc7_token_metadata answers every id in the batch")
+    if isinstance(result, list) and len(result) == 4:
+        assert_contains(result[0], "Index NFT #20", "metadata of NFT #20 comes first")
+        assert_true(result[1] in ([], None), "a missing token has no metadata")
+        assert_contains(result[2], "Index NFT #21", "metadata of NFT #21 keeps its position")
+        assert_equals(result[0], result[3], "a repeated id gets the same metadata")
+
+    repeat = dfx_call("icrc7_token_metadata", "(vec { 20 : nat; 999 : nat; 21 : nat; 20 : nat })")
+    assert_equals(result, repeat, "icrc7_token_metadata answers the same on a second read")
+
+    # Batch mints skip the cache, so the first transfer of NFT #26 misses and fills it
+    # and the transfer back hits; query reads do not move the counters
+    result = dfx_call(
+        "mint_batch",
+        f'(vec {{ record {{ token_id = 26 : nat; owner = record {{ owner = principal "{alice}"; subaccount = null }}; metadata = opt vec {{ record {{ "name"; variant {{ Text = "Cache NFT #26" }} }} }} }} }})',
+    )
+    assert_contains(result, "Ok", "mint_batch mints NFT #26")
+    stats = dfx_call("get_metadata_cache_stats")
+    hits, misses = parse_nat(stats.get("hits", 0)), parse_nat(stats.get("misses", 0))
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{bob}"; subaccount = null }}; token_id = 26 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_alice",
+    )
+    assert_contains(result, "Ok", "alice transfers NFT #26 to bob")
+    stats = dfx_call("get_metadata_cache_stats")
+    assert_equals((hits, misses + 1), (parse_nat(stats.get("hits", 0)), parse_nat(stats.get("misses", 0))), "the first transfer misses the metadata cache")
+
+    result = dfx_call(
+        "icrc7_transfer",
+        f'(vec {{ record {{ from_subaccount = null; to = record {{ owner = principal "{alice}"; subaccount = null }}; token_id = 26 : nat; memo = null; created_at_time = null }} }})',
+        identity="test_bob",
+    )
+    assert_contains(result, "Ok", "bob transfers NFT #26 back to alice")
+    stats = dfx_call("get_metadata_cache_stats")
+    assert_equals((hits + 1, misses + 1), (parse_nat(stats.get("hits", 0)), parse_nat(stats.get("misses", 0))), "the second transfer hits the metadata cache")
+
+    result = dfx_call("icrc7_token_metadata", "(vec { 26 : nat })")
+    assert_contains(result, "Cache NFT #26", "icrc7_token_metadata reads NFT #26")
+
+    # ==========================================
+    # Batch Limit Tests
+    # ==========================================
+    print()
+    print("--- Batch Limit Tests ---")
+
+    # An update batch over the limit is rejected as a whole with one batch error
+    item = f'record {{ from_subaccount = null; to = record {{ owner = principal "{bob}"; subaccount = null }}; token_id = 1 : nat; memo = null; created_at_time = null }}'
+    result = dfx_call("icrc7_transfer", f"(vec {{ {'; '.join([item] * 101)} }})", identity="test_alice")
+    errors = batch_errors(result)
+    assert_true(isinstance(result, list) and len(result) == 1, "an oversized icrc7_transfer gets a single result")
+    assert_true(len(errors) == 1 and parse_nat(errors[0].get("error_code", 0)) == 1, "the oversized batch fails with GenericBatchError code 1")
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat })")
+    assert_contains(result, alice, "nothing in the oversized batch was applied")
+
+    # A query batch over the limit is rejected outright
+    result = dfx_call("icrc7_owner_of", f"(vec {{ {'; '.join(['1 : nat'] * 101)} }})")
+    assert_true(isinstance(result, dict) and "error" in result, "an oversized icrc7_owner_of is rejected")
+    result = dfx_call("icrc7_token_metadata", f"(vec {{ {'; '.join(['1 : nat'] * 101)} }})")
+    assert_true(isinstance(result, dict) and "error" in result, "an oversized icrc7_token_metadata is rejected")
+
+    # With no instruction budget left, every item reports it was not reached and nothing moves
+    assert_true(upgrade_canister(TINY_BUDGET_INIT_ARG), "canister upgrades with a tiny batch budget")
+    items = [
+        f'record {{ from_subaccount = null; to = record {{ owner = principal "{bob}"; subaccount = null }}; token_id = {token_id} : nat; memo = null; created_at_time = null }}'
+        for token_id in (1, 26)
+    ]
+    result = dfx_call("icrc7_transfer", f"(vec {{ {'; '.join(items)} }})", identity="test_alice")
+    errors = batch_errors(result)
+    assert_true(isinstance(result, list) and len(result) == 2, "every item of the batch gets a result")
+    assert_true(len(errors) == 2, "every unreached item is a GenericBatchError")
+    assert_true(all(parse_nat(e.get("error_code", 0)) == 2 for e in errors), "unreached items carry error code 2")
+    assert_true(all(e.get("message") for e in errors), "unreached items say why")
+    result = dfx_call("icrc7_owner_of", "(vec { 1 : nat; 26 : nat })")
+    assert_true(str(result).count(alice) == 2, "alice still owns NFT #1 and #26")
+    assert_true(upgrade_canister(), "canister upgrades back to the default batch budget")
+
+    # ==========================================
+    # Upgrade Tests
+    # ==========================================
+    print()
+    print("--- Upgrade Tests ---")
+
+    alice_count = balance_of(alice)
+    owner_page = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt (1 : nat), opt (3 : nat))',
+    )
+    id_page = dfx_call("icrc7_tokens", "(opt (3 : nat), opt (3 : nat))")
+    audit_stats = dfx_call("get_audit_stats")
+    assert_contains(audit_stats, "sampled", "audit records are sampled by default")
+
+    # Indexes live in stable memory and answer the same once the canister is upgraded
+    assert_true(upgrade_canister(), "canister upgrades in place")
+
+    assert_equals(alice_count, balance_of(alice), "icrc7_balance_of is unchanged right after an upgrade")
+
+    result = dfx_call(
+        "icrc7_tokens_of",
+        f'(record {{ owner = principal "{alice}"; subaccount = null }}, opt (1 : nat), opt (3 : nat))',
+    )
+    assert_equals(token_ids(owner_page), token_ids(result), "icrc7_tokens_of pages the same right after an upgrade")
+
+    result = dfx_call("icrc7_tokens", "(opt (3 : nat), opt (3 : nat))")
+    assert_equals(token_ids(id_page), token_ids(result), "icrc7_tokens pages the same right after an upgrade")
+
+    # The audit counters are saved in pre_upgrade rather than reset
+    result = dfx_call("get_audit_stats")
+    assert_true(
+        parse_nat(result.get("records_seen", 0)) >= parse_nat(audit_stats.get("records_seen", 0)) > 0,
+        "get_audit_stats keeps counting across an upgrade",
+    )
+
+    # The metadata cache starts empty after an upgrade and is refilled by a timer
+    result = dfx_call("icrc7_token_metadata", "(vec { 1 : nat; 20 : nat })")
+    assert_contains(result, "Alice NFT", "icrc7_token_metadata reads NFT #1 right after an upgrade")
+    assert_contains(result, "Index NFT #20", "icrc7_token_metadata reads NFT #20 right after an upgrade")
 
     # ==========================================
     # Final State Verification
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import zlib
+
 from kybra import (
     Opt,
     Principal,
@@ -11,19 +15,164 @@ from kybra import (
     init,
     nat,
     nat8,
+    nat64,
+    null,
+    post_upgrade,
+    pre_upgrade,
     query,
     text,
     update,
     void,
 )
-from kybra_simple_db import Database, Entity, Integer, String
+from kybra_simple_db import Database, Entity, Integer, Storage, String
 from kybra_simple_logging import get_logger
 
+# AuditSink and OrderedIndex are kept identical in the token and NFT canisters on
+# purpose: each canister is built from its own src directory, so there is no shared
+# module both can import. Change the two copies together.
+
+
+class AuditSink(Storage):
+    """
+    Audit storage handed to kybra_simple_db. What happens to each audit record
+    depends on the mode:
+
+    - off: dropped, only counted
+    - sampled (default): one record in sample_rate is kept as the original JSON
+      in samples; a record longer than MAX_SAMPLE_BYTES is journaled instead
+    - journal: every record is appended to journal as op (1 byte) + time in ns
+      (8 bytes) + entity key, without the entity data
+
+    The database still JSON-encodes each record before handing it over, so
+    "off" saves the storage writes but not that CPU cost. The counters live on
+    the heap; the canister saves them in pre_upgrade and restores them on load.
+    """
+
+    MODES = ("off", "sampled", "journal")
+    OPS = {"save": 1, "delete": 2, "update": 3}
+    MAX_KEY_BYTES = 200  # Entity keys, as bounded by the storage map
+    MAX_JOURNAL_ENTRY_BYTES = 1 + 8 + MAX_KEY_BYTES
+    MAX_SAMPLE_BYTES = 4096
+
+    def __init__(self, journal, samples):
+        self.journal = journal
+        self.samples = samples
+        self.mode = "sampled"
+        self.sample_rate = 100
+        self.records_seen = 0
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def configure(self, mode: str, sample_rate: int = None):
+        if mode not in AuditSink.MODES:
+            raise ValueError(
+                f"Unknown audit mode '{mode}', expected one of {AuditSink.MODES}"
+            )
+        if sample_rate is not None:
+            if sample_rate < 1:
+                raise ValueError("Audit sample rate must be at least 1")
+            self.sample_rate = sample_rate
+        self.mode = mode
+
+    def _encode_journal_entry(self, record: str) -> bytes:
+        # record is json.dumps([op, timestamp, key, data]) from Database._audit
+        op, _, key, _ = json.loads(record)
+        return (
+            bytes([AuditSink.OPS.get(op, 0)])
+            + ic.time().to_bytes(8, "big")
+            + key.encode()[: AuditSink.MAX_KEY_BYTES]
+        )
+
+    def _append(self, store, entry: bytes):
+        store.insert(store.len(), entry)
+        self.records_written += 1
+        self.bytes_written += len(entry)
+
+    def get(self, key):
+        if key == "_max_id":
+            return str(self.records_seen)
+        return None
+
+    def insert(self, key, value):
+        if key in ("_min_id", "_max_id"):
+            return
+        self.records_seen += 1
+
+        if self.mode == "off":
+            return
+        if self.mode == "sampled":
+            if self.records_seen % self.sample_rate:
+                return
+            sample = value.encode()
+            if len(sample) <= AuditSink.MAX_SAMPLE_BYTES:
+                self._append(self.samples, sample)
+                return
+        self._append(self.journal, self._encode_journal_entry(value))
+
+    def remove(self, key):
+        pass
+
+    def items(self):
+        return iter([])
+
+    def keys(self):
+        return iter([])
+
+    def __contains__(self, key):
+        return False
+
+
 # Initialize stable storage for the database
 storage = StableBTreeMap[str, str](
     memory_id=1, max_key_size=200, max_value_size=100_000
 )
-Database.init(db_storage=storage, audit_enabled=True)
+
+# Append-only audit journal and sampled records (see AuditSink). Kybra reads map
+# sizes from the source as literals; they are AuditSink.MAX_JOURNAL_ENTRY_BYTES and
+# AuditSink.MAX_SAMPLE_BYTES, so keep them in step.
+audit_journal = StableBTreeMap[nat64, blob](
+    memory_id=5, max_key_size=8, max_value_size=209
+)
+audit_samples = StableBTreeMap[nat64, blob](
+    memory_id=10, max_key_size=8, max_value_size=4096
+)
+audit_sink = AuditSink(audit_journal, audit_samples)
+Database.init(db_storage=storage, audit_enabled=True, db_audit=audit_sink)
+
+# Secondary index: account key -> that account's block ids (ascending by position)
+account_tx_index = StableBTreeMap[str, nat64](
+    memory_id=2, max_key_size=200, max_value_size=8
+)
+
+# Balance-ordered holder index (treap nodes, see OrderedIndex)
+holder_index = StableBTreeMap[str, str](
+    memory_id=3, max_key_size=200, max_value_size=500
+)
+
+# Compact cell for the hot ledger counters (see LedgerState)
+ledger_state = StableBTreeMap[nat8, blob](
+    memory_id=4, max_key_size=1, max_value_size=64
+)
+
+# Transaction log: block index -> binary block (see Block)
+blocks = StableBTreeMap[nat64, blob](memory_id=6, max_key_size=8, max_value_size=1024)
+
+# Recent transfer fingerprints, written through as they are recorded (see DedupIndex).
+# A value is one chunk of DedupIndex.ENTRIES_PER_CHUNK * ENTRY_SIZE bytes, with no
+# header. Kybra reads map sizes from the source as literals, so keep this in step.
+dedup_state = StableBTreeMap[nat64, blob](
+    memory_id=7, max_key_size=8, max_value_size=4_000
+)
+
+# Mints queued by mint_batch: sequence number -> encoded mint (see MintHelper)
+mint_queue = StableBTreeMap[nat64, blob](
+    memory_id=8, max_key_size=8, max_value_size=256
+)
+
+# ICRC-2 allowances with their per-owner and expiry indexes (see AllowanceHelper)
+allowances = StableBTreeMap[str, blob](
+    memory_id=9, max_key_size=300, max_value_size=300
+)
 
 logger = get_logger("token")
 
@@ -42,7 +191,8 @@ class TokenConfig(Entity):
     value = String()
 
 
-# Database Entity for transaction log (for indexer functionality)
+# Transaction log as written by earlier versions; rows are moved into blocks by
+# migrate_transaction_log and read from here until then
 class TransactionLog(Entity):
     __alias__ = "id"
     id = Integer()  # Block index / transaction ID
@@ -57,10 +207,180 @@ class TransactionLog(Entity):
     memo = String()  # Hex-encoded memo or empty
 
 
+# Database Entity tracking the progress of a mint_batch call
+class MintJob(Entity):
+    __alias__ = "id"
+    id = Integer()
+    total = Integer()  # Mints in the batch
+    minted = Integer()  # Mints applied so far
+
+
 # Register entity types
 Database.get_instance().register_entity_type(TokenBalance)
 Database.get_instance().register_entity_type(TokenConfig)
 Database.get_instance().register_entity_type(TransactionLog)
+Database.get_instance().register_entity_type(MintJob)
+
+
+class LedgerState:
+    """
+    Hot ledger counters held as native ints on the heap.
+
+    Every transfer touches total_supply and next_block_index, so instead of
+    TokenConfig rows they live here and are written to the ledger_state cell
+    once per update message (flush) and in pre_upgrade.
+    """
+
+    COUNTERS_KEY = 0
+    MIGRATION_KEY = 1
+    MINT_QUEUE_KEY = 2
+    AUDIT_KEY = 3  # AuditSink counters, see AuditHelper
+
+    total_supply = 0
+    next_block_index = 0
+    dirty = False
+
+    @staticmethod
+    def load():
+        raw = ledger_state.get(LedgerState.COUNTERS_KEY)
+        if raw:
+            LedgerState.total_supply = int.from_bytes(raw[:16], "big")
+            LedgerState.next_block_index = int.from_bytes(raw[16:24], "big")
+            LedgerState.dirty = False
+            return
+
+        # Earlier versions kept the counters as TokenConfig rows
+        for key in ("total_supply", "next_block_index"):
+            config = TokenConfig[key]
+            if config:
+                setattr(LedgerState, key, int(config.value or 0))
+                config.delete()
+                LedgerState.dirty = True
+        LedgerState.flush()
+
+    @staticmethod
+    def flush():
+        if not LedgerState.dirty:
+            return
+        ledger_state.insert(
+            LedgerState.COUNTERS_KEY,
+            LedgerState.total_supply.to_bytes(16, "big")
+            + LedgerState.next_block_index.to_bytes(8, "big"),
+        )
+        LedgerState.dirty = False
+
+
+LedgerState.load()
+
+
+class DedupIndex:
+    """
+    Fingerprints of recent transfers that set created_at_time, for ICRC-1
+    deduplication.
+
+    Entries live on the heap in buckets keyed by created_at_time // BUCKET_NANOS,
+    each a dict of sha256 fingerprint -> block index. created_at_time is part
+    of the fingerprint, so a lookup only ever checks one bucket, and a bucket
+    that has left the transaction window is dropped as a whole. Each entry is
+    also appended to its bucket's current chunk in dedup_state as it is
+    recorded, so an upgrade has nothing to flush and load reads them back.
+    """
+
+    TX_WINDOW_NANOS = 24 * 60 * 60 * 1_000_000_000
+    PERMITTED_DRIFT_NANOS = 2 * 60 * 1_000_000_000
+    BUCKET_NANOS = 60 * 60 * 1_000_000_000
+    ENTRY_SIZE = 40  # fingerprint (32) + block index (8)
+    ENTRIES_PER_CHUNK = 100
+    CHUNK_BITS = 20  # dedup_state keys are bucket_id << CHUNK_BITS | chunk number
+
+    buckets = {}
+
+    @staticmethod
+    def fingerprint(*parts) -> bytes:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(len(part).to_bytes(4, "big"))
+            digest.update(part)
+        return digest.digest()
+
+    @staticmethod
+    def check(created_at_time: int, *parts):
+        """
+        created_at_time checks for a call whose arguments are parts.
+        Returns (error, message, fingerprint); error is None or a one-case
+        dict that fits the ICRC-1 and ICRC-2 error variants alike, and the
+        fingerprint is recorded once the call has produced its block.
+        """
+        if created_at_time is None:
+            return None, None, None
+        now = ic.time()
+        DedupIndex.prune(now)
+
+        window_start = now - DedupIndex.PERMITTED_DRIFT_NANOS
+        if created_at_time + DedupIndex.TX_WINDOW_NANOS < window_start:
+            return {"TooOld": None}, "Transaction is too old", None
+        if created_at_time > now + DedupIndex.PERMITTED_DRIFT_NANOS:
+            return (
+                {"CreatedInFuture": CreatedInFutureError(ledger_time=now)},
+                "Transaction is created in the future",
+                None,
+            )
+
+        fingerprint = DedupIndex.fingerprint(*parts, str(created_at_time).encode())
+        duplicate_of = DedupIndex.find(fingerprint, created_at_time)
+        if duplicate_of is not None:
+            return (
+                {"Duplicate": DuplicateError(duplicate_of=duplicate_of)},
+                f"Duplicate of block {duplicate_of}",
+                fingerprint,
+            )
+        return None, None, fingerprint
+
+    @staticmethod
+    def find(fingerprint: bytes, created_at_time: int):
+        bucket = DedupIndex.buckets.get(created_at_time // DedupIndex.BUCKET_NANOS)
+        return bucket.get(fingerprint) if bucket else None
+
+    @staticmethod
+    def record(fingerprint: bytes, created_at_time: int, block_index: int):
+        bucket_id = created_at_time // DedupIndex.BUCKET_NANOS
+        bucket = DedupIndex.buckets.get(bucket_id)
+        if bucket is None:
+            bucket = DedupIndex.buckets[bucket_id] = {}
+        bucket[fingerprint] = block_index
+        key = DedupIndex.chunk_key(bucket_id, len(bucket) - 1)
+        chunk = dedup_state.get(key) or b""
+        dedup_state.insert(key, chunk + fingerprint + block_index.to_bytes(8, "big"))
+
+    @staticmethod
+    def chunk_key(bucket_id: int, position: int) -> int:
+        """dedup_state key of the chunk holding a bucket's entry at position."""
+        chunk = position // DedupIndex.ENTRIES_PER_CHUNK
+        return (bucket_id << DedupIndex.CHUNK_BITS) | chunk
+
+    @staticmethod
+    def prune(now: int):
+        """Drop buckets whose newest created_at_time is outside the window."""
+        window = DedupIndex.TX_WINDOW_NANOS + DedupIndex.PERMITTED_DRIFT_NANOS
+        first_live = (now - window) // DedupIndex.BUCKET_NANOS
+        for bucket_id in [b for b in DedupIndex.buckets if b < first_live]:
+            entries = len(DedupIndex.buckets[bucket_id])
+            for position in range(0, entries, DedupIndex.ENTRIES_PER_CHUNK):
+                dedup_state.remove(DedupIndex.chunk_key(bucket_id, position))
+            del DedupIndex.buckets[bucket_id]
+
+    @staticmethod
+    def load():
+        DedupIndex.buckets = {}
+        for key, raw in dedup_state.items():
+            bucket_id = key >> DedupIndex.CHUNK_BITS
+            bucket = DedupIndex.buckets.setdefault(bucket_id, {})
+            for pos in range(0, len(raw), DedupIndex.ENTRY_SIZE):
+                entry = raw[pos:][: DedupIndex.ENTRY_SIZE]
+                bucket[entry[:32]] = int.from_bytes(entry[32:], "big")
+
+
+DedupIndex.load()
 
 
 # ICRC-1 Types
@@ -81,10 +401,54 @@ class TransferArgs(Record):
     created_at_time: Opt[nat]
 
 
+class BadFeeError(Record):
+    expected_fee: nat
+
+
+class InsufficientFundsError(Record):
+    balance: nat
+
+
+class BadBurnError(Record):
+    min_burn_amount: nat
+
+
+class CreatedInFutureError(Record):
+    ledger_time: nat64
+
+
+class DuplicateError(Record):
+    duplicate_of: nat
+
+
+class GenericErrorRecord(Record):
+    error_code: nat
+    message: text
+
+
+class TransferError(Variant, total=False):
+    BadFee: BadFeeError
+    BadBurn: BadBurnError
+    InsufficientFunds: InsufficientFundsError
+    TooOld: null
+    CreatedInFuture: CreatedInFutureError
+    Duplicate: DuplicateError
+    TemporarilyUnavailable: null
+    GenericError: GenericErrorRecord
+
+
 class TransferResult(Record):
     success: bool
     block_index: Opt[nat]
     error: Opt[text]
+    icrc1_error: Opt[TransferError]  # Standard ICRC-1 error, when one applies
+
+
+class BatchTransferResult(Record):
+    results: Vec[TransferResult]  # One per processed transfer, in order
+    processed: nat  # Transfers attempted; the rest of the batch was not
+    complete: bool  # False when the batch stopped at the instruction budget
+    error: Opt[text]  # Set when the batch was rejected as a whole
 
 
 class MintArgs(Record):
@@ -99,6 +463,21 @@ class MintResult(Record):
     block_index: Opt[nat]
 
 
+class MintBatchResult(Record):
+    success: bool
+    error: Opt[text]
+    job_id: Opt[nat]  # Pass to get_mint_job to follow the rest of the batch
+    minted: nat  # Mints applied during this call
+    queued: nat  # Mints left for the timer to apply
+
+
+class MintJobInfo(Record):
+    id: nat
+    total: nat
+    minted: nat
+    complete: bool
+
+
 class TokenMetadataRecord(Record):
     name: text
     symbol: text
@@ -114,6 +493,18 @@ class InitArgs(Record):
     total_supply: nat
     fee: nat
     test: Opt[bool]
+    audit_mode: Opt[text]  # "off", "sampled" (default) or "journal"
+    audit_sample_rate: Opt[nat]
+
+
+class AuditStats(Record):
+    mode: text
+    sample_rate: nat
+    records_seen: nat
+    records_written: nat
+    bytes_written: nat
+    journal_entries: nat
+    sampled_entries: nat
 
 
 class HolderInfo(Record):
@@ -121,6 +512,13 @@ class HolderInfo(Record):
     balance: nat
 
 
+class IndexBackfillResult(Record):
+    success: bool
+    indexed: nat
+    total: nat
+    error: Opt[text]
+
+
 class TokenDistribution(Record):
     holders: Vec["HolderInfo"]
     total_supply: nat
@@ -133,6 +531,337 @@ TOKEN_SYMBOL = "SMPL"
 TOKEN_DECIMALS: nat8 = 8
 TOKEN_FEE: nat = 10_000
 
+# Largest values a block can record: ICRC-1 memos and subaccounts are at most
+# 32 bytes, and amounts and fees are stored as 128-bit integers
+MAX_MEMO_BYTES = 32
+MAX_SUBACCOUNT_BYTES = 32
+MAX_BLOCK_AMOUNT = 2**128 - 1
+
+# Instructions a batch may use, counting the balance write-back it still owes
+# (see BalanceBatch.over_budget), leaving headroom under the per-message limit
+BATCH_INSTRUCTION_BUDGET = 15_000_000_000
+
+# Most transfers icrc1_batch_transfer accepts in one call
+MAX_BATCH_TRANSFERS = 1000
+
+
+class Block:
+    """
+    Read-only view over a binary transaction log block.
+
+    Layout: kind (1 byte) | flags (1) | timestamp (8) | amount (16) | fee (16),
+    then each optional field whose flag is set as a 1-byte length followed by
+    raw bytes, in FIELDS order. Owners are stored as raw principal bytes;
+    approvals have an empty to_owner.
+    The header fields are decoded straight from their fixed offsets; the
+    variable part is only walked when an account or memo is read.
+    """
+
+    KINDS = ("transfer", "mint", "burn", "approve")
+    HEADER_SIZE = 42
+    # (field, flag); a zero flag marks a field that is always present
+    FIELDS = (
+        ("from_owner", 1),
+        ("from_subaccount", 2),
+        ("to_owner", 0),
+        ("to_subaccount", 4),
+        ("memo", 8),
+        ("created_at_time", 16),
+        ("spender", 32),  # Principal length (1) | principal | subaccount
+        ("expires_at", 64),
+        ("expected_allowance", 128),
+    )
+
+    def __init__(self, block_id: int, raw: bytes):
+        self.id = block_id
+        self.raw = raw
+        self._fields = None
+
+    @staticmethod
+    def encode(kind: str, timestamp: int, amount: int, fee: int, **fields) -> bytes:
+        flags = 0
+        body = b""
+        for name, flag in Block.FIELDS:
+            value = fields.get(name)
+            if not value and flag:
+                continue
+            value = value or b""
+            if len(value) > 255:
+                raise ValueError(f"Block field {name} is longer than 255 bytes")
+            flags |= flag
+            body += bytes([len(value)]) + value
+        return (
+            bytes([Block.KINDS.index(kind), flags])
+            + timestamp.to_bytes(8, "big")
+            + amount.to_bytes(16, "big")
+            + fee.to_bytes(16, "big")
+            + body
+        )
+
+    @staticmethod
+    def from_log(tx: TransactionLog) -> bytes:
+        """Encode a TransactionLog row written by an earlier version."""
+        return Block.encode(
+            tx.kind,
+            tx.timestamp,
+            tx.amount,
+            tx.fee or 0,
+            from_owner=(
+                Principal.from_str(tx.from_owner).bytes if tx.from_owner else None
+            ),
+            from_subaccount=bytes.fromhex(tx.from_subaccount or ""),
+            to_owner=Principal.from_str(tx.to_owner).bytes,
+            to_subaccount=bytes.fromhex(tx.to_subaccount or ""),
+            memo=bytes.fromhex(tx.memo or ""),
+        )
+
+    @property
+    def kind(self) -> str:
+        return Block.KINDS[self.raw[0]]
+
+    @property
+    def timestamp(self) -> int:
+        return int.from_bytes(self.raw[2:10], "big")
+
+    @property
+    def amount(self) -> int:
+        return int.from_bytes(self.raw[10:26], "big")
+
+    @property
+    def fee(self) -> int:
+        return int.from_bytes(self.raw[26:42], "big")
+
+    def field(self, name: str):
+        """Raw bytes of an optional field, or None when it is absent."""
+        if self._fields is None:
+            flags = self.raw[1]
+            self._fields = {}
+            pos = Block.HEADER_SIZE
+            for field_name, flag in Block.FIELDS:
+                if flag and not flags & flag:
+                    continue
+                start = pos + 1
+                pos = start + self.raw[pos]
+                self._fields[field_name] = self.raw[start:pos]
+        return self._fields.get(name)
+
+    def account(self, side: str) -> Account:
+        """The "from", "to" or "spender" account, or None when the block has none."""
+        if side == "spender":
+            spender = self.field("spender")
+            if spender is None:
+                return None
+            owner_end = 1 + spender[0]
+            return Account(
+                owner=Principal(spender[1:owner_end]),
+                subaccount=spender[owner_end:] or None,
+            )
+
+        owner = self.field(f"{side}_owner")
+        if not owner:
+            return None
+        return Account(
+            owner=Principal(owner), subaccount=self.field(f"{side}_subaccount")
+        )
+
+    def _owner_text(self, name: str) -> str:
+        owner = self.field(name)
+        return Principal(owner).to_str() if owner else ""
+
+    def _int(self, name: str) -> int:
+        value = self.field(name)
+        return int.from_bytes(value, "big") if value is not None else None
+
+    def _hex(self, name: str) -> str:
+        value = self.field(name)
+        return value.hex() if value else ""
+
+    # Text accessors matching the TransactionLog entity
+    @property
+    def from_owner(self) -> str:
+        return self._owner_text("from_owner")
+
+    @property
+    def to_owner(self) -> str:
+        return self._owner_text("to_owner")
+
+    @property
+    def from_subaccount(self) -> str:
+        return self._hex("from_subaccount")
+
+    @property
+    def to_subaccount(self) -> str:
+        return self._hex("to_subaccount")
+
+    @property
+    def memo(self) -> str:
+        return self._hex("memo")
+
+    @property
+    def created_at_time(self) -> int:
+        return self._int("created_at_time")
+
+    @property
+    def expires_at(self) -> int:
+        return self._int("expires_at")
+
+    @property
+    def expected_allowance(self) -> int:
+        return self._int("expected_allowance")
+
+
+class TextStorage:
+    """Text values over a StableBTreeMap with blob values, for an OrderedIndex."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, key: str):
+        raw = self.storage.get(key)
+        return raw.decode() if raw is not None else None
+
+    def insert(self, key: str, value: str):
+        self.storage.insert(key, value.encode())
+
+    def remove(self, key: str):
+        self.storage.remove(key)
+
+    def contains_key(self, key: str) -> bool:
+        return self.storage.contains_key(key)
+
+
+# Kept identical to the NFT canister's copy, see the note above AuditSink
+class OrderedIndex:
+    """
+    Ordered set of text members persisted in a StableBTreeMap.
+
+    StableBTreeMap only offers point lookups, so members are kept in a treap
+    (priority = crc32 of the member) whose nodes are stored under
+    "{namespace}/{member}". Add/discard cost O(log n) lookups, and an in-order
+    read of `limit` members after any position costs O(log n + limit).
+    Members are compared as plain strings and must not contain "|".
+    """
+
+    def __init__(self, storage, namespace: str):
+        self.storage = storage
+        self.namespace = namespace
+
+    def _get_meta(self):
+        meta = self.storage.get(self.namespace)
+        if not meta:
+            return "", 0
+        root, count = meta.split("|")
+        return root, int(count)
+
+    def _set_meta(self, root: str, count: int):
+        self.storage.insert(self.namespace, f"{root}|{count}")
+
+    def _get_node(self, member: str):
+        prio, left, right = self.storage.get(f"{self.namespace}/{member}").split("|")
+        return int(prio), left, right
+
+    def _set_node(self, member: str, prio: int, left: str, right: str):
+        self.storage.insert(f"{self.namespace}/{member}", f"{prio}|{left}|{right}")
+
+    def _insert(self, node: str, member: str) -> str:
+        if not node:
+            self._set_node(member, zlib.crc32(member.encode()), "", "")
+            return member
+
+        prio, left, right = self._get_node(node)
+        if member < node:
+            child = self._insert(left, member)
+            child_prio, child_left, child_right = self._get_node(child)
+            if child_prio > prio:
+                # Rotate right: child becomes the subtree root
+                self._set_node(node, prio, child_right, right)
+                self._set_node(child, child_prio, child_left, node)
+                return child
+            if child != left:
+                self._set_node(node, prio, child, right)
+        else:
+            child = self._insert(right, member)
+            child_prio, child_left, child_right = self._get_node(child)
+            if child_prio > prio:
+                # Rotate left: child becomes the subtree root
+                self._set_node(node, prio, left, child_left)
+                self._set_node(child, child_prio, node, child_right)
+                return child
+            if child != right:
+                self._set_node(node, prio, left, child)
+        return node
+
+    def _merge(self, left: str, right: str) -> str:
+        """Merge two subtrees where every member of left sorts before right."""
+        if not left:
+            return right
+        if not right:
+            return left
+        left_prio, left_left, left_right = self._get_node(left)
+        right_prio, right_left, right_right = self._get_node(right)
+        if left_prio > right_prio:
+            self._set_node(left, left_prio, left_left, self._merge(left_right, right))
+            return left
+        self._set_node(right, right_prio, self._merge(left, right_left), right_right)
+        return right
+
+    def _delete(self, node: str, member: str) -> str:
+        prio, left, right = self._get_node(node)
+        if member == node:
+            self.storage.remove(f"{self.namespace}/{member}")
+            return self._merge(left, right)
+        if member < node:
+            child = self._delete(left, member)
+            if child != left:
+                self._set_node(node, prio, child, right)
+        else:
+            child = self._delete(right, member)
+            if child != right:
+                self._set_node(node, prio, left, child)
+        return node
+
+    def contains(self, member: str) -> bool:
+        return self.storage.contains_key(f"{self.namespace}/{member}")
+
+    def count(self) -> int:
+        return self._get_meta()[1]
+
+    def add(self, member: str) -> bool:
+        if self.contains(member):
+            return False
+        root, count = self._get_meta()
+        self._set_meta(self._insert(root, member), count + 1)
+        return True
+
+    def discard(self, member: str) -> bool:
+        if not self.contains(member):
+            return False
+        root, count = self._get_meta()
+        self._set_meta(self._delete(root, member), count - 1)
+        return True
+
+    def items(self, after: str = None, limit: int = 100) -> list:
+        """Up to limit members in ascending order, strictly after `after`."""
+        members = []
+        stack = []
+        node = self._get_meta()[0]
+        while node:
+            _, left, right = self._get_node(node)
+            if after is None or node > after:
+                stack.append((node, right))
+                node = left
+            else:
+                node = right
+
+        while stack and len(members) < limit:
+            member, node = stack.pop()
+            members.append(member)
+            while node:
+                _, left, right = self._get_node(node)
+                stack.append((node, right))
+                node = left
+        return members
+
 
 class TokenHelper:
     @staticmethod
@@ -153,24 +882,164 @@ class TokenHelper:
         key = TokenHelper.get_account_key(owner, subaccount)
         balance = TokenBalance[key]
         if balance:
+            previous_amount = balance.amount or 0
             balance.amount = balance_amount
         else:
+            previous_amount = 0
             TokenBalance(id=key, amount=balance_amount)
+        HolderHelper.update(key, previous_amount, balance_amount)
 
     @staticmethod
     def get_total_supply():
-        config = TokenConfig["total_supply"]
-        if config and config.value:
-            return int(config.value)
-        return 0
+        return LedgerState.total_supply
 
     @staticmethod
     def set_total_supply(supply):
-        config = TokenConfig["total_supply"]
-        if config:
-            config.value = str(supply)
+        LedgerState.total_supply = supply
+        LedgerState.dirty = True
+
+
+class BalanceBatch:
+    """
+    Balances read once and written back once for a group of transfers.
+    Changes stay on the heap until commit, so an account that appears in many
+    transfers costs one load and one save.
+    """
+
+    # Starting estimate of the cost of committing one changed account (the
+    # entity save, its audit record and the holder index update). Each commit
+    # measures the real cost and updates commit_cost: it goes up at once and
+    # comes down by halves. It is heap-only, so an upgrade starts over here.
+    COMMIT_INSTRUCTIONS_PER_ACCOUNT = 20_000_000
+    commit_cost = COMMIT_INSTRUCTIONS_PER_ACCOUNT
+
+    def __init__(self):
+        self.balances = {}  # account key -> [owner, subaccount, amount]
+        self.changed = set()
+
+    def get(self, owner, subaccount=None):
+        key = TokenHelper.get_account_key(owner, subaccount)
+        entry = self.balances.get(key)
+        if entry is None:
+            entry = [owner, subaccount, TokenHelper.get_balance(owner, subaccount)]
+            self.balances[key] = entry
+        return entry[2]
+
+    def set(self, owner, amount, subaccount=None):
+        key = TokenHelper.get_account_key(owner, subaccount)
+        self.balances[key] = [owner, subaccount, amount]
+        self.changed.add(key)
+
+    def over_budget(self) -> bool:
+        """Whether the work done so far plus the pending commit uses up the batch budget."""
+        pending = len(self.changed) * BalanceBatch.commit_cost
+        return ic.performance_counter(0) + pending > BATCH_INSTRUCTION_BUDGET
+
+    def commit(self):
+        if not self.changed:
+            return
+        started = ic.performance_counter(0)
+        for key in self.changed:
+            owner, subaccount, amount = self.balances[key]
+            TokenHelper.set_balance(owner, amount, subaccount)
+        measured = (ic.performance_counter(0) - started) // len(self.changed)
+        BalanceBatch.commit_cost = max(
+            measured, (BalanceBatch.commit_cost + measured) // 2
+        )
+        self.changed = set()
+
+
+class HolderHelper:
+    """
+    Keeps holders ordered by (balance desc, account key) for top-N reads.
+    Until a backfill has covered every TokenBalance row (after an upgrade that
+    added the index), reads sort the rows instead.
+    """
+
+    # Members are "{RANK_BASE - balance}:{account key}", zero-padded so that
+    # plain string order is balance descending, then account ascending.
+    RANK_BASE = 10**40
+    index = OrderedIndex(holder_index, "holders")
+
+    @staticmethod
+    def member(account_key: str, amount: int) -> str:
+        return f"{HolderHelper.RANK_BASE - amount:040d}:{account_key}"
+
+    @staticmethod
+    def to_holder_info(member: str) -> HolderInfo:
+        rank, account_key = member.split(":", 1)
+        return HolderInfo(
+            address=account_key, balance=HolderHelper.RANK_BASE - int(rank)
+        )
+
+    @staticmethod
+    def update(account_key: str, previous_amount: int, amount: int):
+        if previous_amount == amount:
+            return
+        if previous_amount > 0:
+            HolderHelper.index.discard(
+                HolderHelper.member(account_key, previous_amount)
+            )
+        if amount > 0:
+            HolderHelper.index.add(HolderHelper.member(account_key, amount))
+
+    @staticmethod
+    def index_complete() -> bool:
+        return holder_index.get("#complete") is not None
+
+    @staticmethod
+    def mark_complete():
+        holder_index.insert("#complete", "1")
+
+    @staticmethod
+    def scan_members() -> list:
+        """Members for every positive TokenBalance row, in index order."""
+        return sorted(
+            HolderHelper.member(balance.id, balance.amount)
+            for balance in TokenBalance.instances()
+            if balance.amount and balance.amount > 0
+        )
+
+    @staticmethod
+    def get_holder_count() -> int:
+        if not HolderHelper.index_complete():
+            return len(HolderHelper.scan_members())
+        return HolderHelper.index.count()
+
+    @staticmethod
+    def get_holders(after: HolderInfo = None, limit: int = 100) -> list:
+        """Holders in balance order, starting after the given holder."""
+        after_member = None
+        if after is not None:
+            after_member = HolderHelper.member(after["address"], after["balance"])
+        if not HolderHelper.index_complete():
+            members = [
+                member
+                for member in HolderHelper.scan_members()
+                if after_member is None or member > after_member
+            ][:limit]
         else:
-            TokenConfig(key="total_supply", value=str(supply))
+            members = HolderHelper.index.items(after_member, limit)
+        return [HolderHelper.to_holder_info(member) for member in members]
+
+    @staticmethod
+    def backfill(max_entries: int) -> int:
+        """Index up to max_entries existing TokenBalance rows. Returns the watermark."""
+        # TokenBalance rows carry sequential internal ids starting at 1
+        done = int(holder_index.get("#backfilled") or 0)
+        total = TokenBalance.max_id()
+        if done >= total or max_entries == 0:
+            if done >= total:
+                HolderHelper.mark_complete()
+            return done
+        count = min(max_entries, total - done)
+        for balance in TokenBalance.load_some(done + 1, count):
+            if balance.amount and balance.amount > 0:
+                HolderHelper.index.add(HolderHelper.member(balance.id, balance.amount))
+        holder_index.insert("#backfilled", str(done + count))
+        if done + count >= total:
+            HolderHelper.mark_complete()
+        return done + count
 
 
 class OwnerHelper:
@@ -194,22 +1063,75 @@ class OwnerHelper:
         return principal == OwnerHelper.get_owner()
 
 
+class AuditHelper:
+    @staticmethod
+    def load():
+        mode = TokenConfig["audit_mode"]
+        rate = TokenConfig["audit_sample_rate"]
+        if mode and mode.value:
+            audit_sink.configure(mode.value, int(rate.value) if rate else None)
+        raw = ledger_state.get(LedgerState.AUDIT_KEY)
+        if raw:
+            audit_sink.records_seen = int.from_bytes(raw[:8], "big")
+            audit_sink.records_written = int.from_bytes(raw[8:16], "big")
+            audit_sink.bytes_written = int.from_bytes(raw[16:24], "big")
+
+    @staticmethod
+    def save():
+        """Keep the heap-only AuditSink counters across an upgrade."""
+        ledger_state.insert(
+            LedgerState.AUDIT_KEY,
+            audit_sink.records_seen.to_bytes(8, "big")
+            + audit_sink.records_written.to_bytes(8, "big")
+            + audit_sink.bytes_written.to_bytes(8, "big"),
+        )
+
+    @staticmethod
+    def configure(mode=None, sample_rate=None):
+        if mode is None and sample_rate is None:
+            return
+        audit_sink.configure(mode or audit_sink.mode, sample_rate)
+        for key, value in (
+            ("audit_mode", audit_sink.mode),
+            ("audit_sample_rate", str(audit_sink.sample_rate)),
+        ):
+            config = TokenConfig[key]
+            if config:
+                config.value = value
+            else:
+                TokenConfig(key=key, value=value)
+        logger.info(
+            f"Audit mode set to {audit_sink.mode} (sample rate {audit_sink.sample_rate})"
+        )
+
+    @staticmethod
+    def get_stats() -> AuditStats:
+        return AuditStats(
+            mode=audit_sink.mode,
+            sample_rate=audit_sink.sample_rate,
+            records_seen=audit_sink.records_seen,
+            records_written=audit_sink.records_written,
+            bytes_written=audit_sink.bytes_written,
+            journal_entries=audit_journal.len(),
+            sampled_entries=audit_samples.len(),
+        )
+
+
+AuditHelper.load()
+
+
 class TransactionHelper:
+    PENDING_SCAN_BLOCKS = 1000  # Most unindexed blocks a history query scans
+
     @staticmethod
     def get_next_block_index():
-        config = TokenConfig["next_block_index"]
-        if config and config.value:
-            return int(config.value)
-        return 0
+        return LedgerState.next_block_index
 
     @staticmethod
     def increment_block_index():
-        current = TransactionHelper.get_next_block_index()
-        config = TokenConfig["next_block_index"]
-        if config:
-            config.value = str(current + 1)
-        else:
-            TokenConfig(key="next_block_index", value=str(current + 1))
+        current = LedgerState.next_block_index
+        LedgerState.next_block_index = current + 1
+        LedgerState.dirty = True
         return current
 
     @staticmethod
@@ -222,69 +1144,651 @@ class TransactionHelper:
         amount: int,
         fee: int,
         memo: bytes = None,
+        created_at_time: int = None,
+        spender_owner: str = None,
+        spender_subaccount: bytes = None,
+        expires_at: int = None,
+        expected_allowance: int = None,
     ) -> int:
         """Log a transaction and return its block index."""
         block_index = TransactionHelper.increment_block_index()
         timestamp = ic.time()  # Nanoseconds since epoch
 
-        TransactionLog(
-            id=block_index,
-            kind=kind,
-            timestamp=timestamp,
-            from_owner=from_owner or "",
-            from_subaccount=from_subaccount.hex() if from_subaccount else "",
-            to_owner=to_owner,
-            to_subaccount=to_subaccount.hex() if to_subaccount else "",
-            amount=amount,
-            fee=fee,
-            memo=memo.hex() if memo else "",
+        spender = None
+        if spender_owner:
+            spender_bytes = Principal.from_str(spender_owner).bytes
+            spender = (
+                bytes([len(spender_bytes)])
+                + spender_bytes
+                + (spender_subaccount or b"")
+            )
+
+        blocks.insert(
+            block_index,
+            Block.encode(
+                kind,
+                timestamp,
+                amount,
+                fee,
+                from_owner=Principal.from_str(from_owner).bytes if from_owner else None,
+                from_subaccount=from_subaccount,
+                to_owner=Principal.from_str(to_owner).bytes if to_owner else None,
+                to_subaccount=to_subaccount,
+                memo=memo,
+                created_at_time=(
+                    created_at_time.to_bytes(8, "big")
+                    if created_at_time is not None
+                    else None
+                ),
+                spender=spender,
+                expires_at=expires_at.to_bytes(8, "big") if expires_at else None,
+                expected_allowance=(
+                    expected_allowance.to_bytes(16, "big")
+                    if expected_allowance is not None
+                    else None
+                ),
+            ),
         )
 
-        logger.info(f"Logged {kind} transaction #{block_index}: {amount} tokens")
+        # Only index in order: while a backfill is pending, new blocks wait for it
+        if TransactionHelper.get_indexed_block_count() == block_index:
+            TransactionHelper.index_block(
+                block_index,
+                from_owner,
+                from_subaccount,
+                to_owner,
+                to_subaccount,
+                spender_owner,
+                spender_subaccount,
+            )
+
+        logger.debug(f"Logged {kind} transaction #{block_index}: {amount} tokens")
         return block_index
 
+    @staticmethod
+    def get_block(block_id: int) -> Block:
+        """Block by id, or None. Rows not migrated yet are read from TransactionLog."""
+        raw = blocks.get(block_id)
+        if raw is None:
+            tx = TransactionLog[block_id]
+            if tx is None:
+                return None
+            raw = Block.from_log(tx)
+        return Block(block_id, raw)
+
+    @staticmethod
+    def get_migrated_block_count() -> int:
+        """Number of blocks (from block 0) moved out of TransactionLog."""
+        raw = ledger_state.get(LedgerState.MIGRATION_KEY)
+        return int.from_bytes(raw, "big") if raw else 0
+
+    @staticmethod
+    def migrate_transaction_log(max_blocks: int) -> int:
+        """Move up to max_blocks TransactionLog rows into blocks. Returns the new watermark."""
+        next_block = TransactionHelper.get_migrated_block_count()
+        end = min(next_block + max_blocks, TransactionHelper.get_next_block_index())
+        while next_block < end:
+            tx = TransactionLog[next_block]
+            if tx is not None:
+                if not blocks.contains_key(next_block):
+                    blocks.insert(next_block, Block.from_log(tx))
+                tx.delete()
+            next_block += 1
+        ledger_state.insert(LedgerState.MIGRATION_KEY, next_block.to_bytes(8, "big"))
+        return next_block
+
+    @staticmethod
+    def get_indexed_block_count() -> int:
+        """Number of blocks (from block 0) already in the account index."""
+        return account_tx_index.get("#indexed") or 0
+
+    @staticmethod
+    def account_index_complete() -> bool:
+        """Whether every block is in the account index (false after an upgrade that added it, until the backfill catches up)."""
+        return (
+            TransactionHelper.get_indexed_block_count()
+            >= TransactionHelper.get_next_block_index()
+        )
+
+    @staticmethod
+    def get_account_transaction_count(account_key: str) -> int:
+        return account_tx_index.get(f"{account_key}#n") or 0
+
+    @staticmethod
+    def account_keys(
+        from_owner: str,
+        from_subaccount: bytes,
+        to_owner: str,
+        to_subaccount: bytes,
+        spender_owner: str = None,
+        spender_subaccount: bytes = None,
+    ) -> list:
+        """Distinct account keys a block involves, in from/to/spender order."""
+        keys = []
+        for owner, subaccount in (
+            (from_owner, from_subaccount),
+            (to_owner, to_subaccount),
+            (spender_owner, spender_subaccount),
+        ):
+            if owner:
+                key = TokenHelper.get_account_key(owner, subaccount)
+                if key not in keys:
+                    keys.append(key)
+        return keys
+
+    @staticmethod
+    def block_account_keys(tx: Block) -> list:
+        spender = tx.account("spender")
+        return TransactionHelper.account_keys(
+            tx.from_owner,
+            tx.field("from_subaccount"),
+            tx.to_owner,
+            tx.field("to_subaccount"),
+            spender["owner"].to_str() if spender else None,
+            spender["subaccount"] if spender else None,
+        )
+
+    @staticmethod
+    def index_block(
+        block_index: int,
+        from_owner: str,
+        from_subaccount: bytes,
+        to_owner: str,
+        to_subaccount: bytes,
+        spender_owner: str = None,
+        spender_subaccount: bytes = None,
+    ):
+        """Append a block id to the index of every account it involves."""
+        keys = TransactionHelper.account_keys(
+            from_owner,
+            from_subaccount,
+            to_owner,
+            to_subaccount,
+            spender_owner,
+            spender_subaccount,
+        )
+        for key in keys:
+            count = TransactionHelper.get_account_transaction_count(key)
+            account_tx_index.insert(f"{key}#{count}", block_index)
+            account_tx_index.insert(f"{key}#n", count + 1)
+        account_tx_index.insert("#indexed", block_index + 1)
+
+    @staticmethod
+    def backfill_account_index(max_blocks: int) -> int:
+        """Index up to max_blocks historical blocks. Returns the new watermark."""
+        next_block = TransactionHelper.get_indexed_block_count()
+        end = min(next_block + max_blocks, TransactionHelper.get_next_block_index())
+        while next_block < end:
+            tx = TransactionHelper.get_block(next_block)
+            if tx is None:
+                # Missing row: keep the watermark moving so later blocks get indexed
+                account_tx_index.insert("#indexed", next_block + 1)
+            else:
+                spender = tx.account("spender")
+                TransactionHelper.index_block(
+                    tx.id,
+                    tx.from_owner,
+                    tx.field("from_subaccount"),
+                    tx.to_owner,
+                    tx.field("to_subaccount"),
+                    spender["owner"].to_str() if spender else None,
+                    spender["subaccount"] if spender else None,
+                )
+            next_block += 1
+        return next_block
+
+    @staticmethod
+    def pending_scan_range(start: int = None) -> tuple:
+        """
+        Unindexed block ids [first, end) that an account history query below
+        start scans while a backfill is pending. Only the newest
+        PENDING_SCAN_BLOCKS of them are scanned; the ones between the index
+        watermark and first are skipped until the backfill reaches them.
+        """
+        indexed = TransactionHelper.get_indexed_block_count()
+        end = TransactionHelper.get_next_block_index()
+        if start is not None:
+            end = min(end, start)
+        end = max(end, indexed)
+        return max(indexed, end - TransactionHelper.PENDING_SCAN_BLOCKS), end
+
+    @staticmethod
+    def history_incomplete(start: int = None) -> bool:
+        """Whether an account history query below start skips unindexed blocks."""
+        first, _ = TransactionHelper.pending_scan_range(start)
+        return first > TransactionHelper.get_indexed_block_count()
+
+    @staticmethod
+    def get_account_block_ids(
+        account_key: str, start: int = None, max_results: int = 20
+    ) -> list:
+        """
+        Block ids of an account, newest first, all strictly below start.
+        While a backfill is pending, the newest blocks the index has not
+        reached are scanned (see pending_scan_range), so the result can miss
+        older unindexed blocks; history_incomplete tells whether it did.
+        """
+        indexed = TransactionHelper.get_indexed_block_count()
+        first, top = TransactionHelper.pending_scan_range(start)
+
+        block_ids = []
+        for block_id in range(top - 1, first - 1, -1):
+            if len(block_ids) >= max_results:
+                return block_ids
+            tx = TransactionHelper.get_block(block_id)
+            if tx is not None and account_key in TransactionHelper.block_account_keys(
+                tx
+            ):
+                block_ids.append(block_id)
+        max_results -= len(block_ids)
+        if start is not None and start > indexed:
+            start = None
+
+        end = TransactionHelper.get_account_transaction_count(account_key)
+
+        if start is not None:
+            # Binary search for the first position whose block id is >= start
+            lo, hi = 0, end
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if account_tx_index.get(f"{account_key}#{mid}") < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            end = lo
+
+        first = max(end - max_results, 0)
+        return block_ids + [
+            account_tx_index.get(f"{account_key}#{pos}")
+            for pos in range(end - 1, first - 1, -1)
+        ]
+
+    @staticmethod
+    def get_block_range(end: int, count: int) -> list:
+        """Blocks with ids in [end - count, end), newest first."""
+        transactions = []
+        for block_id in range(end - 1, max(end - count, 0) - 1, -1):
+            tx = TransactionHelper.get_block(block_id)
+            if tx is not None:
+                transactions.append(tx)
+        return transactions
+
     @staticmethod
     def get_transactions_for_account(
         owner: str, subaccount: bytes = None, start: int = None, max_results: int = 20
     ):
-        """Get transactions involving a specific account."""
-        sub_hex = subaccount.hex() if subaccount else ""
+        """Get transactions involving a specific account, newest first."""
+        account_key = TokenHelper.get_account_key(owner, subaccount)
+        block_ids = TransactionHelper.get_account_block_ids(
+            account_key, start, max_results
+        )
+
         transactions = []
+        for block_id in block_ids:
+            tx = TransactionHelper.get_block(block_id)
+            if tx is not None:
+                transactions.append(tx)
+        return transactions
 
-        # Get all transactions and filter by account
-        all_txs = list(TransactionLog.instances())
 
-        # Filter transactions where account is sender or receiver
-        for tx in all_txs:
-            is_sender = tx.from_owner == owner and tx.from_subaccount == sub_hex
-            is_receiver = tx.to_owner == owner and tx.to_subaccount == sub_hex
+class AllowanceHelper:
+    """
+    ICRC-2 allowances, stored under account keys (see TokenHelper.get_account_key):
+
+      "a/{owner}/{spender}" -> amount (16) | expires_at (8, 0 = never) | position (8)
+      "o/{owner}#{i}", "o/{owner}#n" -> the owner's spender keys; a removed
+          spender is replaced by the last one, so positions stay dense
+      "e/{hour}#{i}", "e/{hour}#n" -> "{owner}/{spender}" for every allowance
+          given an expiry in that hour (entries may be stale)
+      "eh", "eh/{hour}" -> OrderedIndex of the hours that have such entries
+
+    Lookups go straight to the primary entry and treat an expired allowance
+    as zero; sweep() then deletes expired entries bucket by bucket, seeking
+    from one non-empty hour to the next, so reclaiming them never scans
+    allowances that are still live or hours without any.
+    """
 
-            if is_sender or is_receiver:
-                # If start is specified, only include transactions with id < start
-                if start is not None and tx.id >= start:
-                    continue
-                transactions.append(tx)
+    HOUR_NANOS = 60 * 60 * 1_000_000_000
+    expiry_hours = OrderedIndex(TextStorage(allowances), "eh")
 
-        # Sort by id descending (newest first)
-        transactions.sort(key=lambda x: x.id, reverse=True)
+    @staticmethod
+    def hour_member(hour: int) -> str:
+        return f"{hour:020d}"
 
-        # Apply max_results limit
-        return transactions[:max_results]
+    @staticmethod
+    def _get_int(key: str) -> int:
+        raw = allowances.get(key)
+        return int.from_bytes(raw, "big") if raw else 0
+
+    @staticmethod
+    def _set_int(key: str, value: int):
+        allowances.insert(key, value.to_bytes(8, "big"))
+
+    @staticmethod
+    def _get_entry(owner_key: str, spender_key: str):
+        raw = allowances.get(f"a/{owner_key}/{spender_key}")
+        if raw is None:
+            return None
+        return (
+            int.from_bytes(raw[:16], "big"),
+            int.from_bytes(raw[16:24], "big"),
+            int.from_bytes(raw[24:32], "big"),
+        )
+
+    @staticmethod
+    def _set_entry(
+        owner_key: str, spender_key: str, amount: int, expires_at: int, position: int
+    ):
+        allowances.insert(
+            f"a/{owner_key}/{spender_key}",
+            amount.to_bytes(16, "big")
+            + expires_at.to_bytes(8, "big")
+            + position.to_bytes(8, "big"),
+        )
+
+    @staticmethod
+    def get(owner_key: str, spender_key: str, now: int):
+        """(allowance, expires_at or None); expired allowances read as zero."""
+        entry = AllowanceHelper._get_entry(owner_key, spender_key)
+        if entry is None:
+            return 0, None
+        amount, expires_at, _ = entry
+        if expires_at and expires_at <= now:
+            return 0, None
+        return amount, expires_at or None
+
+    @staticmethod
+    def set(owner_key: str, spender_key: str, amount: int, expires_at: int = None):
+        """Set an allowance; zero removes it."""
+        if amount == 0:
+            AllowanceHelper.remove(owner_key, spender_key)
+            return
+
+        entry = AllowanceHelper._get_entry(owner_key, spender_key)
+        if entry is None:
+            position = AllowanceHelper._get_int(f"o/{owner_key}#n")
+            allowances.insert(f"o/{owner_key}#{position}", spender_key.encode())
+            AllowanceHelper._set_int(f"o/{owner_key}#n", position + 1)
+        else:
+            position = entry[2]
+
+        if expires_at and (entry is None or entry[1] != expires_at):
+            hour = expires_at // AllowanceHelper.HOUR_NANOS
+            count = AllowanceHelper._get_int(f"e/{hour}#n")
+            allowances.insert(
+                f"e/{hour}#{count}", f"{owner_key}/{spender_key}".encode()
+            )
+            AllowanceHelper._set_int(f"e/{hour}#n", count + 1)
+            if count == 0:
+                AllowanceHelper.expiry_hours.add(AllowanceHelper.hour_member(hour))
+
+        AllowanceHelper._set_entry(
+            owner_key, spender_key, amount, expires_at or 0, position
+        )
+
+    @staticmethod
+    def remove(owner_key: str, spender_key: str):
+        entry = AllowanceHelper._get_entry(owner_key, spender_key)
+        if entry is None:
+            return
+        position = entry[2]
+        last = AllowanceHelper._get_int(f"o/{owner_key}#n") - 1
+        if position != last:
+            moved = allowances.get(f"o/{owner_key}#{last}")
+            allowances.insert(f"o/{owner_key}#{position}", moved)
+            amount, expires_at, _ = AllowanceHelper._get_entry(
+                owner_key, moved.decode()
+            )
+            AllowanceHelper._set_entry(
+                owner_key, moved.decode(), amount, expires_at, position
+            )
+        allowances.remove(f"o/{owner_key}#{last}")
+        if last:
+            AllowanceHelper._set_int(f"o/{owner_key}#n", last)
+        else:
+            allowances.remove(f"o/{owner_key}#n")
+        allowances.remove(f"a/{owner_key}/{spender_key}")
+
+    @staticmethod
+    def list(owner_key: str, start: int, limit: int, now: int) -> list:
+        """(spender key, amount, expires_at) from position start on, skipping expired ones."""
+        end = min(start + limit, AllowanceHelper._get_int(f"o/{owner_key}#n"))
+        result = []
+        for position in range(start, end):
+            spender_key = allowances.get(f"o/{owner_key}#{position}").decode()
+            amount, expires_at = AllowanceHelper.get(owner_key, spender_key, now)
+            if amount:
+                result.append((spender_key, amount, expires_at))
+        return result
+
+    @staticmethod
+    def sweep(now: int, max_entries: int) -> int:
+        """Delete allowances that expired in hours that have fully passed."""
+        last_hour = now // AllowanceHelper.HOUR_NANOS - 1
+        reclaimed = 0
+        steps = 0
+
+        while steps < max_entries:
+            first = AllowanceHelper.expiry_hours.items(None, 1)
+            if not first or int(first[0]) > last_hour:
+                break
+            hour = int(first[0])
+            count = AllowanceHelper._get_int(f"e/{hour}#n")
+            while count and steps < max_entries:
+                count -= 1
+                steps += 1
+                pair = allowances.get(f"e/{hour}#{count}").decode()
+                allowances.remove(f"e/{hour}#{count}")
+                owner_key, spender_key = pair.split("/")
+                entry = AllowanceHelper._get_entry(owner_key, spender_key)
+                # Skip stale entries: the allowance was re-approved or removed
+                if entry and entry[1] and entry[1] <= now:
+                    AllowanceHelper.remove(owner_key, spender_key)
+                    reclaimed += 1
+            if count:
+                AllowanceHelper._set_int(f"e/{hour}#n", count)
+                break
+            allowances.remove(f"e/{hour}#n")
+            AllowanceHelper.expiry_hours.discard(first[0])
+            steps += 1
+
+        return reclaimed
+
+
+class MintHelper:
+    """
+    Applies mints, and drains the queue mint_batch leaves behind.
+
+    Queue entries are job id (8 bytes) | amount (16) | owner length (1) |
+    owner text | subaccount, keyed by a sequence number between the head and
+    tail kept in the ledger_state cell. A one-shot timer drains as much as the
+    instruction budget allows and re-arms itself until the queue is empty.
+    """
+
+    timer_scheduled = False
+
+    @staticmethod
+    def can_mint(caller: str) -> bool:
+        test_mode = TokenConfig["test"] and TokenConfig["test"].value == "true"
+        return OwnerHelper.is_owner(caller) or test_mode
+
+    @staticmethod
+    def apply(balances: BalanceBatch, owner: str, subaccount, amount: int) -> int:
+        """Credit a mint and log its block; the caller updates total supply."""
+        balances.set(owner, balances.get(owner, subaccount) + amount, subaccount)
+        return TransactionHelper.log_transaction(
+            kind="mint",
+            from_owner="",  # No sender for mints
+            from_subaccount=None,
+            to_owner=owner,
+            to_subaccount=subaccount,
+            amount=amount,
+            fee=0,
+            memo=None,
+        )
+
+    @staticmethod
+    def get_bounds():
+        raw = ledger_state.get(LedgerState.MINT_QUEUE_KEY)
+        if not raw:
+            return 0, 0
+        return int.from_bytes(raw[:8], "big"), int.from_bytes(raw[8:16], "big")
+
+    @staticmethod
+    def set_bounds(head: int, tail: int):
+        ledger_state.insert(
+            LedgerState.MINT_QUEUE_KEY,
+            head.to_bytes(8, "big") + tail.to_bytes(8, "big"),
+        )
+
+    @staticmethod
+    def pending() -> int:
+        head, tail = MintHelper.get_bounds()
+        return tail - head
+
+    @staticmethod
+    def enqueue(job_id: int, mints: list):
+        head, tail = MintHelper.get_bounds()
+        for mint_args in mints:
+            owner = mint_args["to"]["owner"].to_str().encode()
+            mint_queue.insert(
+                tail,
+                job_id.to_bytes(8, "big")
+                + mint_args["amount"].to_bytes(16, "big")
+                + bytes([len(owner)])
+                + owner
+                + (mint_args["to"].get("subaccount") or b""),
+            )
+            tail += 1
+        MintHelper.set_bounds(head, tail)
+
+    @staticmethod
+    def drain() -> int:
+        """Apply queued mints until the queue or the budget runs out."""
+        head, tail = MintHelper.get_bounds()
+        balances = BalanceBatch()
+        progress = {}  # job id -> mints applied in this call
+        supply_added = 0
+
+        while head < tail and not balances.over_budget():
+            raw = mint_queue.get(head)
+            job_id = int.from_bytes(raw[:8], "big")
+            amount = int.from_bytes(raw[8:24], "big")
+            owner_end = 25 + raw[24]
+            owner = raw[25:owner_end].decode()
+            subaccount = raw[owner_end:] or None
+
+            MintHelper.apply(balances, owner, subaccount, amount)
+            supply_added += amount
+            progress[job_id] = progress.get(job_id, 0) + 1
+            mint_queue.remove(head)
+            head += 1
+
+        balances.commit()
+        TokenHelper.set_total_supply(TokenHelper.get_total_supply() + supply_added)
+        MintHelper.set_bounds(head, tail)
+        LedgerState.flush()
+        for job_id, count in progress.items():
+            job = MintJob[job_id]
+            job.minted = (job.minted or 0) + count
+        return sum(progress.values())
+
+    @staticmethod
+    def schedule():
+        if MintHelper.timer_scheduled or not MintHelper.pending():
+            return
+        MintHelper.timer_scheduled = True
+        ic.set_timer(0, _drain_mint_queue)
+
+
+def _drain_mint_queue() -> void:
+    MintHelper.timer_scheduled = False
+    minted = MintHelper.drain()
+    logger.info(f"Mint queue: applied {minted}, {MintHelper.pending()} pending")
+    MintHelper.schedule()
+
+
+class BackfillHelper:
+    """
+    Brings indexes added by an upgrade up to date in the background.
+
+    post_upgrade arms a one-shot timer that feeds every unfinished index
+    chunks of history while the instruction budget lasts, and re-arms itself
+    until all of them are complete. Until then queries scan the part an index
+    has not reached, and the owner-only backfill endpoints still work.
+    """
+
+    CHUNK = 200  # Rows fed to an index per step
+    timer_scheduled = False
+
+    @staticmethod
+    def pending() -> bool:
+        return (
+            not TransactionHelper.account_index_complete()
+            or not HolderHelper.index_complete()
+        )
+
+    @staticmethod
+    def run():
+        while (
+            BackfillHelper.pending()
+            and ic.performance_counter(0) <= BATCH_INSTRUCTION_BUDGET
+        ):
+            if not TransactionHelper.account_index_complete():
+                TransactionHelper.backfill_account_index(BackfillHelper.CHUNK)
+            if not HolderHelper.index_complete():
+                HolderHelper.backfill(BackfillHelper.CHUNK)
+
+    @staticmethod
+    def schedule():
+        if BackfillHelper.timer_scheduled or not BackfillHelper.pending():
+            return
+        BackfillHelper.timer_scheduled = True
+        ic.set_timer(0, _run_backfills)
+
+
+def _run_backfills() -> void:
+    BackfillHelper.timer_scheduled = False
+    BackfillHelper.run()
+    logger.info(
+        f"Backfill: account index at block {TransactionHelper.get_indexed_block_count()}"
+        f"/{TransactionHelper.get_next_block_index()}"
+    )
+    BackfillHelper.schedule()
 
 
 @init
 def init_(args: InitArgs) -> void:
     logger.info("Initializing token canister")
+    AuditHelper.configure(args.get("audit_mode"), args.get("audit_sample_rate"))
     deployer = ic.caller().to_str()
     OwnerHelper.set_owner(deployer)
+    # A new ledger keeps the holder index up to date from its first balance
+    HolderHelper.mark_complete()
     TokenHelper.set_balance(deployer, args["total_supply"])
     TokenHelper.set_total_supply(args["total_supply"])
     if args.get("test"):
         TokenConfig(key="test", value="true")
         logger.info("Test mode enabled - public minting allowed")
+    LedgerState.flush()
     logger.info(f"Token initialized. Supply: {args['total_supply']} to {deployer}")
 
 
+@pre_upgrade
+def pre_upgrade_() -> void:
+    LedgerState.flush()
+    AuditHelper.save()
+
+
+@post_upgrade
+def post_upgrade_(args: InitArgs) -> void:
+    # Upgrades receive the init arguments; only the audit settings apply
+    AuditHelper.configure(args.get("audit_mode"), args.get("audit_sample_rate"))
+    # Timers do not survive upgrades
+    MintHelper.schedule()
+    BackfillHelper.schedule()
+
+
 @query
 def icrc1_name() -> text:
     return TOKEN_NAME
@@ -335,17 +1839,74 @@ def icrc1_metadata() -> Vec[MetadataEntry]:
 def icrc1_supported_standards() -> Vec[MetadataEntry]:
     return [
         ("ICRC-1", "https://github.com/dfinity/ICRC-1"),
+        ("ICRC-2", "https://github.com/dfinity/ICRC-1/tree/main/standards/ICRC-2"),
     ]
 
 
-@update
-def icrc1_transfer(args: TransferArgs) -> TransferResult:
-    caller = ic.caller().to_str()
-    logger.info(
-        f"Transfer request: {caller} -> {args['to']['owner'].to_str()}, amount: {args['amount']}"
+def _unrecordable(memo: bytes, amounts: list, subaccounts: list) -> str:
+    """Why arguments could not be written to a block, or None if they can."""
+    if memo is not None and len(memo) > MAX_MEMO_BYTES:
+        return f"Memo is longer than {MAX_MEMO_BYTES} bytes"
+    for subaccount in subaccounts:
+        if subaccount is not None and len(subaccount) > MAX_SUBACCOUNT_BYTES:
+            return f"Subaccount is longer than {MAX_SUBACCOUNT_BYTES} bytes"
+    for amount in amounts:
+        if amount is not None and amount > MAX_BLOCK_AMOUNT:
+            return f"Amount {amount} does not fit in 128 bits"
+    return None
+
+
+def _transfer(
+    caller: str, args: TransferArgs, balances: BalanceBatch
+) -> TransferResult:
+    """Validate and apply one transfer against a balance batch."""
+    recipient = args["to"]["owner"].to_str()
+    created_at_time = args.get("created_at_time")
+
+    if args.get("fee") is not None and args["fee"] > MAX_BLOCK_AMOUNT:
+        return TransferResult(
+            success=False,
+            block_index=None,
+            error=f"Fee {args['fee']} does not fit in 128 bits",
+            icrc1_error=TransferError(BadFee=BadFeeError(expected_fee=TOKEN_FEE)),
+        )
+    invalid = _unrecordable(
+        args.get("memo"),
+        [args["amount"]],
+        [args.get("from_subaccount"), args["to"].get("subaccount")],
+    )
+    if invalid:
+        logger.info(f"Transfer from {caller} rejected: {invalid}")
+        return TransferResult(
+            success=False,
+            block_index=None,
+            error=invalid,
+            icrc1_error=TransferError(
+                GenericError=GenericErrorRecord(error_code=0, message=invalid)
+            ),
+        )
+
+    # The fee is part of the fingerprint as given, so null and the default differ
+    dedup_error, message, fingerprint = DedupIndex.check(
+        created_at_time,
+        caller.encode(),
+        args.get("from_subaccount") or b"",
+        recipient.encode(),
+        args["to"].get("subaccount") or b"",
+        str(args["amount"]).encode(),
+        str(args.get("fee")).encode(),
+        args.get("memo") or b"",
     )
+    if dedup_error:
+        logger.info(f"Transfer from {caller} rejected: {message}")
+        return TransferResult(
+            success=False,
+            block_index=None,
+            error=message,
+            icrc1_error=TransferError(**dedup_error),
+        )
 
-    sender_balance = TokenHelper.get_balance(caller, args.get("from_subaccount"))
+    sender_balance = balances.get(caller, args.get("from_subaccount"))
     fee = args.get("fee") if args.get("fee") is not None else TOKEN_FEE
     total_deduction = args["amount"] + fee
 
@@ -355,15 +1916,15 @@ def icrc1_transfer(args: TransferArgs) -> TransferResult:
             success=False,
             block_index=None,
             error=f"Insufficient balance. Have {sender_balance}, need {total_deduction}",
+            icrc1_error=TransferError(
+                InsufficientFunds=InsufficientFundsError(balance=sender_balance)
+            ),
         )
 
-    recipient = args["to"]["owner"].to_str()
-    recipient_balance = TokenHelper.get_balance(recipient, args["to"].get("subaccount"))
-
-    TokenHelper.set_balance(
-        caller, sender_balance - total_deduction, args.get("from_subaccount")
-    )
-    TokenHelper.set_balance(
+    balances.set(caller, sender_balance - total_deduction, args.get("from_subaccount"))
+    # Read after the debit so a transfer to the same account nets out correctly
+    recipient_balance = balances.get(recipient, args["to"].get("subaccount"))
+    balances.set(
         recipient, recipient_balance + args["amount"], args["to"].get("subaccount")
     )
 
@@ -380,13 +1941,76 @@ def icrc1_transfer(args: TransferArgs) -> TransferResult:
         amount=args["amount"],
         fee=fee,
         memo=args.get("memo"),
+        created_at_time=created_at_time,
+    )
+    if fingerprint is not None:
+        DedupIndex.record(fingerprint, created_at_time, block_index)
+
+    return TransferResult(
+        success=True, block_index=block_index, error=None, icrc1_error=None
+    )
+
+
+@update
+def icrc1_transfer(args: TransferArgs) -> TransferResult:
+    caller = ic.caller().to_str()
+    logger.info(
+        f"Transfer request: {caller} -> {args['to']['owner'].to_str()}, amount: {args['amount']}"
     )
 
+    balances = BalanceBatch()
+    result = _transfer(caller, args, balances)
+    balances.commit()
+    LedgerState.flush()
+
+    if result["success"]:
+        logger.info(
+            f"Transfer successful: {args['amount']} tokens transferred, block_index={result['block_index']}"
+        )
+
+    return result
+
+
+@update
+def icrc1_batch_transfer(args: Vec[TransferArgs]) -> BatchTransferResult:
+    """
+    Apply up to MAX_BATCH_TRANSFERS transfers from the caller in one message,
+    in order. Balances are read and written once per account for the whole
+    batch. If the instruction budget runs out the remaining transfers are not
+    attempted: processed says how many were, complete is False, and the
+    caller resubmits the rest. A longer batch is rejected with error set.
+    """
+    caller = ic.caller().to_str()
+    if len(args) > MAX_BATCH_TRANSFERS:
+        return BatchTransferResult(
+            results=[],
+            processed=0,
+            complete=False,
+            error=f"Batch has {len(args)} transfers, the limit is {MAX_BATCH_TRANSFERS}",
+        )
+
+    balances = BalanceBatch()
+    results = []
+
+    for transfer_args in args:
+        if balances.over_budget():
+            break
+        results.append(_transfer(caller, transfer_args, balances))
+
+    balances.commit()
+    LedgerState.flush()
+
+    succeeded = len([r for r in results if r["success"]])
     logger.info(
-        f"Transfer successful: {args['amount']} tokens transferred, block_index={block_index}"
+        f"Batch transfer from {caller}: {succeeded}/{len(results)} succeeded, {len(args) - len(results)} not processed"
     )
 
-    return TransferResult(success=True, block_index=block_index, error=None)
+    return BatchTransferResult(
+        results=results,
+        processed=len(results),
+        complete=len(results) == len(args),
+        error=None,
+    )
 
 
 @update
@@ -396,8 +2020,7 @@ def mint(args: MintArgs) -> MintResult:
         f"Mint request from {caller}: {args['amount']} to {args['to']['owner'].to_str()}"
     )
 
-    test_mode = TokenConfig["test"] and TokenConfig["test"].value == "true"
-    if not OwnerHelper.is_owner(caller) and not test_mode:
+    if not MintHelper.can_mint(caller):
         logger.warning(f"Unauthorized mint attempt by {caller}")
         return MintResult(
             success=False,
@@ -406,26 +2029,24 @@ def mint(args: MintArgs) -> MintResult:
             block_index=None,
         )
 
-    recipient = args["to"]["owner"].to_str()
-    current_balance = TokenHelper.get_balance(recipient, args["to"].get("subaccount"))
-    new_balance = current_balance + args["amount"]
+    invalid = _unrecordable(None, [args["amount"]], [args["to"].get("subaccount")])
+    if invalid:
+        return MintResult(
+            success=False, new_balance=None, error=invalid, block_index=None
+        )
 
-    TokenHelper.set_balance(recipient, new_balance, args["to"].get("subaccount"))
+    recipient = args["to"]["owner"].to_str()
+    balances = BalanceBatch()
+    block_index = MintHelper.apply(
+        balances, recipient, args["to"].get("subaccount"), args["amount"]
+    )
+    new_balance = balances.get(recipient, args["to"].get("subaccount"))
+    balances.commit()
 
     current_supply = TokenHelper.get_total_supply()
     TokenHelper.set_total_supply(current_supply + args["amount"])
 
-    # Log the mint transaction for indexer
-    block_index = TransactionHelper.log_transaction(
-        kind="mint",
-        from_owner="",  # No sender for mints
-        from_subaccount=None,
-        to_owner=recipient,
-        to_subaccount=args["to"].get("subaccount"),
-        amount=args["amount"],
-        fee=0,
-        memo=None,
-    )
+    LedgerState.flush()
 
     logger.info(
         f"Minted {args['amount']} tokens to {recipient}. New balance: {new_balance}, block_index={block_index}"
@@ -436,6 +2057,167 @@ def mint(args: MintArgs) -> MintResult:
     )
 
 
+@update
+def mint_batch(args: Vec[MintArgs]) -> MintBatchResult:
+    """
+    Mint to many recipients (airdrops). As many mints as the instruction
+    budget allows are applied right away; the rest are queued and applied by
+    a timer in the background. Follow them with get_mint_job.
+    """
+    caller = ic.caller().to_str()
+
+    if not MintHelper.can_mint(caller):
+        logger.warning(f"Unauthorized batch mint attempt by {caller}")
+        return MintBatchResult(
+            success=False,
+            error="Only the token owner can mint tokens",
+            job_id=None,
+            minted=0,
+            queued=0,
+        )
+
+    # Queued mints are applied later, so check them all before taking any
+    for position, mint_args in enumerate(args):
+        invalid = _unrecordable(
+            None, [mint_args["amount"]], [mint_args["to"].get("subaccount")]
+        )
+        if invalid:
+            return MintBatchResult(
+                success=False,
+                error=f"Mint {position}: {invalid}",
+                job_id=None,
+                minted=0,
+                queued=0,
+            )
+
+    balances = BalanceBatch()
+    minted = 0
+    supply_added = 0
+
+    # Mints queued by earlier batches go first
+    if not MintHelper.pending():
+        for mint_args in args:
+            if balances.over_budget():
+                break
+            MintHelper.apply(
+                balances,
+                mint_args["to"]["owner"].to_str(),
+                mint_args["to"].get("subaccount"),
+                mint_args["amount"],
+            )
+            supply_added += mint_args["amount"]
+            minted += 1
+
+    balances.commit()
+    TokenHelper.set_total_supply(TokenHelper.get_total_supply() + supply_added)
+    LedgerState.flush()
+
+    job_id = None
+    queued = len(args) - minted
+    if queued:
+        job_id = MintJob.max_id() + 1
+        MintJob(id=job_id, total=len(args), minted=minted)
+        MintHelper.enqueue(job_id, args[minted:])
+        MintHelper.schedule()
+
+    logger.info(f"Batch mint by {caller}: {minted} minted, {queued} queued")
+
+    return MintBatchResult(
+        success=True, error=None, job_id=job_id, minted=minted, queued=queued
+    )
+
+
+@update
+def backfill_account_index(max_blocks: nat) -> IndexBackfillResult:
+    """Index blocks logged before the account index existed (owner only)."""
+    caller = ic.caller().to_str()
+    total_blocks = TransactionHelper.get_next_block_index()
+
+    if not OwnerHelper.is_owner(caller):
+        logger.warning(f"Unauthorized index backfill attempt by {caller}")
+        return IndexBackfillResult(
+            success=False,
+            indexed=TransactionHelper.get_indexed_block_count(),
+            total=total_blocks,
+            error="Only the token owner can backfill the index",
+        )
+
+    indexed_blocks = TransactionHelper.backfill_account_index(max_blocks)
+    logger.info(f"Account index backfilled to block {indexed_blocks}/{total_blocks}")
+
+    return IndexBackfillResult(
+        success=True,
+        indexed=indexed_blocks,
+        total=total_blocks,
+        error=None,
+    )
+
+
+@update
+def migrate_transaction_log(max_blocks: nat) -> IndexBackfillResult:
+    """Move TransactionLog rows written by earlier versions into blocks (owner only)."""
+    caller = ic.caller().to_str()
+    total_blocks = TransactionHelper.get_next_block_index()
+
+    if not OwnerHelper.is_owner(caller):
+        logger.warning(f"Unauthorized transaction log migration attempt by {caller}")
+        return IndexBackfillResult(
+            success=False,
+            indexed=TransactionHelper.get_migrated_block_count(),
+            total=total_blocks,
+            error="Only the token owner can migrate the transaction log",
+        )
+
+    migrated = TransactionHelper.migrate_transaction_log(max_blocks)
+    logger.info(f"Transaction log migrated to block {migrated}/{total_blocks}")
+
+    return IndexBackfillResult(
+        success=True, indexed=migrated, total=total_blocks, error=None
+    )
+
+
+@update
+def backfill_holder_index(max_entries: nat) -> IndexBackfillResult:
+    """Index balances recorded before the holder index existed (owner only)."""
+    caller = ic.caller().to_str()
+    total = TokenBalance.max_id()
+
+    if not OwnerHelper.is_owner(caller):
+        logger.warning(f"Unauthorized holder index backfill attempt by {caller}")
+        return IndexBackfillResult(
+            success=False,
+            indexed=HolderHelper.backfill(0),
+            total=total,
+            error="Only the token owner can backfill the index",
+        )
+
+    indexed = HolderHelper.backfill(max_entries)
+    logger.info(f"Holder index backfilled to balance {indexed}/{total}")
+
+    return IndexBackfillResult(success=True, indexed=indexed, total=total, error=None)
+
+
+@query
+def get_mint_job(job_id: nat) -> Opt[MintJobInfo]:
+    """Progress of a mint_batch call that queued part of its mints."""
+    job = MintJob[job_id]
+    if job is None:
+        return None
+
+    return MintJobInfo(
+        id=job.id,
+        total=job.total,
+        minted=job.minted or 0,
+        complete=(job.minted or 0) >= job.total,
+    )
+
+
+@query
+def get_audit_stats() -> AuditStats:
+    """Audit mode and how many records/bytes it has written."""
+    return AuditHelper.get_stats()
+
+
 @query
 def get_owner() -> text:
     owner = OwnerHelper.get_owner()
@@ -472,20 +2254,359 @@ def is_test_mode() -> bool:
 @query
 def get_token_distribution() -> TokenDistribution:
     """Get all token holders and their balances for distribution visualization."""
-    holders = []
-
-    for balance in TokenBalance.instances():
-        if balance.amount and balance.amount > 0:
-            holders.append(HolderInfo(address=balance.id, balance=balance.amount))
-
-    # Sort by balance descending
-    holders.sort(key=lambda h: h["balance"], reverse=True)
+    holder_count = HolderHelper.get_holder_count()
+    holders = HolderHelper.get_holders(limit=holder_count)
 
     return TokenDistribution(
         holders=holders,
         total_supply=TokenHelper.get_total_supply(),
-        holder_count=len(holders),
+        holder_count=holder_count,
+    )
+
+
+@query
+def get_holders(prev: Opt[HolderInfo], take: nat) -> Vec[HolderInfo]:
+    """Stream holders in balance order, resuming after the last holder returned."""
+    if take == 0:
+        take = 100
+    if take > 1000:
+        take = 1000
+    return HolderHelper.get_holders(prev, take)
+
+
+# ============================================================================
+# ICRC-2 Types and Methods (approvals)
+# ============================================================================
+
+# Expired allowances reclaimed per approve/transfer_from call
+ALLOWANCE_SWEEP_BATCH = 20
+
+
+class ApproveArgs(Record):
+    from_subaccount: Opt[blob]
+    spender: Account
+    amount: nat
+    expected_allowance: Opt[nat]
+    expires_at: Opt[nat64]
+    fee: Opt[nat]
+    memo: Opt[blob]
+    created_at_time: Opt[nat64]
+
+
+class AllowanceChangedError(Record):
+    current_allowance: nat
+
+
+class ExpiredError(Record):
+    ledger_time: nat64
+
+
+class InsufficientAllowanceError(Record):
+    allowance: nat
+
+
+class ApproveError(Variant, total=False):
+    BadFee: BadFeeError
+    InsufficientFunds: InsufficientFundsError
+    AllowanceChanged: AllowanceChangedError
+    Expired: ExpiredError
+    TooOld: null
+    CreatedInFuture: CreatedInFutureError
+    Duplicate: DuplicateError
+    TemporarilyUnavailable: null
+    GenericError: GenericErrorRecord
+
+
+class ApproveResult(Variant, total=False):
+    Ok: nat
+    Err: ApproveError
+
+
+class AllowanceArgs(Record):
+    account: Account
+    spender: Account
+
+
+class Allowance(Record):
+    allowance: nat
+    expires_at: Opt[nat64]
+
+
+class AllowanceInfo(Record):
+    spender: Account
+    allowance: nat
+    expires_at: Opt[nat64]
+
+
+class TransferFromArgs(Record):
+    spender_subaccount: Opt[blob]
+    from_: Account
+    to: Account
+    amount: nat
+    fee: Opt[nat]
+    memo: Opt[blob]
+    created_at_time: Opt[nat64]
+
+
+class TransferFromError(Variant, total=False):
+    BadFee: BadFeeError
+    BadBurn: BadBurnError
+    InsufficientFunds: InsufficientFundsError
+    InsufficientAllowance: InsufficientAllowanceError
+    TooOld: null
+    CreatedInFuture: CreatedInFutureError
+    Duplicate: DuplicateError
+    TemporarilyUnavailable: null
+    GenericError: GenericErrorRecord
+
+
+class TransferFromResult(Variant, total=False):
+    Ok: nat
+    Err: TransferFromError
+
+
+@update
+def icrc2_approve(args: ApproveArgs) -> ApproveResult:
+    caller = ic.caller().to_str()
+    from_subaccount = args.get("from_subaccount")
+    spender = args["spender"]["owner"].to_str()
+    spender_subaccount = args["spender"].get("subaccount")
+    now = ic.time()
+
+    if spender == caller:
+        return ApproveResult(
+            Err=ApproveError(
+                GenericError=GenericErrorRecord(
+                    error_code=0, message="Cannot approve an account of the caller"
+                )
+            )
+        )
+    if args.get("fee") is not None and args["fee"] != TOKEN_FEE:
+        return ApproveResult(
+            Err=ApproveError(BadFee=BadFeeError(expected_fee=TOKEN_FEE))
+        )
+    if args.get("expires_at") is not None and args["expires_at"] <= now:
+        return ApproveResult(Err=ApproveError(Expired=ExpiredError(ledger_time=now)))
+    invalid = _unrecordable(
+        args.get("memo"),
+        [args["amount"], args.get("expected_allowance")],
+        [from_subaccount, spender_subaccount],
+    )
+    if invalid:
+        return ApproveResult(
+            Err=ApproveError(
+                GenericError=GenericErrorRecord(error_code=0, message=invalid)
+            )
+        )
+
+    dedup_error, message, fingerprint = DedupIndex.check(
+        args.get("created_at_time"),
+        b"approve",
+        caller.encode(),
+        from_subaccount or b"",
+        spender.encode(),
+        spender_subaccount or b"",
+        str(args["amount"]).encode(),
+        str(args.get("expected_allowance")).encode(),
+        str(args.get("expires_at")).encode(),
+        str(args.get("fee")).encode(),
+        args.get("memo") or b"",
+    )
+    if dedup_error:
+        logger.info(f"Approve from {caller} rejected: {message}")
+        return ApproveResult(Err=ApproveError(**dedup_error))
+
+    balance = TokenHelper.get_balance(caller, from_subaccount)
+    if balance < TOKEN_FEE:
+        return ApproveResult(
+            Err=ApproveError(InsufficientFunds=InsufficientFundsError(balance=balance))
+        )
+
+    owner_key = TokenHelper.get_account_key(caller, from_subaccount)
+    spender_key = TokenHelper.get_account_key(spender, spender_subaccount)
+    if args.get("expected_allowance") is not None:
+        current, _ = AllowanceHelper.get(owner_key, spender_key, now)
+        if current != args["expected_allowance"]:
+            return ApproveResult(
+                Err=ApproveError(
+                    AllowanceChanged=AllowanceChangedError(current_allowance=current)
+                )
+            )
+
+    TokenHelper.set_balance(caller, balance - TOKEN_FEE, from_subaccount)
+    TokenHelper.set_total_supply(TokenHelper.get_total_supply() - TOKEN_FEE)
+    AllowanceHelper.set(owner_key, spender_key, args["amount"], args.get("expires_at"))
+
+    block_index = TransactionHelper.log_transaction(
+        kind="approve",
+        from_owner=caller,
+        from_subaccount=from_subaccount,
+        to_owner="",
+        to_subaccount=None,
+        amount=args["amount"],
+        fee=TOKEN_FEE,
+        memo=args.get("memo"),
+        created_at_time=args.get("created_at_time"),
+        spender_owner=spender,
+        spender_subaccount=spender_subaccount,
+        expires_at=args.get("expires_at"),
+        expected_allowance=args.get("expected_allowance"),
+    )
+    if fingerprint is not None:
+        DedupIndex.record(fingerprint, args["created_at_time"], block_index)
+
+    AllowanceHelper.sweep(now, ALLOWANCE_SWEEP_BATCH)
+    LedgerState.flush()
+
+    logger.info(
+        f"Approved {spender} to spend {args['amount']} from {caller}, block_index={block_index}"
+    )
+    return ApproveResult(Ok=block_index)
+
+
+@query
+def icrc2_allowance(args: AllowanceArgs) -> Allowance:
+    owner_key = TokenHelper.get_account_key(
+        args["account"]["owner"].to_str(), args["account"].get("subaccount")
+    )
+    spender_key = TokenHelper.get_account_key(
+        args["spender"]["owner"].to_str(), args["spender"].get("subaccount")
+    )
+    amount, expires_at = AllowanceHelper.get(owner_key, spender_key, ic.time())
+    return Allowance(allowance=amount, expires_at=expires_at)
+
+
+@query
+def get_allowances(account: Account, start: nat, take: nat) -> Vec[AllowanceInfo]:
+    """
+    Allowances granted by an account, by position in its spender list.
+    Positions shift when allowances are removed, so treat pages as a snapshot.
+    """
+    owner_key = TokenHelper.get_account_key(
+        account["owner"].to_str(), account.get("subaccount")
+    )
+    take = min(take or 100, 100)
+
+    result = []
+    for spender_key, amount, expires_at in AllowanceHelper.list(
+        owner_key, start, take, ic.time()
+    ):
+        owner, sub = spender_key.split(":")
+        result.append(
+            AllowanceInfo(
+                spender=Account(
+                    owner=Principal.from_str(owner),
+                    subaccount=bytes.fromhex(sub) if sub != "default" else None,
+                ),
+                allowance=amount,
+                expires_at=expires_at,
+            )
+        )
+    return result
+
+
+@update
+def icrc2_transfer_from(args: TransferFromArgs) -> TransferFromResult:
+    spender = ic.caller().to_str()
+    spender_subaccount = args.get("spender_subaccount")
+    owner = args["from_"]["owner"].to_str()
+    from_subaccount = args["from_"].get("subaccount")
+    recipient = args["to"]["owner"].to_str()
+    to_subaccount = args["to"].get("subaccount")
+    now = ic.time()
+
+    if args.get("fee") is not None and args["fee"] != TOKEN_FEE:
+        return TransferFromResult(
+            Err=TransferFromError(BadFee=BadFeeError(expected_fee=TOKEN_FEE))
+        )
+    invalid = _unrecordable(
+        args.get("memo"),
+        [args["amount"]],
+        [spender_subaccount, from_subaccount, to_subaccount],
+    )
+    if invalid:
+        return TransferFromResult(
+            Err=TransferFromError(
+                GenericError=GenericErrorRecord(error_code=0, message=invalid)
+            )
+        )
+
+    dedup_error, message, fingerprint = DedupIndex.check(
+        args.get("created_at_time"),
+        b"transfer_from",
+        spender.encode(),
+        spender_subaccount or b"",
+        owner.encode(),
+        from_subaccount or b"",
+        recipient.encode(),
+        to_subaccount or b"",
+        str(args["amount"]).encode(),
+        str(args.get("fee")).encode(),
+        args.get("memo") or b"",
+    )
+    if dedup_error:
+        logger.info(f"transfer_from by {spender} rejected: {message}")
+        return TransferFromResult(Err=TransferFromError(**dedup_error))
+
+    total_deduction = args["amount"] + TOKEN_FEE
+    balances = BalanceBatch()
+    balance = balances.get(owner, from_subaccount)
+    if balance < total_deduction:
+        return TransferFromResult(
+            Err=TransferFromError(
+                InsufficientFunds=InsufficientFundsError(balance=balance)
+            )
+        )
+
+    owner_key = TokenHelper.get_account_key(owner, from_subaccount)
+    spender_key = TokenHelper.get_account_key(spender, spender_subaccount)
+    # Spending from your own account needs no allowance
+    if spender_key != owner_key:
+        allowance, expires_at = AllowanceHelper.get(owner_key, spender_key, now)
+        if allowance < total_deduction:
+            return TransferFromResult(
+                Err=TransferFromError(
+                    InsufficientAllowance=InsufficientAllowanceError(
+                        allowance=allowance
+                    )
+                )
+            )
+        AllowanceHelper.set(
+            owner_key, spender_key, allowance - total_deduction, expires_at
+        )
+
+    balances.set(owner, balance - total_deduction, from_subaccount)
+    balances.set(
+        recipient,
+        balances.get(recipient, to_subaccount) + args["amount"],
+        to_subaccount,
+    )
+    balances.commit()
+    TokenHelper.set_total_supply(TokenHelper.get_total_supply() - TOKEN_FEE)
+
+    block_index = TransactionHelper.log_transaction(
+        kind="transfer",
+        from_owner=owner,
+        from_subaccount=from_subaccount,
+        to_owner=recipient,
+        to_subaccount=to_subaccount,
+        amount=args["amount"],
+        fee=TOKEN_FEE,
+        memo=args.get("memo"),
+        created_at_time=args.get("created_at_time"),
+        spender_owner=spender if spender_key != owner_key else None,
+        spender_subaccount=spender_subaccount,
+    )
+    if fingerprint is not None:
+        DedupIndex.record(fingerprint, args["created_at_time"], block_index)
+
+    AllowanceHelper.sweep(now, ALLOWANCE_SWEEP_BATCH)
+    LedgerState.flush()
+
+    logger.info(
+        f"transfer_from by {spender}: {args['amount']} from {owner} to {recipient}, block_index={block_index}"
     )
+    return TransferFromResult(Ok=block_index)
 
 
 # ============================================================================
@@ -523,11 +2644,22 @@ class IndexerBurn(Record):
     spender: Opt[Spender]
 
 
+class IndexerApprove(Record):
+    fee: Opt[nat]
+    from_: Account
+    memo: Opt[Vec[nat8]]
+    created_at_time: Opt[nat]
+    amount: nat
+    expected_allowance: Opt[nat]
+    expires_at: Opt[nat64]
+    spender: Account
+
+
 class IndexerTransaction(Record):
     burn: Opt[IndexerBurn]
     kind: text
     mint: Opt[IndexerMint]
-    approve: Opt[nat]  # Simplified - not implementing approvals
+    approve: Opt[IndexerApprove]
     timestamp: nat
     transfer: Opt[IndexerTransfer]
 
@@ -547,6 +2679,7 @@ class GetAccountTransactionsResponse(Record):
     balance: nat
     transactions: Vec[AccountTransaction]
     oldest_tx_id: Opt[nat]
+    backfill_pending: bool
 
 
 class GetTransactionsResult(Variant, total=False):
@@ -561,6 +2694,10 @@ def get_account_transactions(
     """
     ICRC-3 compatible method to get transaction history for an account.
     This is the indexer interface that the vault extension expects.
+
+    backfill_pending is true when the account index backfill after an
+    upgrade has not reached some of the blocks below start yet; they are
+    left out of this page and show up once the backfill catches up.
     """
     owner_str = request["account"]["owner"].to_str()
     subaccount = request["account"].get("subaccount")
@@ -590,25 +2727,14 @@ def get_account_transactions(
 
         # Build the transaction record based on kind
         if tx.kind == "transfer":
-            from_subaccount = (
-                bytes.fromhex(tx.from_subaccount) if tx.from_subaccount else None
-            )
-            to_subaccount = (
-                bytes.fromhex(tx.to_subaccount) if tx.to_subaccount else None
-            )
-
             transfer_record = IndexerTransfer(
-                to=Account(
-                    owner=Principal.from_str(tx.to_owner), subaccount=to_subaccount
-                ),
+                to=tx.account("to"),
                 fee=tx.fee if tx.fee else None,
-                from_=Account(
-                    owner=Principal.from_str(tx.from_owner), subaccount=from_subaccount
-                ),
+                from_=tx.account("from"),
                 memo=None,
-                created_at_time=tx.timestamp,
+                created_at_time=tx.created_at_time or tx.timestamp,
                 amount=tx.amount,
-                spender=None,
+                spender=tx.account("spender"),
             )
 
             indexer_tx = IndexerTransaction(
@@ -620,16 +2746,10 @@ def get_account_transactions(
                 transfer=transfer_record,
             )
         elif tx.kind == "mint":
-            to_subaccount = (
-                bytes.fromhex(tx.to_subaccount) if tx.to_subaccount else None
-            )
-
             mint_record = IndexerMint(
-                to=Account(
-                    owner=Principal.from_str(tx.to_owner), subaccount=to_subaccount
-                ),
+                to=tx.account("to"),
                 memo=None,
-                created_at_time=tx.timestamp,
+                created_at_time=tx.created_at_time or tx.timestamp,
                 amount=tx.amount,
             )
 
@@ -641,6 +2761,26 @@ def get_account_transactions(
                 timestamp=tx.timestamp,
                 transfer=None,
             )
+        elif tx.kind == "approve":
+            approve_record = IndexerApprove(
+                fee=tx.fee if tx.fee else None,
+                from_=tx.account("from"),
+                memo=None,
+                created_at_time=tx.created_at_time or tx.timestamp,
+                amount=tx.amount,
+                expected_allowance=tx.expected_allowance,
+                expires_at=tx.expires_at,
+                spender=tx.account("spender"),
+            )
+
+            indexer_tx = IndexerTransaction(
+                burn=None,
+                kind="approve",
+                mint=None,
+                approve=approve_record,
+                timestamp=tx.timestamp,
+                transfer=None,
+            )
         else:
             # Unknown transaction type, skip
             continue
@@ -659,6 +2799,7 @@ def get_account_transactions(
         balance=balance,
         transactions=account_transactions,
         oldest_tx_id=oldest_tx_id,
+        backfill_pending=TransactionHelper.history_incomplete(start),
     )
 
     logger.info(
@@ -704,47 +2845,54 @@ class TransactionDetailResponse(Record):
     memo: text
 
 
-@query
-def get_transactions(page: nat, page_size: nat) -> TransactionListResponse:
-    """Get paginated list of all transactions."""
+class TransactionPageResponse(Record):
+    transactions: Vec[TransactionInfo]
+    total_count: nat
+    next_cursor: Opt[text]
+
+
+def _clamp_page_size(page_size: int) -> int:
     if page_size == 0:
-        page_size = 20
+        return 20
     if page_size > 100:
-        page_size = 100
+        return 100
+    return page_size
 
-    all_txs = list(TransactionLog.instances())
-    all_txs.sort(key=lambda x: x.id, reverse=True)
 
-    total_count = len(all_txs)
-    start_idx = page * page_size
-    end_idx = start_idx + page_size
+def _to_transaction_info(tx: Block) -> TransactionInfo:
+    from_addr = tx.from_owner
+    if tx.from_subaccount:
+        from_addr = f"{from_addr}:{tx.from_subaccount[:8]}"
 
-    page_txs = all_txs[start_idx:end_idx]
+    to_addr = tx.to_owner
+    if tx.to_subaccount:
+        to_addr = f"{to_addr}:{tx.to_subaccount[:8]}"
 
-    transactions = []
-    for tx in page_txs:
-        from_addr = tx.from_owner
-        if tx.from_subaccount:
-            from_addr = f"{from_addr}:{tx.from_subaccount[:8]}"
+    return TransactionInfo(
+        id=tx.id,
+        kind=tx.kind,
+        timestamp=tx.timestamp,
+        from_address=from_addr,
+        to_address=to_addr,
+        amount=tx.amount,
+        fee=tx.fee or 0,
+    )
 
-        to_addr = tx.to_owner
-        if tx.to_subaccount:
-            to_addr = f"{to_addr}:{tx.to_subaccount[:8]}"
 
-        transactions.append(
-            TransactionInfo(
-                id=tx.id,
-                kind=tx.kind,
-                timestamp=tx.timestamp,
-                from_address=from_addr,
-                to_address=to_addr,
-                amount=tx.amount,
-                fee=tx.fee or 0,
-            )
-        )
+@query
+def get_transactions(page: nat, page_size: nat) -> TransactionListResponse:
+    """Get paginated list of all transactions."""
+    page_size = _clamp_page_size(page_size)
+
+    # Block ids are dense, so a page is just a range of ids below the counter
+    total_count = TransactionHelper.get_next_block_index()
+    start_idx = page * page_size
+    end_idx = start_idx + page_size
+
+    page_txs = TransactionHelper.get_block_range(total_count - start_idx, page_size)
 
     return TransactionListResponse(
-        transactions=transactions,
+        transactions=[_to_transaction_info(tx) for tx in page_txs],
         total_count=total_count,
         page=page,
         page_size=page_size,
@@ -752,10 +2900,36 @@ def get_transactions(page: nat, page_size: nat) -> TransactionListResponse:
     )
 
 
+@query
+def get_transactions_page(cursor: Opt[text], page_size: nat) -> TransactionPageResponse:
+    """
+    Cursor-based variant of get_transactions, newest first.
+    Pass back next_cursor to continue; pages stay stable while new blocks are appended.
+    """
+    page_size = _clamp_page_size(page_size)
+    total_count = TransactionHelper.get_next_block_index()
+
+    end = total_count
+    if cursor:
+        try:
+            end = min(int(cursor, 16), total_count)
+        except ValueError:
+            end = 0
+
+    page_txs = TransactionHelper.get_block_range(end, page_size)
+    oldest = max(end - page_size, 0)
+
+    return TransactionPageResponse(
+        transactions=[_to_transaction_info(tx) for tx in page_txs],
+        total_count=total_count,
+        next_cursor=format(oldest, "x") if oldest > 0 else None,
+    )
+
+
 @query
 def get_transaction(tx_id: nat) -> Opt[TransactionDetailResponse]:
     """Get details of a specific transaction by ID."""
-    tx = TransactionLog[tx_id]
+    tx = TransactionHelper.get_block(tx_id)
     if tx is None:
         return None
 
@@ -781,10 +2955,4 @@ def get_top_holders(limit: nat) -> Vec[HolderInfo]:
     if limit > 100:
         limit = 100
 
-    holders = []
-    for balance in TokenBalance.instances():
-        if balance.amount and balance.amount > 0:
-            holders.append(HolderInfo(address=balance.id, balance=balance.amount))
-
-    holders.sort(key=lambda h: h["balance"], reverse=True)
-    return holders[:limit]
+    return HolderHelper.get_holders(limit=limit)
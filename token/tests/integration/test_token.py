@@ -315,6 +315,12 @@ def run_tests():
         "get_transactions has transactions",
     )
 
+    result = dfx_call("get_transactions_page", "(null, 2 : nat)")
+    assert_true(
+        isinstance(result, dict) and len(result.get("transactions", [])) == 2,
+        "get_transactions_page returns a page of transactions",
+    )
+
     result = dfx_call("get_top_holders", "(5 : nat)")
     assert_true(
         isinstance(result, list) or "address" in str(result),